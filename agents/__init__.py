@@ -1,5 +1,5 @@
 from .manager import create_agent_conversation, save_and_get_agent, run_agent, import_agents_from_json
 from .models import Agent
+from .registry import AgentRegistry, registry
 
-__all__ = ["Agent", "create_agent_conversation", "save_and_get_agent", "run_agent", "import_agents_from_json"]
-
+__all__ = ["Agent", "AgentRegistry", "registry", "create_agent_conversation", "save_and_get_agent", "run_agent", "import_agents_from_json"]
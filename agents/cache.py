@@ -0,0 +1,139 @@
+"""Completion cache keyed on the full prompt.
+
+Identical requests (same backend, model, generation params and message list)
+are answered from an in-memory LRU, then from the completion_cache table,
+before any network call is made. Enabled with AI_STORY_CACHE=1; entries
+expire after AI_STORY_CACHE_TTL seconds and both tiers are size-bounded.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from db import read_connection, write_connection
+
+CACHE_ENABLED = os.environ.get("AI_STORY_CACHE", "0").lower() in ("1", "true", "yes")
+CACHE_TTL = float(os.environ.get("AI_STORY_CACHE_TTL", str(24 * 60 * 60)))
+CACHE_MEMORY_SIZE = int(os.environ.get("AI_STORY_CACHE_MEMORY_SIZE", "512"))
+CACHE_MAX_ROWS = int(os.environ.get("AI_STORY_CACHE_MAX_ROWS", "50000"))
+
+
+def cache_key(api: str, model: str, params: dict, messages: list) -> str:
+    """Stable hash of everything that determines a completion."""
+    payload = json.dumps(
+        [api, model, params, messages], sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Two-tier (memory LRU + SQLite) cache of raw completion text."""
+
+    # Prune the SQLite tier once every this many writes
+    PRUNE_EVERY = 100
+
+    def __init__(
+        self,
+        enabled: bool = CACHE_ENABLED,
+        ttl: float = CACHE_TTL,
+        memory_size: int = CACHE_MEMORY_SIZE,
+        max_rows: int = CACHE_MAX_ROWS,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created_at = entry
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return response
+                del self._memory[key]
+
+        with read_connection() as con:
+            row = con.execute(
+                "SELECT response, created_at FROM completion_cache "
+                "WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.db_hits += 1
+            self._remember(key, row[0], row[1])
+        return row[0]
+
+    def put(self, key: str, response: str):
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, response, created_at)
+            self._writes += 1
+            prune = self._writes % self.PRUNE_EVERY == 0
+
+        with write_connection() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO completion_cache (key, response, created_at) "
+                "VALUES (?, ?, ?)",
+                (key, response, created_at),
+            )
+            if prune:
+                self._prune(con, created_at)
+
+    def _remember(self, key: str, response: str, created_at: float):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _prune(self, con, now: float):
+        """Drop expired rows, then the oldest rows beyond max_rows."""
+        con.execute(
+            "DELETE FROM completion_cache WHERE created_at <= ?", (now - self.ttl,)
+        )
+        con.execute(
+            """
+            DELETE FROM completion_cache WHERE key IN (
+                SELECT key FROM completion_cache
+                ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_rows,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        with write_connection() as con:
+            con.execute("DELETE FROM completion_cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+            }
+
+
+completion_cache = CompletionCache()
@@ -0,0 +1,225 @@
+"""Rolling summary compaction of long agent histories.
+
+Once an agent has more than AI_STORY_COMPACT_AFTER messages in a session that
+are not yet covered by a summary, the older ones (all but the newest
+AI_STORY_COMPACT_KEEP) are folded into a new rolling summary in the
+background and stored in memory_summaries. Prompt assembly then sends that
+summary plus the recent tail, trimmed to AI_STORY_MEMORY_TOKENS (or less when
+the model's context budget is smaller), instead of an ever longer raw history. Messages are never deleted by compaction.
+
+With AI_STORY_MEMORY_MODE=retrieval the tail is shortened and preceded by the
+past messages that best match the incoming event (BM25 over messages_fts).
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from db import read_connection, write_connection
+from telemetry import to_thread
+
+from .context_cache import context_cache
+from .models import Agent
+from .tokens import MESSAGE_TOKENS, count_tokens
+
+COMPACT_AFTER = int(os.environ.get("AI_STORY_COMPACT_AFTER", "40"))
+KEEP_RECENT = int(os.environ.get("AI_STORY_COMPACT_KEEP", "20"))
+MEMORY_TOKENS = int(os.environ.get("AI_STORY_MEMORY_TOKENS", "1500"))
+# "recency" sends the newest messages, "retrieval" the ones relevant to the
+# incoming event (full-text search) plus a short recency tail
+MEMORY_MODE = os.environ.get("AI_STORY_MEMORY_MODE", "recency")
+RETRIEVAL_K = int(os.environ.get("AI_STORY_RETRIEVAL_K", "5"))
+RETRIEVAL_RECENT = int(os.environ.get("AI_STORY_RETRIEVAL_RECENT", "4"))
+SUMMARY_MAX_TOKENS = 300
+# Upper bound on messages folded in by one run, so a huge backlog is
+# summarized over several runs instead of in one oversized prompt
+MAX_BATCH = 200
+
+# summarize(previous_summary, messages) -> new summary
+Summarizer = Callable[[Optional[str], List[str]], Awaitable[str]]
+
+
+def load_context_memory(
+    agent: Agent,
+    cursor,
+    event: Optional[str] = None,
+    limit: Optional[int] = None,
+    budget: int = MEMORY_TOKENS,
+    session_id: Optional[int] = None,
+    tokenizer: Optional[str] = None,
+) -> Tuple[Optional[str], List[str]]:
+    """Return (summary, memory messages) to put in an agent's prompt.
+
+    Only the given session (None is the default session) is read, so stories
+    do not bleed into each other.
+
+    In "recency" mode the memory is the newest messages not yet covered by
+    the summary. In "retrieval" mode it is a short recency tail preceded by
+    the past messages most relevant to the event. Messages are added newest
+    (or most relevant) first until the token budget, which the summary also
+    counts against, is used up. A summary larger than the whole budget is
+    left out. Tokens are counted with tokenizer; counts stored with the
+    messages are reused when they were made with it.
+    """
+    row = agent.load_summary(cursor, session_id)
+    summary, after_id = row if row else (None, 0)
+    if summary:
+        summary_tokens = count_tokens(summary, tokenizer)
+        if summary_tokens > budget:
+            summary = None
+        else:
+            budget -= summary_tokens
+
+    retrieval = MEMORY_MODE == "retrieval" and bool(event)
+    if limit is None:
+        limit = RETRIEVAL_RECENT if retrieval else KEEP_RECENT
+
+    recent = agent.load_memory(
+        cursor,
+        limit=limit,
+        after_id=after_id,
+        session_id=session_id,
+        with_tokens=True,
+        tokenizer=tokenizer,
+    )
+    kept: List[str] = []
+    for content, tokens in reversed(recent):
+        budget -= tokens + MESSAGE_TOKENS
+        if budget < 0 and kept:
+            return summary, kept[::-1]
+        kept.append(content)
+    kept.reverse()
+    if not retrieval:
+        return summary, kept
+
+    seen = set(kept)
+    relevant: List[Tuple[int, str]] = []
+    for message_id, content, tokens in agent.search_memory(
+        cursor, event, RETRIEVAL_K, session_id, tokenizer
+    ):
+        if content in seen:
+            continue
+        budget -= tokens + MESSAGE_TOKENS
+        if budget < 0:
+            break
+        seen.add(content)
+        relevant.append((message_id, content))
+    # Recalled messages go before the tail, in the order they were said
+    return summary, [content for _, content in sorted(relevant)] + kept
+
+
+def build_summary_prompt(previous: Optional[str], messages: List[str]) -> List[dict]:
+    """Messages asking a backend to fold new lines into the running summary."""
+    lines = "\n".join(f"- {m}" for m in messages)
+    content = (
+        (f"Summary so far: {previous}\n\n" if previous else "")
+        + f"New lines:\n{lines}\n\n"
+        + "Write an updated summary of the story from this character's view. "
+        "Keep names, places, promises and open plot threads. "
+        "Use at most 150 words and plain prose."
+    )
+    return [
+        {
+            "role": "system",
+            "content": "You compress story transcripts into short summaries.",
+        },
+        {"role": "user", "content": content},
+    ]
+
+
+class Compactor:
+    """Schedules at most one background compaction per (agent, session)."""
+
+    def __init__(
+        self,
+        threshold: int = COMPACT_AFTER,
+        keep_recent: int = KEEP_RECENT,
+        max_batch: int = MAX_BATCH,
+    ):
+        self.enabled = threshold > 0
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self.max_batch = max_batch
+        self._tasks: Dict[Tuple[int, Optional[int]], asyncio.Task] = {}
+        self.runs = 0
+        self.failures = 0
+
+    def maybe_schedule(
+        self, agent: Agent, summarize: Summarizer, session_id: Optional[int] = None
+    ):
+        """Start a compaction for the agent's session unless one is running."""
+        key = (agent.id, session_id)
+        if not self.enabled or key in self._tasks:
+            return
+        task = asyncio.create_task(self._compact(agent, summarize, session_id))
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+    def _pending(
+        self, agent: Agent, session_id: Optional[int]
+    ) -> Tuple[Optional[str], List[Tuple[int, str]]]:
+        """Previous summary and the messages a run should fold into it."""
+        with read_connection() as con:
+            cur = con.cursor()
+            row = agent.load_summary(cur, session_id)
+            summary, after_id = row if row else (None, 0)
+            cur.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id IS ? "
+                "AND agent_id = ? AND role = 'assistant' AND id > ?",
+                (session_id, agent.id, after_id),
+            )
+            unsummarized = cur.fetchone()[0]
+            if unsummarized <= self.threshold:
+                return summary, []
+            cur.execute(
+                "SELECT id, content FROM messages WHERE session_id IS ? "
+                "AND agent_id = ? AND role = 'assistant' AND id > ? "
+                "ORDER BY created_at ASC, id ASC LIMIT ?",
+                (
+                    session_id,
+                    agent.id,
+                    after_id,
+                    min(unsummarized - self.keep_recent, self.max_batch),
+                ),
+            )
+            return summary, cur.fetchall()
+
+    async def _compact(
+        self, agent: Agent, summarize: Summarizer, session_id: Optional[int]
+    ):
+        try:
+            summary, rows = await to_thread(self._pending, agent, session_id)
+            if not rows:
+                return
+            new_summary = await summarize(summary, [content for _, content in rows])
+            if not new_summary.strip():
+                return
+            await to_thread(
+                self._save, agent, session_id, new_summary, rows[-1][0]
+            )
+            self.runs += 1
+        except Exception as e:
+            # A failed compaction only means the prompt stays longer for now
+            self.failures += 1
+            print(f"Memory compaction failed for {agent.name}: {e}")
+
+    @staticmethod
+    def _save(agent: Agent, session_id: Optional[int], summary: str, up_to_id: int):
+        with write_connection() as con:
+            con.execute(
+                "INSERT INTO memory_summaries "
+                "(agent_id, session_id, summary, up_to_message_id) VALUES (?, ?, ?, ?)",
+                (agent.id, session_id, summary, up_to_id),
+            )
+        context_cache.set_summary((agent.id, session_id), summary, up_to_id)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": len(self._tasks),
+            "runs": self.runs,
+            "failures": self.failures,
+        }
+
+
+compactor = Compactor()
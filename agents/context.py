@@ -0,0 +1,161 @@
+"""Token-budgeted prompt assembly shared by the CLI and the API.
+
+build_context() lays out one agent turn as a system prompt (persona and
+instructions, the roster, the rolling summary), the recent memories and the
+incoming event. Persona, instructions and the event are always sent; the
+roster, then the summary and the memories are added while they fit the
+model's input budget. Budgets come from AI_STORY_CONTEXT_TOKENS, e.g.
+"ollama=4096,openai=16384,ollama/llama3:70b=8192", keyed by backend or
+backend/model like AI_STORY_CONCURRENCY.
+
+generation_params() turns an agent's generation profile (max_tokens,
+temperature, stop) into backend parameters. Without a max_tokens in the
+profile the backend/model's limit from AI_STORY_MAX_TOKENS applies, in the
+same "backend=N,backend/model=N" form (a bare number applies to every
+backend, 0 removes a limit). OpenAI and GitHub Models default to 4000
+tokens; Ollama has no limit by default, so reasoning models are not cut off
+inside their <think> block.
+"""
+
+import os
+from typing import Dict, List, Optional
+
+from .compaction import MEMORY_TOKENS, load_context_memory
+from .models import Agent
+from .roster import roster_cache
+from .tokens import MESSAGE_TOKENS, count_tokens
+
+DEFAULT_BUDGETS = {"ollama": 4096, "openai": 16384, "github": 8192}
+DEFAULT_MAX_TOKENS = {"ollama": 0, "openai": 4000, "github": 4000}
+PROFILE_KEYS = ("max_tokens", "temperature", "stop")
+
+INSTRUCTIONS = (
+    "Speak only as yourself. Never speak for other characters. "
+    "Stay fully in character and never copy others' speech patterns."
+    "Avoid filler or flowery language. "
+    "Do not include the other characters' lines in your response. "
+    "Avoid em dashes — and asteriks * use simple punctuation."
+    "Be yourself, but don't cling too much to your persona"
+    "Try to make it an intresting story create new events if fitting"
+    "Use max 20 words."
+)
+
+
+def parse_budgets(spec: str) -> Dict[str, int]:
+    """Parse "backend=N,backend/model=N" into an input budgets dict."""
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        key, value = item.rsplit("=", 1)
+        budgets[key.strip()] = int(value)
+    return budgets
+
+
+def parse_max_tokens(spec: str) -> Dict[str, int]:
+    """Parse "backend=N,backend/model=N" (or one bare N for every backend)
+    into an output limits dict; 0 means no limit."""
+    limits = dict(DEFAULT_MAX_TOKENS)
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if "=" not in item:
+            limits = {key: int(item) for key in limits}
+            continue
+        key, value = item.rsplit("=", 1)
+        limits[key.strip()] = int(value)
+    return limits
+
+
+BUDGETS = parse_budgets(os.environ.get("AI_STORY_CONTEXT_TOKENS", ""))
+MAX_TOKENS = parse_max_tokens(os.environ.get("AI_STORY_MAX_TOKENS", ""))
+
+
+def input_budget(api: str, model: Optional[str] = None) -> int:
+    """Prompt tokens allowed for a backend/model, the backend's if not set."""
+    if model and f"{api}/{model}" in BUDGETS:
+        return BUDGETS[f"{api}/{model}"]
+    return BUDGETS.get(api, min(DEFAULT_BUDGETS.values()))
+
+
+def output_limit(api: Optional[str], model: Optional[str] = None) -> Optional[int]:
+    """Reply token limit for a backend/model, None for no limit."""
+    if model and f"{api}/{model}" in MAX_TOKENS:
+        limit = MAX_TOKENS[f"{api}/{model}"]
+    else:
+        limit = MAX_TOKENS.get(api or "", 0)
+    return limit or None
+
+
+def generation_params(
+    agent: Agent, api: Optional[str] = None, model: Optional[str] = None
+) -> dict:
+    """Backend parameters from the agent's generation profile, on top of the
+    backend/model's output limit (none when api is not given)."""
+    params = {}
+    limit = output_limit(api, model)
+    if limit is not None:
+        params["max_tokens"] = limit
+    profile = agent.generation or {}
+    params.update((key, profile[key]) for key in PROFILE_KEYS if key in profile)
+    if isinstance(params.get("stop"), str):
+        params["stop"] = [params["stop"]]
+    return params
+
+
+def build_context(
+    agent: Agent,
+    event: str,
+    cursor,
+    all_agents: List[Agent],
+    session_id: Optional[int] = None,
+    budget: Optional[int] = None,
+    tokenizer: Optional[str] = None,
+) -> List[dict]:
+    """Build the message list sent to the backend for one agent turn, counting
+    tokens with the backend's tokenizer (see agents.tokens.tokenizer_for)."""
+    if budget is None:
+        budget = min(DEFAULT_BUDGETS.values())
+    persona = f"You are {agent.name}, defined as: {agent.persona}. "
+    used = (
+        count_tokens(persona, tokenizer)
+        + count_tokens(INSTRUCTIONS, tokenizer)
+        + count_tokens(event, tokenizer)
+    )
+    used += 2 * MESSAGE_TOKENS
+
+    # Short, cached blurbs of the other agents; the same text every turn so
+    # the backend can reuse its cached prompt prefix
+    others_info = roster_cache.roster(agent, all_agents)
+    roster = f"You know the others: {others_info}. " if others_info else ""
+    if roster:
+        if used + count_tokens(roster, tokenizer) > budget:
+            roster = ""
+        else:
+            used += count_tokens(roster, tokenizer)
+
+    # The rolling summary plus the recent (or relevant) messages of this
+    # session that fit in what is left
+    summary, recent_memory = None, []
+    memory_budget = min(MEMORY_TOKENS, budget - used)
+    if memory_budget > 0:
+        summary, recent_memory = load_context_memory(
+            agent,
+            cursor,
+            event,
+            budget=memory_budget,
+            session_id=session_id,
+            tokenizer=tokenizer,
+        )
+
+    system_prompt = (
+        persona
+        + roster
+        + INSTRUCTIONS
+        + (f" Your memory of the story so far: {summary}" if summary else "")
+    )
+    history = [{"role": "system", "content": system_prompt}]
+    history.extend({"role": "assistant", "content": msg} for msg in recent_memory)
+    history.append({"role": "user", "content": event})
+    return history
@@ -0,0 +1,289 @@
+"""Write-through cache of the recent context of each (agent, session).
+
+Agent.add_memory appends every message this process writes to a bounded ring
+buffer of the newest AI_STORY_CONTEXT_CACHE_SIZE assistant messages of that
+agent and session, and the rolling summary is kept next to it. The next
+turn's Agent.load_memory / load_summary are then answered from memory
+without SQL; a buffer is filled from the database once, on its first miss.
+
+Writes that bypass add_memory (broadcast batches, imports, purges,
+retention) drop the affected buffers through db.on_messages_changed. The
+cache assumes this process is the only writer of the database; disable it
+with AI_STORY_CONTEXT_CACHE=0 when several processes share one file. Buffers
+of idle agents are evicted least recently used first once the cached text
+exceeds AI_STORY_CONTEXT_CACHE_MB.
+"""
+
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from db import on_messages_changed
+
+from .tokens import stored_count
+
+CONTEXT_CACHE_ENABLED = os.environ.get("AI_STORY_CONTEXT_CACHE", "1").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+CONTEXT_CACHE_SIZE = int(os.environ.get("AI_STORY_CONTEXT_CACHE_SIZE", "32"))
+CONTEXT_CACHE_MB = float(os.environ.get("AI_STORY_CONTEXT_CACHE_MB", "64"))
+
+Key = Tuple[int, Optional[int]]
+# (message id, content, stored token count or None, its tokenizer or None)
+Row = Tuple[int, str, Optional[int], Optional[str]]
+
+
+class ContextRecord:
+    """One cached message; id is None until the write-behind journal inserts
+    it, and such a message is newer than every stored one."""
+
+    __slots__ = ("id", "content", "tokens", "tokenizer")
+
+    def __init__(
+        self,
+        id: Optional[int],
+        content: str,
+        tokens: Optional[int],
+        tokenizer: Optional[str],
+    ):
+        self.id = id
+        self.content = content
+        self.tokens = tokens
+        self.tokenizer = tokenizer
+
+
+class ContextBuffer:
+    """Newest messages of one (agent, session), oldest first."""
+
+    __slots__ = ("records", "complete", "summary", "size")
+
+    def __init__(self, capacity: int, rows: List[Row], complete: bool):
+        # Missing counts, or counts of another tokenizer, are made on read
+        self.records: "deque[ContextRecord]" = deque(
+            (ContextRecord(*row) for row in rows), maxlen=capacity
+        )
+        # True while the buffer holds every message of the session
+        self.complete = complete
+        # (summary, up_to_message_id), None if nothing was compacted, or
+        # False until loaded
+        self.summary = False
+        self.size = sum(len(row[1]) for row in rows)
+
+    def push(self, record: ContextRecord) -> int:
+        """Append a newer message, dropping the oldest when full; returns the
+        change in cached text size."""
+        change = len(record.content)
+        if len(self.records) == self.records.maxlen:
+            change -= len(self.records[0].content)
+            self.complete = False
+        self.records.append(record)
+        self.size += change
+        return change
+
+
+class ContextCache:
+    """LRU of ContextBuffers, bounded by the total cached text."""
+
+    def __init__(
+        self,
+        enabled: bool = CONTEXT_CACHE_ENABLED,
+        capacity: int = CONTEXT_CACHE_SIZE,
+        max_bytes: int = int(CONTEXT_CACHE_MB * 1024 * 1024),
+    ):
+        self.enabled = enabled
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._buffers: "OrderedDict[Key, ContextBuffer]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        # Fills in progress: key -> [writes seen meanwhile, running fills]
+        self._fills: Dict[Key, List[int]] = {}
+        # Write-behind messages of sessions without a buffer, see append()
+        self._queued: "Dict[Key, deque[ContextRecord]]" = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def recent(
+        self,
+        key: Key,
+        limit: int,
+        after_id: int,
+        load: Callable[[int], List[Row]],
+        tokenizer: str,
+    ) -> Optional[List[Tuple[str, int]]]:
+        """The newest `limit` messages with an id above after_id, oldest first,
+        as (content, token count) pairs counted with tokenizer.
+
+        load(n) must return the newest n (id, content, token_count, tokenizer)
+        rows from the database, oldest first; it is called once to fill a missing
+        buffer. Returns None when the request cannot be answered from the
+        buffer (cache disabled, limit above its capacity or older messages
+        needed), so the caller falls back to SQL.
+        """
+        if not self.enabled or limit > self.capacity:
+            return None
+        buffer = self._buffer(key, load)
+        with self._lock:
+            records = list(buffer.records)
+            complete = buffer.complete
+        kept = [r for r in records if r.id is None or r.id > after_id]
+        # Enough rows, or all rows (the session is shorter than the buffer,
+        # or older rows fall below after_id anyway)
+        if len(kept) >= limit or complete or len(kept) < len(records):
+            self.hits += 1
+            return [
+                (r.content, stored_count(r.content, r.tokens, r.tokenizer, tokenizer))
+                for r in (kept[-limit:] if limit > 0 else [])
+            ]
+        self.misses += 1
+        return None
+
+    def summary(
+        self,
+        key: Key,
+        load_rows: Callable[[int], List[Row]],
+        load: Callable[[], Optional[Tuple[str, int]]],
+    ) -> Optional[Tuple[str, int]]:
+        """The rolling summary, read with load() once per buffer.
+
+        The buffer is filled with load_rows like in recent(), so the memory
+        read that follows the summary in a turn is served from it too.
+        """
+        if not self.enabled:
+            return load()
+        buffer = self._buffer(key, load_rows)
+        with self._lock:
+            summary = buffer.summary
+        if summary is not False:
+            self.hits += 1
+            return summary
+        summary = load()
+        self.misses += 1
+        with self._lock:
+            # set_summary may have stored a newer one meanwhile
+            if buffer.summary is False:
+                buffer.summary = summary
+        return summary
+
+    def append(self, key: Key, record: ContextRecord, queued: bool = False):
+        """Write-through of a message just committed for the agent's session.
+
+        queued marks a message only queued on the write-behind journal: when
+        the session has no buffer yet it is remembered, and merged into the
+        buffer filled next unless the rows read already hold it.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._touch(key)
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                if queued:
+                    self._queued.setdefault(key, deque(maxlen=self.capacity)).append(
+                        record
+                    )
+                # Otherwise filled from the database on the next read
+                return
+            self._size += buffer.push(record)
+            self._buffers.move_to_end(key)
+            self._evict()
+
+    def set_summary(self, key: Key, summary: str, up_to_id: int):
+        """Write-through of a new rolling summary."""
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is not None:
+                buffer.summary = (summary, up_to_id)
+
+    def invalidate(self, agent_id: Optional[int] = None):
+        """Drop the buffers of one agent, or all of them for None."""
+        with self._lock:
+            for key in self._fills:
+                if agent_id is None or key[0] == agent_id:
+                    self._touch(key)
+            for key in list(self._queued):
+                if agent_id is None or key[0] == agent_id:
+                    del self._queued[key]
+            if agent_id is None:
+                self._buffers.clear()
+                self._size = 0
+                return
+            for key in [key for key in self._buffers if key[0] == agent_id]:
+                self._size -= self._buffers.pop(key).size
+
+    def _buffer(self, key: Key, load: Callable[[int], List[Row]]) -> ContextBuffer:
+        """The buffer for key, filled from the database when missing."""
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is not None:
+                self._buffers.move_to_end(key)
+                return buffer
+            fill = self._fills.setdefault(key, [0, 0])
+            fill[1] += 1
+            seen = fill[0]
+        try:
+            rows = load(self.capacity)
+            buffer = ContextBuffer(self.capacity, rows, len(rows) < self.capacity)
+        except BaseException:
+            with self._lock:
+                self._end_fill(key, fill)
+            raise
+        with self._lock:
+            self._end_fill(key, fill)
+            raced = fill[0] != seen
+            existing = self._buffers.get(key)
+            if existing is not None:
+                # Filled concurrently by another thread
+                return existing
+            # Queued messages the journal had not committed when read
+            newest = rows[-1][0] if rows else 0
+            for record in self._queued.get(key, ()):
+                if record.id is None or record.id > newest:
+                    buffer.push(record)
+            if raced:
+                # A message was written or dropped while the rows were read,
+                # so they may miss it; answer this read only and refill later
+                return buffer
+            self._queued.pop(key, None)
+            self._buffers[key] = buffer
+            self._size += buffer.size
+            self._evict()
+        return buffer
+
+    def _end_fill(self, key: Key, fill: List[int]):
+        # Called with the lock held
+        fill[1] -= 1
+        if fill[1] == 0:
+            del self._fills[key]
+
+    def _touch(self, key: Key):
+        # Called with the lock held; a fill of key in progress goes stale
+        fill = self._fills.get(key)
+        if fill is not None:
+            fill[0] += 1
+
+    def _evict(self):
+        # Called with the lock held; keeps the most recently used buffer
+        while self._size > self.max_bytes and len(self._buffers) > 1:
+            _, buffer = self._buffers.popitem(last=False)
+            self._size -= buffer.size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "buffers": len(self._buffers),
+            "bytes": self._size,
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+context_cache = ContextCache()
+on_messages_changed(context_cache.invalidate)
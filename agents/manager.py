@@ -1,19 +1,19 @@
+import hashlib
 import json
 import os
 import re
-from typing import List, Union
+from typing import List, Optional
 
-import ollama
-from openai import OpenAI
-from openai.types.chat import (
-    ChatCompletionAssistantMessageParam,
-    ChatCompletionSystemMessageParam,
-    ChatCompletionUserMessageParam,
-)
-
-from db import load_agent, save_agent
+from db import get_meta, save_agent, save_agents, set_meta
+from telemetry import span
 
+from .context import build_context, generation_params, input_budget
 from .models import Agent
+from .providers import get_provider
+from .registry import registry
+from .tokens import tokenizer_for
+
+AGENTS_FILE_HASH_KEY = "agents_json_sha256"
 
 
 def run_agent(
@@ -21,67 +21,43 @@ def run_agent(
 ) -> str:
     """Send an event to the agent and get a reply using their persona."""
 
-    # Load the agent's memory from database
-    memory = agent.load_memory(cursor)
-
-    system_prompt = f"You are {agent.name}, defined as: {agent.persona}. " + (
-        "Speak only as yourself. Never speak for other characters. "
-        "Do not include the other characters' lines in your response. "
-        "Avoid em dashes — and asteriks * use simple punctuation."
-        "Only give one reply, keep it short"
-    )
-
-    system_message: ChatCompletionSystemMessageParam = {
-        "role": "system",
-        "content": system_prompt,
-    }
-    history: List[
-        Union[
-            ChatCompletionSystemMessageParam,
-            ChatCompletionUserMessageParam,
-            ChatCompletionAssistantMessageParam,
-        ]
-    ] = [system_message]
-
-    # Add recent memory for context (last 20 messages)
-    recent_memory = memory[-20:] if len(memory) > 20 else memory
-    for msg in recent_memory:
-        assistant_message: ChatCompletionAssistantMessageParam = {
-            "role": "assistant",
-            "content": msg,
-        }
-        history.append(assistant_message)
-
-    # Add the current event/prompt
-    user_message: ChatCompletionUserMessageParam = {"role": "user", "content": event}
-    history.append(user_message)
-
     try:
         if api == "ollama":
-            response = ollama.chat(model="mythomax:latest", messages=history)
-            content = response.get("message", {}).get("content", "")
-            raw_reply = content if isinstance(content, str) else ""
+            provider = get_provider("ollama")
+            model, params = "mythomax:latest", {}
         elif api == "openai":
             # TODO differentiate between github and openai token
-            client = OpenAI(
-                base_url="https://models.github.ai/inference",
-                api_key=os.environ.get("GITHUB_TOKEN"),
-            )
-            if not client.api_key:
+            api_key = os.environ.get("GITHUB_TOKEN")
+            if not api_key:
                 raise ValueError("OPENAI_API_KEY environment variable not set")
-            response = client.chat.completions.create(
-                messages=history,
-                temperature=0.7,
-                max_tokens=4000,
-                model="openai/gpt-4o-mini",
+            provider = get_provider(
+                "openai", "https://models.github.ai/inference", api_key
             )
-            content = response.choices[0].message.content
-            raw_reply = content if content is not None else ""
+            model, params = "openai/gpt-4o-mini", {"temperature": 0.7}
         else:
             raise ValueError(f"Unsupported API: {api}")
 
-        reply = clean_reply(raw_reply)
-        agent.add_memory(cursor, reply, role="assistant")
+        # Persona, roster, rolling summary and the recent (or relevant)
+        # messages that fit the model's input budget
+        tokenizer = tokenizer_for(api, model)
+        with span("memory"):
+            history = build_context(
+                agent,
+                event,
+                cursor,
+                all_agents,
+                budget=input_budget(api, model),
+                tokenizer=tokenizer,
+            )
+        with span("llm"):
+            raw_reply = provider.complete_sync(
+                model, history, **{**params, **generation_params(agent, api, model)}
+            )
+
+        with span("clean"):
+            reply = clean_reply(raw_reply)
+        with span("save"):
+            agent.add_memory(cursor, reply, role="assistant", tokenizer=tokenizer)
         return reply
     except Exception as e:
         error_msg = (
@@ -124,18 +100,120 @@ def create_agent_conversation(
 
 
 def clean_reply(raw_reply: str) -> str:
-    """Remove <think> tags and strip surrounding double quotes."""
-    cleaned = re.sub(r"<think>.*?</think>", "", raw_reply, flags=re.DOTALL).strip()
+    """Remove <think> blocks and strip surrounding double quotes.
+
+    A block left open (the reply hit its token limit while thinking) is
+    removed up to the end of the reply.
+    """
+    cleaned = re.sub(r"<think>.*?(</think>|\Z)", "", raw_reply, flags=re.DOTALL).strip()
     if cleaned.startswith('"') and cleaned.endswith('"'):
         cleaned = cleaned[1:-1].strip()
     return cleaned
 
 
+class StreamCleaner:
+    """Incremental counterpart of clean_reply for streamed replies.
+
+    Feed raw chunks as they arrive and get back the text that is safe to show,
+    then call finish() for the rest. <think> blocks are dropped mid-stream,
+    leading whitespace is skipped and trailing whitespace or a quote is held
+    back until more text follows. Like clean_reply, quotes are only stripped
+    as a pair around the whole reply, so a reply opening with a quote is held
+    back until the end, when it is known whether it closes with one too. The
+    authoritative reply is still clean_reply() on the full text.
+    """
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self._pending = ""
+        self._in_think = False
+        self._started = False
+        # Text of a reply opening with a quote, None for any other reply
+        self._quoted: Optional[str] = None
+        self._held = ""
+
+    def feed(self, chunk: str) -> str:
+        self._pending += chunk
+        visible = []
+
+        while self._pending:
+            if self._in_think:
+                end = self._pending.find(self.CLOSE_TAG)
+                if end == -1:
+                    # Keep just enough to recognise a split closing tag
+                    self._pending = self._pending[-(len(self.CLOSE_TAG) - 1) :]
+                    break
+                self._pending = self._pending[end + len(self.CLOSE_TAG) :]
+                self._in_think = False
+            else:
+                start = self._pending.find(self.OPEN_TAG)
+                if start != -1:
+                    visible.append(self._pending[:start])
+                    self._pending = self._pending[start + len(self.OPEN_TAG) :]
+                    self._in_think = True
+                    continue
+                keep = _partial_suffix(self._pending, self.OPEN_TAG)
+                visible.append(self._pending[: len(self._pending) - keep])
+                self._pending = self._pending[len(self._pending) - keep :]
+                break
+
+        return self._emit("".join(visible))
+
+    def finish(self) -> str:
+        """End the stream and return the rest of the visible text: a held
+        closing quote, or a reply held back because it opened with a quote."""
+        # A partial <think> tag that never completed is plain text
+        tail = "" if self._in_think else self._pending
+        self._pending = ""
+        self._in_think = False
+        if self._quoted is not None:
+            text = (self._quoted + tail).strip()
+            self._quoted = None
+            if text.startswith('"') and text.endswith('"'):
+                return text[1:-1].strip()
+            return text
+        held, self._held = self._held, ""
+        if not self._started:
+            tail = tail.lstrip()
+        return (held + tail).rstrip()
+
+    def _emit(self, text: str) -> str:
+        if self._quoted is not None:
+            self._quoted += text
+            return ""
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+            if text.startswith('"'):
+                self._quoted = text
+                return ""
+
+        text = self._held + text
+        body = _TRAILING_HOLD.sub("", text)
+        self._held = text[len(body) :]
+        return body
+
+
+_TRAILING_HOLD = re.compile(r'\s*"?\s*$')
+
+
+def _partial_suffix(text: str, tag: str) -> int:
+    """Length of the longest suffix of text that is a proper prefix of tag."""
+    for size in range(min(len(text), len(tag) - 1), 0, -1):
+        if tag.startswith(text[-size:]):
+            return size
+    return 0
+
+
 def get_agent(name: str) -> Agent:
-    data = load_agent(name)
-    if data is None:
+    agent = registry.get(name)
+    if agent is None:
         raise ValueError(f"Agent {name} not found")
-    return Agent(**data)
+    return agent
 
 
 def save_and_get_agent(name: str, persona: str) -> Agent:
@@ -143,10 +221,26 @@ def save_and_get_agent(name: str, persona: str) -> Agent:
     return get_agent(name)
 
 
-def import_agents_from_json() -> List[Agent]:
-    with open("agents.json", "r", encoding="utf-8") as f:
-        agents_data = json.load(f)
-    agents = [
-        save_and_get_agent(agent["name"], agent["persona"]) for agent in agents_data
-    ]
-    return agents
+def import_agents_from_json(
+    path: str = "agents.json", force: bool = False
+) -> List[Agent]:
+    """Sync agents from a JSON roster in one transaction.
+
+    Unchanged agents are skipped by content hash and changed personas are
+    updated. When the file itself is unchanged since the last import it is
+    not even parsed, unless force is set.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    file_hash = hashlib.sha256(raw).hexdigest()
+    if not force and get_meta(AGENTS_FILE_HASH_KEY) == file_hash:
+        return registry.all()
+
+    agents_data = json.loads(raw)
+    save_agents(
+        (agent["name"], agent["persona"], agent.get("generation"))
+        for agent in agents_data
+    )
+    set_meta(AGENTS_FILE_HASH_KEY, file_hash)
+    agents = [registry.get(agent["name"]) for agent in agents_data]
+    return [agent for agent in agents if agent is not None]
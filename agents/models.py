@@ -1,24 +1,152 @@
+import re
 from dataclasses import dataclass
-from typing import List, Tuple, Dict
+from typing import List, Optional, Tuple, Dict, Union
+
+from db.journal import journal
+from telemetry import traced
+
+from .context_cache import ContextRecord, context_cache
+from .tokens import count_tokens, stored_count, tokenizer_for
+
+# Words too common to say anything about relevance
+_STOPWORDS = frozenset(
+    "the and for are but not you your with this that was were have has had "
+    "what when where who why how all any can did does its our out she him her "
+    "they them then than there their from into about just some".split()
+)
+
+
+def fts_query(text: str, max_terms: int = 16, operator: str = "OR") -> Optional[str]:
+    """Turn free text into an FTS5 query joining its distinct words with
+    operator (OR for recall, AND for search), quoted so punctuation and FTS
+    operators in the text cannot break the query."""
+    terms = []
+    for word in re.findall(r"\w+", text.lower()):
+        if len(word) > 2 and word not in _STOPWORDS and word not in terms:
+            terms.append(word)
+    if not terms:
+        return None
+    return f" {operator} ".join(f'"{t}"' for t in terms[:max_terms])
+
 
 @dataclass
 class Agent:
     id: int
     name: str
     persona: str
+    # Generation profile, e.g. {"max_tokens": 60, "temperature": 0.9, "stop": ["\n\n"]}
+    generation: Optional[dict] = None
 
-    def load_memory(self, cursor) -> List[str]:
+    @traced
+    def load_memory(
+        self, cursor, limit: Optional[int] = None, after_id: int = 0, session_id: Optional[int] = None,
+        with_tokens: bool = False, tokenizer: Optional[str] = None
+    ) -> Union[List[str], List[Tuple[str, int]]]:
         """
-        Load all message contents from the DB for this agent,
-        ordered by creation time ascending.
+        Load message contents from the DB for this agent in one session
+        (None is the default session), ordered by creation time ascending.
+        If limit is given only the most recent `limit` messages are loaded,
+        using the (session_id, agent_id, role, created_at) index, so the cost
+        depends on the size of the session, not the agent's whole history.
+        Messages with an id up to after_id (e.g. already summarized) are skipped.
+        A limited read is normally answered by the in-process context cache.
+        With with_tokens, (content, token count) pairs are returned instead,
+        counted with tokenizer (see agents.tokens); the count stored with the
+        message is used when it was made with the same tokenizer.
         """
-        cursor.execute(
-            "SELECT content FROM messages WHERE agent_id = ? AND role = 'assistant' ORDER BY created_at ASC",
-            (self.id,)
-        )
+        tokenizer = tokenizer or tokenizer_for()
+        if limit is not None:
+            cached = context_cache.recent(
+                (self.id, session_id), limit, after_id,
+                lambda n: self._recent_rows(cursor, session_id, n), tokenizer
+            )
+            if cached is not None:
+                return cached if with_tokens else [content for content, _ in cached]
+        if limit is None:
+            cursor.execute(
+                "SELECT content, token_count, tokenizer FROM messages WHERE session_id IS ? AND agent_id = ? AND role = 'assistant' AND id > ? ORDER BY created_at ASC, id ASC",
+                (session_id, self.id, after_id)
+            )
+        else:
+            cursor.execute(
+                """
+                SELECT content, token_count, tokenizer FROM (
+                    SELECT id, content, token_count, tokenizer, created_at FROM messages
+                    WHERE session_id IS ? AND agent_id = ? AND role = 'assistant' AND id > ?
+                    ORDER BY created_at DESC, id DESC LIMIT ?
+                ) ORDER BY created_at ASC, id ASC
+                """,
+                (session_id, self.id, after_id, limit)
+            )
         rows = cursor.fetchall()
+        if with_tokens:
+            return [
+                (content, stored_count(content, tokens, counted_with, tokenizer))
+                for content, tokens, counted_with in rows
+            ]
         return [row[0] for row in rows]
 
+    def _recent_rows(
+        self, cursor, session_id: Optional[int], limit: int
+    ) -> List[Tuple[int, str, Optional[int], Optional[str]]]:
+        """The newest `limit` (id, content, token_count, tokenizer) assistant messages of a session, oldest first."""
+        cursor.execute(
+            """
+            SELECT id, content, token_count, tokenizer FROM (
+                SELECT id, content, token_count, tokenizer, created_at FROM messages
+                WHERE session_id IS ? AND agent_id = ? AND role = 'assistant'
+                ORDER BY created_at DESC, id DESC LIMIT ?
+            ) ORDER BY created_at ASC, id ASC
+            """,
+            (session_id, self.id, limit)
+        )
+        return cursor.fetchall()
+
+    @traced
+    def load_summary(self, cursor, session_id: Optional[int] = None) -> Optional[Tuple[str, int]]:
+        """
+        Load the latest rolling summary of this agent's older memory in a session.
+        Returns (summary, up_to_message_id) or None if nothing was compacted yet.
+        """
+        def load():
+            cursor.execute(
+                "SELECT summary, up_to_message_id FROM memory_summaries WHERE session_id IS ? AND agent_id = ? ORDER BY up_to_message_id DESC LIMIT 1",
+                (session_id, self.id)
+            )
+            return cursor.fetchone()
+
+        return context_cache.summary(
+            (self.id, session_id), lambda n: self._recent_rows(cursor, session_id, n), load
+        )
+
+    @traced
+    def search_memory(
+        self, cursor, text: str, limit: int = 5, session_id: Optional[int] = None,
+        tokenizer: Optional[str] = None
+    ) -> List[Tuple[int, str, int]]:
+        """
+        Find this agent's past messages in a session most relevant to text,
+        best first, using BM25 ranking over the messages_fts index.
+        Returns (message id, content, token count) rows, counted with tokenizer.
+        """
+        tokenizer = tokenizer or tokenizer_for()
+        query = fts_query(text)
+        if query is None or limit <= 0:
+            return []
+        cursor.execute(
+            """
+            SELECT m.id, m.content, m.token_count, m.tokenizer FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ? AND m.session_id IS ? AND m.agent_id = ? AND m.role = 'assistant'
+            ORDER BY bm25(messages_fts) LIMIT ?
+            """,
+            (query, session_id, self.id, limit)
+        )
+        return [
+            (message_id, content, stored_count(content, tokens, counted_with, tokenizer))
+            for message_id, content, tokens, counted_with in cursor.fetchall()
+        ]
+
     def load_full_memory(self, cursor) -> List[Tuple[str, str, str]]:
         """
         Load full messages for this agent: role, content, created_at,
@@ -31,33 +159,96 @@ class Agent:
         )
         return cursor.fetchall()
 
-    def add_memory(self, cursor, content: str, role: str = "assistant", commit: bool = False):
+    @traced
+    def add_memory(
+        self, cursor, content: str, role: str = "assistant", commit: bool = False,
+        session_id: Optional[int] = None, tokenizer: Optional[str] = None
+    ):
         """
-        Add a message to the agent's memory in the DB.
+        Add a message to the agent's memory in the DB, in the given session
+        (None is the default session).
         If commit=True, commit the connection after inserting.
+        In write-behind durability mode the message is queued on the journal
+        instead and committed in the background with the next batch; cursor
+        is not used then and may be None.
+        Assistant messages are also appended to the context cache.
+        The message's token count is stored with it, with the name of the
+        tokenizer (by default the one for an unknown backend), so it is not
+        counted again while that tokenizer is used.
         """
+        tokenizer = tokenizer or tokenizer_for()
+        tokens = count_tokens(content, tokenizer)
+        key = (self.id, session_id)
+        # Cached only once stored (or queued), so a failed write is not served
+        record = ContextRecord(None, content, tokens, tokenizer) if role == "assistant" else None
+        if journal.enabled:
+            def inserted(message_id: int):
+                record.id = message_id
+            journal.append(
+                self.id, role, content, session_id, tokens, tokenizer,
+                on_insert=inserted if record else None
+            )
+            if record:
+                context_cache.append(key, record, queued=True)
+            return
         cursor.execute(
-            "INSERT INTO messages (agent_id, role, content) VALUES (?, ?, ?)",
-            (self.id, role, content)
+            "INSERT INTO messages (agent_id, role, content, session_id, token_count, tokenizer) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.id, role, content, session_id, tokens, tokenizer)
         )
+        if record:
+            record.id = cursor.lastrowid
+            after_commit = getattr(cursor.connection, "after_commit", None)
+            if after_commit:
+                after_commit(lambda: context_cache.append(key, record))
+            else:
+                # A plain sqlite3 connection has no commit hook
+                context_cache.append(key, record)
         if commit:
             cursor.connection.commit()
 
-    def get_conversation_history(self, cursor, limit: int = 10) -> List[Dict[str, str]]:
+    def get_conversation_history(
+        self, cursor, limit: int = 10, session_id: Optional[int] = None
+    ) -> List[Dict[str, str]]:
         """
-        Get formatted conversation history for this agent.
+        Get formatted conversation history for this agent in a session.
         Returns list of message dictionaries with role and content.
         """
         cursor.execute(
-            "SELECT role, content FROM messages WHERE agent_id = ? ORDER BY created_at DESC LIMIT ?",
-            (self.id, limit)
+            "SELECT role, content FROM messages WHERE session_id IS ? AND agent_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (session_id, self.id, limit)
         )
         rows = cursor.fetchall()
         return [{"role": row[0], "content": row[1]} for row in reversed(rows)]
 
+    @traced
+    def get_history_page(
+        self, cursor, limit: int = 50, before: Optional[Tuple[str, int]] = None
+    ) -> List[Tuple[int, str, str, str]]:
+        """
+        Get one page of this agent's messages, newest first,
+        as (id, role, content, created_at) rows.
+        Pass the (created_at, id) of the last row of the previous page as
+        before to get the next (older) page; every page is a range scan on
+        the (agent_id, created_at) index however deep it is.
+        """
+        if before is None:
+            cursor.execute(
+                "SELECT id, role, content, created_at FROM messages WHERE agent_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+                (self.id, limit)
+            )
+        else:
+            cursor.execute(
+                "SELECT id, role, content, created_at FROM messages WHERE agent_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?",
+                (self.id, before[0], before[1], limit)
+            )
+        return cursor.fetchall()
+
+    @traced
     def clear_memory(self, cursor, commit: bool = False):
-        """Clear all messages for this agent."""
+        """Clear all messages (and their summaries) for this agent."""
         cursor.execute("DELETE FROM messages WHERE agent_id = ?", (self.id,))
+        cursor.execute("DELETE FROM memory_summaries WHERE agent_id = ?", (self.id,))
+        context_cache.invalidate(self.id)
         if commit:
             cursor.connection.commit()
 
@@ -0,0 +1,406 @@
+"""Pooled LLM backend clients.
+
+Clients are built once per (backend, base_url, api_key) and reused, so every
+turn shares one keep-alive connection pool per backend instead of paying for
+a fresh httpx client, DNS lookup and TLS handshake.
+
+The ollama and openai SDKs are only imported when a provider for that
+backend is first created, so processes that never call a backend (CLI jobs,
+an Ollama-only server) do not pay for importing them.
+
+Every Ollama call sends keep_alive (AI_STORY_OLLAMA_KEEP_ALIVE), so a model
+in active use stays loaded between turns; agents.warmup decides which idle
+models to unload.
+"""
+
+import os
+import time
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from telemetry import counter, histogram
+
+LLM_SECONDS = histogram(
+    "ai_story_llm_request_duration_seconds",
+    "Duration of LLM backend calls until the last token.",
+    ["backend", "model", "mode"],
+)
+LLM_FIRST_TOKEN_SECONDS = histogram(
+    "ai_story_llm_time_to_first_token_seconds",
+    "Time from a streamed LLM call to its first token.",
+    ["backend", "model"],
+)
+LLM_TOKENS_PER_SECOND = histogram(
+    "ai_story_llm_tokens_per_second",
+    "Approximate output tokens per second of each LLM call.",
+    ["backend", "model"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000),
+)
+LLM_TOKENS = counter(
+    "ai_story_llm_output_tokens_total",
+    "Approximate output tokens (characters / 4) generated by LLM backends.",
+    ["backend", "model"],
+)
+OLLAMA_KEEP_ALIVE = os.environ.get("AI_STORY_OLLAMA_KEEP_ALIVE", "30m")
+
+LLM_ERRORS = counter(
+    "ai_story_llm_errors_total",
+    "Failed LLM backend calls, by exception type.",
+    ["backend", "model", "error"],
+)
+
+
+@lru_cache(maxsize=None)
+def pool_limits():
+    """Shared by every pooled client; idle connections are kept for a minute."""
+    import httpx
+
+    return httpx.Limits(
+        max_connections=100, max_keepalive_connections=20, keepalive_expiry=60
+    )
+
+
+class Provider:
+    """
+    Common base of the backends: the public complete/stream/complete_sync
+    record latency, time to first token, throughput and errors for
+    /metrics and delegate to the backend's _complete/_stream/_complete_sync.
+    """
+
+    backend = "unknown"
+
+    def _observe(self, model: str, mode: str, start: float, chars: int, first=None):
+        end = time.perf_counter()
+        LLM_SECONDS.observe(end - start, self.backend, model, mode)
+        if first is not None:
+            LLM_FIRST_TOKEN_SECONDS.observe(first - start, self.backend, model)
+        tokens = (chars + 3) // 4
+        LLM_TOKENS.inc(self.backend, model, amount=tokens)
+        generating = end - (first if first is not None else start)
+        if tokens and generating > 0:
+            LLM_TOKENS_PER_SECOND.observe(tokens / generating, self.backend, model)
+
+    def _error(self, model: str, e: BaseException):
+        LLM_ERRORS.inc(self.backend, model, type(e).__name__)
+
+    async def complete(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+    ) -> str:
+        start = time.perf_counter()
+        try:
+            text = await self._complete(model, messages, max_tokens, temperature, stop)
+        except Exception as e:
+            self._error(model, e)
+            raise
+        self._observe(model, "complete", start, len(text))
+        return text
+
+    async def stream(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+    ) -> AsyncIterator[str]:
+        start = time.perf_counter()
+        first = None
+        chars = 0
+        try:
+            async for chunk in self._stream(
+                model, messages, max_tokens, temperature, stop
+            ):
+                if first is None:
+                    first = time.perf_counter()
+                chars += len(chunk)
+                yield chunk
+        except Exception as e:
+            self._error(model, e)
+            raise
+        self._observe(model, "stream", start, chars, first)
+
+    def complete_sync(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+    ) -> str:
+        start = time.perf_counter()
+        try:
+            text = self._complete_sync(model, messages, max_tokens, temperature, stop)
+        except Exception as e:
+            self._error(model, e)
+            raise
+        self._observe(model, "complete", start, len(text))
+        return text
+
+
+class OllamaProvider(Provider):
+    """Ollama backend using one AsyncClient (and a lazy sync Client) per host."""
+
+    backend = "ollama"
+
+    def __init__(self, host: Optional[str] = None, keep_alive: str = OLLAMA_KEEP_ALIVE):
+        import ollama
+
+        self.host = host
+        self.keep_alive = keep_alive
+        self.client = ollama.AsyncClient(host=host, limits=pool_limits())
+        self._sync_client = None
+        # model -> time.monotonic() of its last request, for the unload policy
+        self.last_used: Dict[str, float] = {}
+
+    @staticmethod
+    def _options(
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        stop: Optional[List[str]] = None,
+    ):
+        options = {}
+        if max_tokens is not None:
+            options["num_predict"] = max_tokens
+        if temperature is not None:
+            options["temperature"] = temperature
+        if stop:
+            options["stop"] = stop
+        return options or None
+
+    async def _complete(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+    ) -> str:
+        self.last_used[model] = time.monotonic()
+        response = await self.client.chat(
+            model=model,
+            messages=messages,
+            options=self._options(max_tokens, temperature, stop),
+            keep_alive=self.keep_alive,
+        )
+        content = response.get("message", {}).get("content", "")
+        return content if isinstance(content, str) else ""
+
+    async def _stream(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+    ) -> AsyncIterator[str]:
+        self.last_used[model] = time.monotonic()
+        chunks = await self.client.chat(
+            model=model,
+            messages=messages,
+            options=self._options(max_tokens, temperature, stop),
+            stream=True,
+            keep_alive=self.keep_alive,
+        )
+        async for chunk in chunks:
+            content = chunk.get("message", {}).get("content", "")
+            if content:
+                yield content
+
+    def _complete_sync(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+    ) -> str:
+        if self._sync_client is None:
+            import ollama
+
+            self._sync_client = ollama.Client(host=self.host, limits=pool_limits())
+        self.last_used[model] = time.monotonic()
+        response = self._sync_client.chat(
+            model=model,
+            messages=messages,
+            options=self._options(max_tokens, temperature, stop),
+            keep_alive=self.keep_alive,
+        )
+        content = response.get("message", {}).get("content", "")
+        return content if isinstance(content, str) else ""
+
+    async def list_models(self) -> List[str]:
+        response = await self.client.list()
+        return [m.model for m in response.models if m.model]
+
+    async def load(self, model: str):
+        """Load a model into memory without generating anything."""
+        await self.client.chat(model=model, messages=[], keep_alive=self.keep_alive)
+
+    async def unload(self, model: str):
+        """Ask Ollama to free a model's memory now."""
+        await self.client.chat(model=model, messages=[], keep_alive=0)
+        self.last_used.pop(model, None)
+
+    async def loaded_models(self) -> Dict[str, int]:
+        """Models Ollama currently holds in memory, with their size in bytes."""
+        response = await self.client.ps()
+        return {m.model: m.size or 0 for m in response.models if m.model}
+
+    async def aclose(self):
+        await self.client._client.aclose()
+        if self._sync_client is not None:
+            self._sync_client._client.close()
+
+
+class OpenAIProvider(Provider):
+    """OpenAI-compatible backend (OpenAI, GitHub Models) with pooled clients."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        token_param: str = "max_tokens",
+        backend: str = "openai",
+    ):
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        self.backend = backend
+        self.base_url = base_url
+        self.api_key = api_key
+        # GitHub Models only accepts max_completion_tokens
+        self.token_param = token_param
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=DefaultAsyncHttpxClient(limits=pool_limits()),
+        )
+        self._sync_client = None
+
+    def _params(
+        self,
+        max_tokens: Optional[int],
+        temperature: Optional[float],
+        stop: Optional[List[str]] = None,
+    ):
+        params = {}
+        if max_tokens is not None:
+            params[self.token_param] = max_tokens
+        if temperature is not None:
+            params["temperature"] = temperature
+        if stop:
+            # OpenAI accepts at most four stop sequences
+            params["stop"] = stop[:4]
+        return params
+
+    async def _complete(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+    ) -> str:
+        response = await self.client.chat.completions.create(
+            messages=messages,
+            model=model,
+            **self._params(max_tokens, temperature, stop),
+        )
+        content = response.choices[0].message.content
+        return content if content is not None else ""
+
+    async def _stream(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+    ) -> AsyncIterator[str]:
+        chunks = await self.client.chat.completions.create(
+            messages=messages,
+            model=model,
+            stream=True,
+            **self._params(max_tokens, temperature, stop),
+        )
+        async for chunk in chunks:
+            content = chunk.choices[0].delta.content if chunk.choices else None
+            if content:
+                yield content
+
+    def _complete_sync(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None,
+        stop: Optional[List[str]] = None,
+    ) -> str:
+        if self._sync_client is None:
+            from openai import DefaultHttpxClient, OpenAI
+
+            self._sync_client = OpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=DefaultHttpxClient(limits=pool_limits()),
+            )
+        response = self._sync_client.chat.completions.create(
+            messages=messages,
+            model=model,
+            **self._params(max_tokens, temperature, stop),
+        )
+        content = response.choices[0].message.content
+        return content if content is not None else ""
+
+    async def aclose(self):
+        await self.client.close()
+        if self._sync_client is not None:
+            self._sync_client.close()
+
+
+_providers: Dict[Tuple[str, Optional[str], Optional[str]], object] = {}
+
+
+def get_provider(
+    api: str, base_url: Optional[str] = None, api_key: Optional[str] = None
+):
+    """Return the shared provider for a backend, creating it on first use.
+
+    api is "ollama", "openai" or "github"; for Ollama base_url is the host
+    (None uses OLLAMA_HOST or the local default).
+    """
+    key = (api, base_url, api_key)
+    provider = _providers.get(key)
+    if provider is None:
+        if api == "ollama":
+            provider = OllamaProvider(host=base_url)
+        elif api == "openai":
+            provider = OpenAIProvider(base_url=base_url, api_key=api_key)
+        elif api == "github":
+            provider = OpenAIProvider(
+                base_url=base_url,
+                api_key=api_key,
+                token_param="max_completion_tokens",
+                backend="github",
+            )
+        else:
+            raise ValueError(f"Unsupported API: {api}")
+        _providers[key] = provider
+    return provider
+
+
+def pooled_providers() -> List[Provider]:
+    """Every provider created so far."""
+    return list(_providers.values())
+
+
+async def close_providers():
+    """Close every pooled client; called on application shutdown."""
+    providers = list(_providers.values())
+    _providers.clear()
+    for provider in providers:
+        await provider.aclose()
@@ -0,0 +1,55 @@
+import threading
+from typing import Dict, List, Optional
+
+from db import load_agents, on_agents_changed
+
+from .models import Agent
+
+
+class AgentRegistry:
+    """
+    In-memory name -> Agent and id -> Agent maps, loaded from the DB once
+    and served without queries until invalidated by an agent write.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_name: Dict[str, Agent] = {}
+        self._by_id: Dict[int, Agent] = {}
+        self._loaded = False
+        self._version = 0
+
+    def load(self):
+        """(Re)load every agent from the DB."""
+        with self._lock:
+            version = self._version
+            agents = [Agent(**data) for data in load_agents()]
+            self._by_name = {agent.name: agent for agent in agents}
+            self._by_id = {agent.id: agent for agent in agents}
+            # An invalidation during the load means the rows may be stale
+            self._loaded = version == self._version
+
+    def invalidate(self):
+        """Drop the cached agents; the next lookup reloads them."""
+        self._version += 1
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def get(self, name: str) -> Optional[Agent]:
+        self._ensure_loaded()
+        return self._by_name.get(name)
+
+    def get_by_id(self, agent_id: int) -> Optional[Agent]:
+        self._ensure_loaded()
+        return self._by_id.get(agent_id)
+
+    def all(self) -> List[Agent]:
+        self._ensure_loaded()
+        return list(self._by_name.values())
+
+
+registry = AgentRegistry()
+on_agents_changed(registry.invalidate)
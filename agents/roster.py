@@ -0,0 +1,124 @@
+"""Compact, cached roster section of the system prompt.
+
+Each agent is told who else is in the scene. Instead of every other agent's
+full persona, the roster lists a short blurb per agent (the first sentence
+of the persona, at most AI_STORY_ROSTER_BLURB_WORDS words) and stops at
+AI_STORY_ROSTER_TOKENS, naming how many agents were left out. Rosters are
+built once per (agent, cast) and reused until an agent is written, so the
+system prompt stays byte-identical across turns and backends can reuse
+their prompt prefix cache.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from db import on_agents_changed
+
+from .models import Agent
+from .tokens import count_tokens
+
+ROSTER_TOKENS = int(os.environ.get("AI_STORY_ROSTER_TOKENS", "200"))
+BLURB_WORDS = int(os.environ.get("AI_STORY_ROSTER_BLURB_WORDS", "12"))
+# Distinct (agent, cast) rosters kept
+MAX_ROSTERS = 1024
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+_YOU_ARE = re.compile(r"^you(?: are|'re)\s+", re.IGNORECASE)
+
+
+def blurb(persona: str, name: str = "", max_words: int = BLURB_WORDS) -> str:
+    """First sentence of a persona, cut to max_words words.
+
+    A leading "You are <name>," is dropped, so "You are Echo, a cryptic
+    storyteller. ..." becomes "a cryptic storyteller".
+    """
+    sentence = _YOU_ARE.sub("", _SENTENCE_END.split(persona.strip(), 1)[0])
+    if name and sentence.startswith(name):
+        sentence = sentence[len(name) :].lstrip(" ,")
+    words = sentence.split()
+    if len(words) > max_words:
+        return " ".join(words[:max_words]).rstrip(",;:") + "..."
+    return " ".join(words).rstrip(".")
+
+
+class RosterCache:
+    """Blurbs per agent and finished roster strings per (agent, cast)."""
+
+    def __init__(
+        self,
+        budget: int = ROSTER_TOKENS,
+        blurb_words: int = BLURB_WORDS,
+        max_rosters: int = MAX_ROSTERS,
+    ):
+        self.budget = budget
+        self.blurb_words = blurb_words
+        self.max_rosters = max_rosters
+        self._blurbs: Dict[int, str] = {}
+        self._rosters: "OrderedDict[Tuple[int, ...], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def roster(self, agent: Agent, cast: List[Agent]) -> str:
+        """Who else is in the scene, e.g. "Echo (a cave spirit), Rook (...)".
+
+        Empty when the agent is alone. Agents are listed in id order so the
+        text does not depend on the order of cast.
+        """
+        others = sorted((a for a in cast if a.id != agent.id), key=lambda a: a.id)
+        key = (agent.id,) + tuple(a.id for a in others)
+        with self._lock:
+            text = self._rosters.get(key)
+            if text is not None:
+                self._rosters.move_to_end(key)
+                self.hits += 1
+                return text
+
+        text = self._build(others)
+        with self._lock:
+            self.misses += 1
+            self._rosters[key] = text
+            while len(self._rosters) > self.max_rosters:
+                self._rosters.popitem(last=False)
+        return text
+
+    def _build(self, others: List[Agent]) -> str:
+        entries = []
+        used = 0
+        for i, other in enumerate(others):
+            entry = f"{other.name} ({self._blurb(other)})"
+            cost = count_tokens(entry)
+            if entries and used + cost > self.budget:
+                entries.append(f"and {len(others) - i} more")
+                break
+            entries.append(entry)
+            used += cost
+        return ", ".join(entries)
+
+    def _blurb(self, agent: Agent) -> str:
+        text = self._blurbs.get(agent.id)
+        if text is None:
+            text = self._blurbs[agent.id] = blurb(
+                agent.persona, agent.name, self.blurb_words
+            )
+        return text
+
+    def invalidate(self):
+        """Forget every blurb and roster, e.g. after an agent was written."""
+        with self._lock:
+            self._blurbs = {}
+            self._rosters.clear()
+
+    def stats(self) -> dict:
+        return {
+            "rosters": len(self._rosters),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+roster_cache = RosterCache()
+on_agents_changed(roster_cache.invalidate)
@@ -0,0 +1,192 @@
+"""Admission control in front of the LLM backends.
+
+Every generation takes a slot from the gate of its backend (or of its
+backend/model when a model-specific limit is configured). When all slots are
+busy the request waits in a bounded priority queue, interactive requests
+ahead of batch ones. A full queue is rejected immediately with QueueFull
+(HTTP 429) and a request that waits longer than the queue timeout fails with
+QueueTimeout (HTTP 503); both carry a Retry-After estimate.
+
+Limits come from AI_STORY_CONCURRENCY, e.g. "ollama=2,openai=16,ollama/llama3=1".
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from telemetry import span
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+DEFAULT_LIMITS = {"ollama": 2, "openai": 16, "github": 8}
+QUEUE_SIZE = int(os.environ.get("AI_STORY_QUEUE_SIZE", "64"))
+QUEUE_TIMEOUT = float(os.environ.get("AI_STORY_QUEUE_TIMEOUT", "30"))
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """Parse "backend=N,backend/model=N" into a limits dict."""
+    limits = dict(DEFAULT_LIMITS)
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        key, value = item.rsplit("=", 1)
+        limits[key.strip()] = int(value)
+    return limits
+
+
+class AdmissionError(Exception):
+    """A generation was not admitted; retry_after is in seconds."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(AdmissionError):
+    status_code = 429
+
+
+class QueueTimeout(AdmissionError):
+    status_code = 503
+
+
+class BackendGate:
+    """Concurrency limit plus priority wait queue for one backend (or model)."""
+
+    def __init__(self, name: str, limit: int, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        # Moving average of how long a slot is held, for Retry-After
+        self.avg_hold = 1.0
+        self._heap: list = []
+        self._seq = itertools.count()
+
+    def retry_after(self) -> int:
+        backlog = (self.waiting + 1) / max(self.limit, 1)
+        return max(1, math.ceil(self.avg_hold * backlog))
+
+    def check(self):
+        """Raise QueueFull if a new request could not even be queued."""
+        if self.active >= self.limit and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(
+                f"{self.name} is busy ({self.waiting} requests queued)",
+                self.retry_after(),
+            )
+
+    async def acquire(self, priority: int, timeout: Optional[float]):
+        if self.active < self.limit and self.waiting == 0:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        self.check()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.waiting -= 1
+            self.timeouts += 1
+            raise QueueTimeout(
+                f"Timed out after {timeout:.0f}s waiting for {self.name}",
+                self.retry_after(),
+            )
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            else:
+                self.waiting -= 1
+            raise
+        self.admitted += 1
+
+    def release(self):
+        # Hand the slot straight to the next live waiter, if any
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                self.waiting -= 1
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def observe(self, held: float):
+        self.avg_hold = 0.8 * self.avg_hold + 0.2 * held
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.waiting,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+
+class Scheduler:
+    """Registry of backend gates."""
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, int]] = None,
+        max_queue: int = QUEUE_SIZE,
+        queue_timeout: float = QUEUE_TIMEOUT,
+    ):
+        self.limits = (
+            limits
+            if limits is not None
+            else parse_limits(os.environ.get("AI_STORY_CONCURRENCY", ""))
+        )
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._gates: Dict[str, BackendGate] = {}
+
+    def gate(self, api: str, model: str) -> BackendGate:
+        # A model-specific limit gets its own gate, otherwise the backend's
+        name = f"{api}/{model}" if f"{api}/{model}" in self.limits else api
+        gate = self._gates.get(name)
+        if gate is None:
+            limit = self.limits.get(name, 4)
+            gate = self._gates[name] = BackendGate(name, limit, self.max_queue)
+        return gate
+
+    def check(self, api: str, model: str):
+        """Fail fast with QueueFull before starting a streamed response."""
+        self.gate(api, model).check()
+
+    @asynccontextmanager
+    async def slot(self, api: str, model: str, priority: int = PRIORITY_INTERACTIVE):
+        """Hold one generation slot of the backend for the duration of the block."""
+        gate = self.gate(api, model)
+        with span("queue"):
+            await gate.acquire(priority, self.queue_timeout)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            gate.release()
+            gate.observe(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: gate.stats() for name, gate in self._gates.items()}
+
+
+scheduler = Scheduler()
@@ -0,0 +1,166 @@
+"""Single-flight deduplication of identical concurrent generations.
+
+Requests whose prompt hash matches a generation that is still running attach
+to it instead of calling the backend again. The running generation is pumped
+by a background task into a Flight that records every chunk, so late joiners
+replay what was already produced and then follow live. Only the request that
+started the flight is told it is the leader. Saving the reply is left to the
+flight's on_done callback, which runs once the generation completes even if
+the leader has disconnected while others still follow. Disabled with
+AI_STORY_COALESCE=0.
+"""
+
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+COALESCE_ENABLED = os.environ.get("AI_STORY_COALESCE", "1").lower() not in (
+    "0",
+    "false",
+    "no",
+)
+
+
+class FlightCancelled(Exception):
+    """Raised to followers when a generation is stopped before it finished."""
+
+
+class Flight:
+    """Chunks of one in-flight generation, readable by any number of followers."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def push(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.finished = True
+        self.error = error
+        self._notify()
+
+    async def follow(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class SingleFlight:
+    """Registry of in-flight generations keyed by prompt hash."""
+
+    def __init__(self, enabled: bool = COALESCE_ENABLED):
+        self.enabled = enabled
+        self._flights: Dict[str, Flight] = {}
+        self.started = 0
+        self.joined = 0
+
+    def join(
+        self,
+        key: str,
+        source: Callable[[], AsyncIterator[str]],
+        on_done: Optional[Callable[[str], Awaitable[None]]] = None,
+    ) -> Tuple[AsyncIterator[str], bool]:
+        """Return (chunks, is_leader) for the generation identified by key.
+
+        source and on_done are only used when no identical generation is
+        running. on_done gets the full text when the generation completes,
+        before followers see the end of the stream; it is not called when the
+        generation fails or everybody left. The caller counts as a follower
+        from this call on, so it must start iterating the chunks right away.
+        """
+        if not self.enabled:
+            return self._complete(source(), on_done), True
+
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = self._flights[key] = Flight()
+            flight.task = asyncio.create_task(
+                self._pump(key, flight, source(), on_done)
+            )
+            self.started += 1
+        else:
+            self.joined += 1
+        # Counted now, not on the first read: a leader leaving before the
+        # others have read anything must not cancel their generation
+        flight.subscribers += 1
+        return self._subscribe(flight), leader
+
+    async def _complete(
+        self,
+        chunks: AsyncIterator[str],
+        on_done: Optional[Callable[[str], Awaitable[None]]],
+    ) -> AsyncIterator[str]:
+        """Uncoalesced generation, calling on_done like a flight would."""
+        text = []
+        async for chunk in chunks:
+            text.append(chunk)
+            yield chunk
+        if on_done is not None:
+            await on_done("".join(text))
+
+    async def _pump(
+        self,
+        key: str,
+        flight: Flight,
+        chunks: AsyncIterator[str],
+        on_done: Optional[Callable[[str], Awaitable[None]]] = None,
+    ):
+        try:
+            async for chunk in chunks:
+                flight.push(chunk)
+            if on_done is not None:
+                try:
+                    # Shielded: the last follower leaving must not cut the save
+                    await asyncio.shield(on_done("".join(flight.chunks)))
+                except Exception as e:
+                    print(f"Saving generation {key} failed: {e}")
+            flight.finish()
+        except asyncio.CancelledError:
+            # Followers get an ordinary error, not a cancellation of their own
+            flight.finish(FlightCancelled(f"generation {key} was cancelled"))
+            raise
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def _subscribe(self, flight: Flight) -> AsyncIterator[str]:
+        try:
+            async for chunk in flight.follow():
+                yield chunk
+        finally:
+            flight.subscribers -= 1
+            # Nobody is listening any more, stop paying for the generation
+            if flight.subscribers == 0 and not flight.finished and flight.task:
+                flight.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "joined": self.joined,
+        }
+
+
+singleflight = SingleFlight()
@@ -0,0 +1,103 @@
+"""Token counting for prompt budgets.
+
+The tokenizer is picked per backend, because a count is only right for the
+model family it was made for: OpenAI and GitHub Models use tiktoken's
+o200k_base encoding (the GPT-4o family), while Ollama's Llama-style models
+have tokenizers tiktoken does not ship, so their prompts are estimated at
+about four characters per token. AI_STORY_TOKENIZER overrides this with
+"backend=name" or "backend/model=name" items like AI_STORY_CONTEXT_TOKENS,
+e.g. "openai/gpt-4=cl100k_base,ollama=approx"; a bare name applies to every
+backend. A name is "approx" or a tiktoken encoding; when tiktoken or the
+encoding is unavailable the estimate is used instead.
+
+Counts of stored messages are saved with the message together with the name
+of the tokenizer that made them (messages.token_count and
+messages.tokenizer). A count made with another tokenizer, or before the
+tokenizer was recorded, is recomputed when read. Repeated texts such as
+system prompts, rosters and summaries hit an in-process LRU, so a text is
+tokenized once per tokenizer.
+"""
+
+import os
+from functools import lru_cache
+from typing import Dict, Optional
+
+APPROX = "approx"
+DEFAULT_TOKENIZERS = {"ollama": APPROX, "openai": "o200k_base", "github": "o200k_base"}
+# Tokens a chat message costs on top of its content (role and separators)
+MESSAGE_TOKENS = 4
+
+_encodings: Dict[str, object] = {}
+
+
+def parse_tokenizers(spec: str) -> Dict[str, str]:
+    """Parse "backend=name,backend/model=name" (or one bare name for every
+    backend) into a tokenizers dict; "*" is used when the backend is unknown."""
+    tokenizers = dict(DEFAULT_TOKENIZERS)
+    tokenizers["*"] = APPROX
+    for item in spec.split(","):
+        item = item.strip()
+        # "auto" was the old default and means the per-backend defaults
+        if not item or item == "auto":
+            continue
+        if "=" not in item:
+            tokenizers = {key: item for key in tokenizers}
+            continue
+        key, value = item.rsplit("=", 1)
+        tokenizers[key.strip()] = value.strip()
+    return tokenizers
+
+
+TOKENIZERS = parse_tokenizers(os.environ.get("AI_STORY_TOKENIZER", ""))
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+def _get_encoding(name: str):
+    """The tiktoken encoding called name, or None to estimate."""
+    if name == APPROX:
+        return None
+    if name in _encodings:
+        return _encodings[name]
+    try:
+        # Imported when counting is first needed, not at startup
+        import tiktoken
+
+        encoding = tiktoken.get_encoding(name)
+    except Exception as e:
+        print(f"Tokenizer {name} is not available, estimating tokens instead: {e}")
+        encoding = None
+    _encodings[name] = encoding
+    return encoding
+
+
+def tokenizer_for(api: Optional[str] = None, model: Optional[str] = None) -> str:
+    """Name of the tokenizer counting for a backend/model, the backend's if
+    not set; "approx" when the configured encoding cannot be loaded."""
+    if model and f"{api}/{model}" in TOKENIZERS:
+        name = TOKENIZERS[f"{api}/{model}"]
+    else:
+        name = TOKENIZERS.get(api or "*", TOKENIZERS["*"])
+    return name if _get_encoding(name) is not None else APPROX
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, tokenizer: Optional[str] = None) -> int:
+    """Number of tokens in text with the given tokenizer (by default the one
+    for an unknown backend)."""
+    encoding = _get_encoding(tokenizer or tokenizer_for())
+    if encoding is None:
+        return approx_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def stored_count(
+    text: str, count: Optional[int], counted_with: Optional[str], tokenizer: str
+) -> int:
+    """A stored token count if it was made with tokenizer, else a new count."""
+    if count is not None and counted_with == tokenizer:
+        return count
+    return count_tokens(text, tokenizer)
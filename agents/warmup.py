@@ -0,0 +1,193 @@
+"""Ollama model lifecycle: warm-up at startup, an unload policy and cached
+connection checks.
+
+The models in AI_STORY_WARM_MODELS (none by default) are loaded in the
+background when the server starts with the Ollama backend (AI_API, "ollama"
+by default), so the first chat does not wait for Ollama to read the weights.
+Requests keep models they use loaded with keep_alive (see agents.providers).
+While the pool runs, every AI_STORY_WARM_INTERVAL seconds it asks Ollama
+which models are loaded and unloads the least recently used ones beyond
+AI_STORY_OLLAMA_MAX_LOADED, once they have been idle for a full interval;
+anything else unloads by itself when its keep_alive runs out. Without warm
+models the pool does not start and nothing talks to Ollama at startup.
+
+ConnectionChecks caches the outcome of /test-connection for
+AI_STORY_CHECK_TTL seconds (failures for CHECK_FAILURE_TTL), and concurrent
+checks of the same settings share one run.
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from telemetry import to_thread
+
+from .providers import OllamaProvider, get_provider, pooled_providers
+
+WARM_MODELS = [
+    model.strip()
+    for model in os.environ.get("AI_STORY_WARM_MODELS", "").split(",")
+    if model.strip()
+]
+BACKEND = os.environ.get("AI_API", "ollama")
+MAX_LOADED = int(os.environ.get("AI_STORY_OLLAMA_MAX_LOADED", "2"))
+WARM_INTERVAL = float(os.environ.get("AI_STORY_WARM_INTERVAL", "60"))
+CHECK_TTL = float(os.environ.get("AI_STORY_CHECK_TTL", "30"))
+# Failed checks are retried sooner, so a fixed setting shows up quickly
+CHECK_FAILURE_TTL = 5.0
+
+
+class ModelPool:
+    """Warms the configured models and unloads idle ones beyond max_loaded."""
+
+    def __init__(
+        self,
+        models: List[str] = WARM_MODELS,
+        max_loaded: int = MAX_LOADED,
+        interval: float = WARM_INTERVAL,
+        backend: str = BACKEND,
+    ):
+        self.models = models
+        self.backend = backend
+        self.max_loaded = max_loaded
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.warmed: Dict[str, float] = {}
+        self.warm_seconds: Dict[str, float] = {}
+        self.unloads = 0
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        """Start warming and the policy loop on the running event loop, if
+        there are models to warm and the server uses Ollama."""
+        if self._task is None and self.models and self.backend == "ollama":
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def warm(self, provider: OllamaProvider, model: str):
+        """Load one model; failures are recorded, not raised."""
+        start = time.perf_counter()
+        try:
+            await provider.load(model)
+        except Exception as e:
+            self.last_error = f"warming {model}: {e}"
+            return
+        self.warm_seconds[model] = time.perf_counter() - start
+        self.warmed[model] = time.monotonic()
+
+    async def enforce(self) -> List[str]:
+        """Unload the least recently used idle models beyond max_loaded.
+
+        Only models this process used or warmed are considered; models
+        loaded by other Ollama clients are left alone. Returns the models
+        unloaded.
+        """
+        unloaded = []
+        if self.max_loaded <= 0:
+            return unloaded
+        now = time.monotonic()
+        for provider in pooled_providers():
+            if not isinstance(provider, OllamaProvider):
+                continue
+            loaded = await provider.loaded_models()
+            used: List[Tuple[float, str]] = []
+            for model in loaded:
+                last = provider.last_used.get(model, self.warmed.get(model))
+                if last is not None:
+                    used.append((last, model))
+            used.sort(reverse=True)
+            for last, model in used[self.max_loaded :]:
+                if now - last < self.interval:
+                    continue
+                await provider.unload(model)
+                self.warmed.pop(model, None)
+                self.unloads += 1
+                unloaded.append(model)
+        return unloaded
+
+    async def _run(self):
+        # Creating the provider imports the ollama SDK; keep that off the loop
+        provider = await to_thread(get_provider, "ollama")
+        # One at a time, so warming never needs more memory than serving
+        for model in self.models:
+            await self.warm(provider, model)
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.enforce()
+            except Exception as e:
+                # Ollama may be down for a while; try again next interval
+                self.last_error = str(e)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "warm_models": self.models,
+            "max_loaded": self.max_loaded,
+            "warmed": sorted(self.warmed),
+            "warm_seconds": {
+                model: round(seconds, 3) for model, seconds in self.warm_seconds.items()
+            },
+            "unloads": self.unloads,
+            "last_error": self.last_error,
+        }
+
+
+model_pool = ModelPool()
+
+
+class ConnectionChecks:
+    """Short-lived cache of connection check results, keyed by settings."""
+
+    def __init__(self, ttl: float = CHECK_TTL, failure_ttl: float = CHECK_FAILURE_TTL):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self._checks: Dict[Hashable, Tuple[float, asyncio.Task]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def run(self, key: Hashable, check: Callable[[], Awaitable[dict]]) -> dict:
+        """The result of check(), reused while fresh; exceptions are reused too."""
+        now = time.monotonic()
+        entry = self._checks.get(key)
+        if entry is not None:
+            expires, task = entry
+            if not task.done() or now < expires:
+                self.hits += 1
+                return await asyncio.shield(task)
+        self.misses += 1
+        for stale in [
+            k for k, (expires, t) in self._checks.items() if t.done() and now >= expires
+        ]:
+            del self._checks[stale]
+        task = asyncio.ensure_future(check())
+        self._checks[key] = (now + self.ttl, task)
+        task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        entry = self._checks.get(key)
+        if entry is None or entry[1] is not task:
+            return
+        if task.cancelled():
+            del self._checks[key]
+        elif task.exception() is not None:
+            self._checks[key] = (time.monotonic() + self.failure_ttl, task)
+        else:
+            self._checks[key] = (time.monotonic() + self.ttl, task)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._checks), "hits": self.hits, "misses": self.misses}
+
+
+connection_checks = ConnectionChecks()
@@ -1,17 +1,54 @@
 import os
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 
+from agents.providers import close_providers
+from agents.scheduler import AdmissionError
+from agents.warmup import model_pool
+from db import close_all, journal, retention
+from telemetry import TracingMiddleware, sink, workers
+
+from .metrics import MetricsMiddleware
 from .routes import router
 
-app = FastAPI(title="AI Agent Chat API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Blocking work runs on our executor, so /metrics can report on it
+    workers.start()
+    retention.start()
+    # Load the configured Ollama models in the background, if any
+    model_pool.start()
+    yield
+    await model_pool.stop()
+    retention.stop()
+    await close_providers()
+    journal.stop()
+    close_all()
+    sink.close()
+    workers.stop()
+
+
+app = FastAPI(title="AI Agent Chat API", lifespan=lifespan)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 if os.path.exists("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
+@app.exception_handler(AdmissionError)
+async def admission_error_handler(request: Request, exc: AdmissionError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 @app.get("/")
 async def serve_index():
     return FileResponse("static/index.html")
@@ -0,0 +1,245 @@
+"""HTTP request metrics and scrape-time gauges for GET /metrics.
+
+Request counts and latencies are recorded per route template (not per raw
+path, which would create a series per agent name). Saturation gauges are
+read from the scheduler, connection pool, journal and thread pools when
+Prometheus scrapes, so they cost nothing in between.
+"""
+
+import threading
+import time
+
+from agents.cache import completion_cache
+from agents.compaction import compactor
+from agents.context_cache import context_cache
+from agents.scheduler import scheduler
+from agents.singleflight import singleflight
+from db import journal, pool, read_connection, retention
+from telemetry import REGISTRY, counter, gauge, histogram, to_thread, workers
+
+HTTP_REQUESTS = counter(
+    "ai_story_http_requests_total",
+    "HTTP requests handled, by route and status code.",
+    ["method", "route", "status"],
+)
+HTTP_SECONDS = histogram(
+    "ai_story_http_request_duration_seconds",
+    "Time from request to the end of the response body, by route.",
+    ["method", "route"],
+)
+
+# Stored message counts are a full index scan, so they are cached briefly
+MESSAGE_COUNT_TTL = 30.0
+
+
+def route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    if scope.get("path", "").startswith("/static/"):
+        return "/static"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed to their end."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            method = scope.get("method", "")
+            route = route_label(scope)
+            HTTP_REQUESTS.inc(method, route, str(status))
+            HTTP_SECONDS.observe(time.perf_counter() - start, method, route)
+
+
+def _gate_samples(field: str):
+    for name, stats in scheduler.stats().items():
+        yield (name,), stats[field]
+
+
+_message_counts = {"at": 0.0, "rows": []}
+_message_counts_lock = threading.Lock()
+
+
+def _refresh_message_counts():
+    with _message_counts_lock:
+        if time.monotonic() - _message_counts["at"] < MESSAGE_COUNT_TTL:
+            return
+        with read_connection() as con:
+            _message_counts["rows"] = con.execute(
+                "SELECT a.name, COUNT(m.id) FROM agents a "
+                "LEFT JOIN messages m ON m.agent_id = a.id GROUP BY a.id"
+            ).fetchall()
+        _message_counts["at"] = time.monotonic()
+
+
+def _stored_messages():
+    return [((name,), count) for name, count in _message_counts["rows"]]
+
+
+def _worker_threads():
+    # to_thread work (DB reads and writes, cache files, imports)
+    stats = workers.stats()
+    return [
+        (("asyncio", state), stats[state])
+        for state in ("threads", "max_threads", "queued")
+    ]
+
+
+def _anyio_limiter():
+    # Sync dependencies and sync streaming bodies run on anyio's thread pool
+    try:
+        from anyio.to_thread import current_default_thread_limiter
+
+        limiter = current_default_thread_limiter()
+    except Exception:
+        return []
+    return [
+        (("anyio", "threads"), limiter.borrowed_tokens),
+        (("anyio", "max_threads"), limiter.total_tokens),
+    ]
+
+
+gauge(
+    "ai_story_backend_active_generations",
+    "Generations currently holding a backend slot.",
+    ["gate"],
+    lambda: _gate_samples("active"),
+)
+gauge(
+    "ai_story_backend_queued_generations",
+    "Generations waiting for a backend slot.",
+    ["gate"],
+    lambda: _gate_samples("queued"),
+)
+gauge(
+    "ai_story_backend_concurrency_limit",
+    "Configured concurrent generations per backend gate.",
+    ["gate"],
+    lambda: _gate_samples("limit"),
+)
+gauge(
+    "ai_story_backend_rejected_total",
+    "Generations rejected because the backend queue was full (HTTP 429).",
+    ["gate"],
+    lambda: _gate_samples("rejected"),
+    type="counter",
+)
+gauge(
+    "ai_story_backend_queue_timeouts_total",
+    "Generations that timed out waiting for a backend slot (HTTP 503).",
+    ["gate"],
+    lambda: _gate_samples("timeouts"),
+    type="counter",
+)
+gauge(
+    "ai_story_db_pool_connections",
+    "SQLite connection pool state.",
+    ["state"],
+    lambda: [
+        (("open",), pool.stats()["open"]),
+        (("idle",), pool.stats()["idle"]),
+        (("max",), pool.stats()["max"]),
+    ],
+)
+gauge(
+    "ai_story_journal_pending_messages",
+    "Messages queued in the write-behind journal.",
+    [],
+    lambda: [((), journal.pending())],
+)
+gauge(
+    "ai_story_journal_write_failures_total",
+    "Failed write-behind journal commits; failed batches are retried.",
+    [],
+    lambda: [((), journal.failures)],
+    type="counter",
+)
+gauge(
+    "ai_story_thread_pool",
+    "Worker threads in use and queued work items per thread pool.",
+    ["pool", "state"],
+    lambda: _worker_threads() + _anyio_limiter(),
+)
+gauge(
+    "ai_story_inflight_generations",
+    "Distinct generations in flight after coalescing identical requests.",
+    [],
+    lambda: [((), singleflight.stats()["in_flight"])],
+)
+gauge(
+    "ai_story_coalesced_requests_total",
+    "Requests that joined an identical in-flight generation.",
+    [],
+    lambda: [((), singleflight.stats()["joined"])],
+    type="counter",
+)
+gauge(
+    "ai_story_completion_cache_requests_total",
+    "Completion cache lookups, by result.",
+    ["result"],
+    lambda: [
+        (("memory_hit",), completion_cache.stats()["memory_hits"]),
+        (("db_hit",), completion_cache.stats()["db_hits"]),
+        (("miss",), completion_cache.stats()["misses"]),
+    ],
+    type="counter",
+)
+gauge(
+    "ai_story_context_cache_requests_total",
+    "Context reads answered from the in-process context cache, by result.",
+    ["result"],
+    lambda: [
+        (("hit",), context_cache.stats()["hits"]),
+        (("miss",), context_cache.stats()["misses"]),
+    ],
+    type="counter",
+)
+gauge(
+    "ai_story_context_cache_bytes",
+    "Message text held by the context cache.",
+    [],
+    lambda: [((), context_cache.stats()["bytes"])],
+)
+gauge(
+    "ai_story_compactions_running",
+    "Background memory compactions in progress.",
+    [],
+    lambda: [((), compactor.stats()["running"])],
+)
+gauge(
+    "ai_story_retention_pruned_messages_total",
+    "Messages deleted by the retention policy.",
+    [],
+    lambda: [((), retention.pruned)],
+    type="counter",
+)
+gauge(
+    "ai_story_stored_messages",
+    "Messages stored per agent (refreshed at most every 30 seconds).",
+    ["agent"],
+    _stored_messages,
+)
+
+
+async def render() -> str:
+    """The Prometheus text for a scrape; refreshes the cached DB counts first."""
+    await to_thread(_refresh_message_counts)
+    return REGISTRY.render()
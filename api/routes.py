@@ -1,17 +1,66 @@
+import asyncio
+import functools
 import os
-from sqlite3 import Connection
-from typing import List, Optional
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional, Tuple, Union
 
-import ollama
-from fastapi import APIRouter, Depends, HTTPException
-from openai import OpenAI
-from pydantic import BaseModel
-from starlette.concurrency import run_in_threadpool
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
-from agents import Agent
-from db.queries import load_agent
+if TYPE_CHECKING:
+    # Only for annotations, so the openai SDK is not imported at startup
+    from openai.types.chat import (
+        ChatCompletionAssistantMessageParam,
+        ChatCompletionSystemMessageParam,
+        ChatCompletionUserMessageParam,
+    )
 
-from .dependencies import get_db
+    ChatMessage = Union[
+        ChatCompletionSystemMessageParam,
+        ChatCompletionUserMessageParam,
+        ChatCompletionAssistantMessageParam,
+    ]
+from pydantic import BaseModel
+
+from agents import Agent, registry
+from agents.models import fts_query
+from agents.manager import StreamCleaner, clean_reply
+from agents.cache import cache_key, completion_cache
+from agents.context_cache import context_cache
+from agents.compaction import SUMMARY_MAX_TOKENS, build_summary_prompt, compactor
+from agents.context import build_context, generation_params, input_budget
+from agents.providers import get_provider
+from agents.roster import roster_cache
+from agents.tokens import count_tokens, tokenizer_for
+from agents.warmup import connection_checks, model_pool
+from agents.scheduler import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    AdmissionError,
+    scheduler,
+)
+from agents.singleflight import singleflight
+from db import (
+    NdjsonImporter,
+    create_session,
+    delete_session,
+    export_lines,
+    journal,
+    list_sessions,
+    load_session,
+    read_connection,
+    save_messages,
+    purge_messages,
+    reclaim_space,
+    retention,
+    search_messages,
+    session_messages,
+    write_connection,
+)
+from telemetry import span, to_thread
+
+from .metrics import render as render_metrics
+from .pagination import decode_cursor, encode_cursor
+from .sse import SSE_HEADERS, sse_event
 
 router = APIRouter()
 
@@ -26,204 +75,530 @@ class Settings(BaseModel):
     githubModel: Optional[str] = "openai/gpt-4o-mini"
 
 
+AGENT_FIELDS = ("id", "name", "persona")
+
+
 @router.get("/agents")
-async def get_agents(db: Connection = Depends(get_db)):
-    """Get all available agents."""
-    cur = db.cursor()
-    cur.execute("SELECT id, name, persona FROM agents")
-    agents = cur.fetchall()
-    return [{"id": agent[0], "name": agent[1], "persona": agent[2]} for agent in agents]
+async def get_agents(fields: Optional[str] = None):
+    """Get all available agents.
+
+    fields is a comma separated subset of id, name and persona, e.g.
+    "id,name" to leave out the persona texts.
+    """
+    selected = AGENT_FIELDS
+    if fields:
+        selected = tuple(f.strip() for f in fields.split(",") if f.strip())
+        unknown = [f for f in selected if f not in AGENT_FIELDS]
+        if unknown:
+            raise HTTPException(
+                status_code=400, detail=f"Unknown agent fields: {', '.join(unknown)}"
+            )
+    return [
+        {field: getattr(agent, field) for field in selected} for agent in registry.all()
+    ]
+
+
+def history_page(agent: Agent, limit: int, before: Optional[str] = None):
+    """One page of an agent's history, oldest first, plus the cursor of the
+    next older page (None when there is nothing older). Blocking; call it
+    through to_thread."""
+    # One extra row tells whether an older page exists
+    with read_connection() as con:
+        rows = agent.get_history_page(con.cursor(), limit + 1, decode_cursor(before, 2))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
+    messages = [
+        {"id": row[0], "role": row[1], "content": row[2], "created_at": row[3]}
+        for row in reversed(rows)
+    ]
+    return messages, next_cursor
 
 
 @router.get("/agents/{agent_name}")
-async def get_agent_details(agent_name: str, db: Connection = Depends(get_db)):
-    """Get details for a specific agent including recent memory."""
-    cur = db.cursor()
+async def get_agent_details(
+    agent_name: str,
+    limit: int = Query(20, ge=1, le=200),
+):
+    """Get details for a specific agent including recent memory.
 
-    agent_data = load_agent(agent_name)
-    if not agent_data:
+    next_cursor pages further back through /agents/{agent_name}/messages.
+    """
+    agent = registry.get(agent_name)
+    if not agent:
         raise HTTPException(status_code=404, detail=f"Agent {agent_name} not found")
 
-    agent = Agent(**agent_data)
-
-    recent_messages = agent.get_conversation_history(cur, limit=20)
+    messages, next_cursor = await to_thread(history_page, agent, limit)
 
     return {
         "id": agent.id,
         "name": agent.name,
         "persona": agent.persona,
-        "recent_messages": recent_messages,
+        "generation": generation_params(agent),
+        "recent_messages": [
+            {"role": m["role"], "content": m["content"]} for m in messages
+        ],
+        "next_cursor": next_cursor,
     }
 
 
+@router.get("/agents/{agent_name}/messages")
+async def get_agent_messages(
+    agent_name: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+):
+    """Page backwards through an agent's message history.
+
+    Each page is in chronological order; pass its next_cursor as before to
+    get the page of older messages.
+    """
+    agent = registry.get(agent_name)
+    if not agent:
+        raise HTTPException(status_code=404, detail=f"Agent {agent_name} not found")
+
+    messages, next_cursor = await to_thread(history_page, agent, limit, before)
+    return {"agent": agent.name, "messages": messages, "next_cursor": next_cursor}
+
+
+@router.get("/search")
+async def search(
+    q: str,
+    agent_name: Optional[str] = None,
+    session_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    before: Optional[str] = None,
+):
+    """Full-text search across all agents' messages, newest matches first.
+
+    Every word of q must match (words are stemmed, case is ignored);
+    agent_name and session_id narrow the search. Pass next_cursor as before
+    for the next page.
+    """
+    match = fts_query(q, operator="AND")
+    if match is None:
+        raise HTTPException(status_code=400, detail="Search query has no words")
+
+    agent_id = None
+    if agent_name:
+        agent = registry.get(agent_name)
+        if not agent:
+            raise HTTPException(status_code=404, detail=f"Agent {agent_name} not found")
+        agent_id = agent.id
+
+    cursor = decode_cursor(before, 1)
+    results = await to_thread(
+        search_messages,
+        match,
+        agent_id,
+        cursor[0] if cursor else None,
+        limit + 1,
+        session_id,
+    )
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor(results[-1]["id"])
+    return {"query": q, "results": results, "next_cursor": next_cursor}
+
+
 class ChatRequest(BaseModel):
     prompt: str
     agent_name: Optional[str] = None
     api: Optional[str] = "ollama"
     settings: Optional[Settings] = None
+    use_cache: bool = True
+    # Story to continue; None is the default session. new_session starts one.
+    session_id: Optional[int] = None
+    new_session: bool = False
+
+
+async def resolve_session(
+    session_id: Optional[int], new_session: bool, title: str
+) -> Optional[int]:
+    """The session a request runs in: a new one, an existing one (404 if it
+    does not exist) or None for the default session."""
+    if new_session:
+        session = await to_thread(create_session, title[:80])
+        return session["id"]
+    if session_id is not None:
+        if await to_thread(load_session, session_id) is None:
+            raise HTTPException(
+                status_code=404, detail=f"Session {session_id} not found"
+            )
+    return session_id
 
 
-def run_agent_with_settings(
+def build_agent_history(
     agent: Agent,
     event: str,
     cursor,
     all_agents: List[Agent],
+    session_id: Optional[int] = None,
     api="ollama",
     settings: Optional[Settings] = None,
-) -> str:
-    """Enhanced run_agent function that uses custom settings."""
-
-    # Load the agent's memory from database
-    memory = agent.load_memory(cursor)
-
-    # Get info of all other personas as info in system_prompt
-    others = [a for a in all_agents if a.name != agent.name]
-    others_info = ", ".join([f"{a.name} ({a.persona})" for a in others])
-
-    system_prompt = (
-        f"You are {agent.name}, defined as: {agent.persona}. "
-        + (f"You know the others: {others_info}. " if others_info else "")
-        + (
-            "Speak only as yourself. Never speak for other characters. "
-            "Stay fully in character and never copy others' speech patterns."
-            "Avoid filler or flowery language. "
-            "Do not include the other characters' lines in your response. "
-            "Avoid em dashes — and asteriks * use simple punctuation."
-            "Be yourself, but don't cling too much to your persona"
-            "Try to make it an intresting story create new events if fitting"
-            "Use max 20 words."
-        )
+) -> "List[ChatMessage]":
+    """Build the message list sent to the backend for one agent turn, within
+    the input budget of the backend/model that will answer it."""
+    model = selected_model(api, settings)
+    return build_context(
+        agent,
+        event,
+        cursor,
+        all_agents,
+        session_id,
+        input_budget(api, model),
+        tokenizer_for(api, model),
     )
 
-    from typing import Union
 
-    from openai.types.chat import (
-        ChatCompletionAssistantMessageParam,
-        ChatCompletionSystemMessageParam,
-        ChatCompletionUserMessageParam,
-    )
+def selected_model(api="ollama", settings: Optional[Settings] = None) -> str:
+    """The model a request runs on, from its settings or the backend default."""
+    if api == "ollama":
+        if settings and settings.ollamaUrl and settings.ollamaModel:
+            return settings.ollamaModel
+        return "mythomax:latest"
+    elif api == "openai":
+        return (
+            settings.openaiModel if settings and settings.openaiModel else "gpt-4o-mini"
+        )
+    elif api == "github":
+        return (
+            settings.githubModel
+            if settings and settings.githubModel
+            else "openai/gpt-4o-mini"
+        )
+    # resolve_backend reports unsupported backends
+    return ""
+
+
+def resolve_backend(api="ollama", settings: Optional[Settings] = None):
+    """Pick the pooled provider, model and backend default params for a request.
+
+    Output limits and stop sequences come from the agent's generation
+    profile (agents.context.generation_params) on top of these.
+    """
+    model = selected_model(api, settings)
+    if api == "ollama":
+        # Use custom Ollama settings if provided
+        if settings and settings.ollamaUrl:
+            return get_provider("ollama", settings.ollamaUrl), model, {}
+        return get_provider("ollama"), model, {}
+
+    elif api == "openai":
+        # Use custom OpenAI settings if provided
+        api_key = (
+            settings.openaiApiKey
+            if settings and settings.openaiApiKey
+            else os.environ.get("OPENAI_API_KEY")
+        )
+        base_url = (
+            settings.openaiBaseUrl
+            if settings and settings.openaiBaseUrl
+            else "https://api.openai.com/v1"
+        )
 
-    system_message: ChatCompletionSystemMessageParam = {
-        "role": "system",
-        "content": system_prompt,
-    }
-    history: List[
-        Union[
-            ChatCompletionSystemMessageParam,
-            ChatCompletionUserMessageParam,
-            ChatCompletionAssistantMessageParam,
-        ]
-    ] = [system_message]
-
-    # Add recent memory for context (last 20 messages)
-    recent_memory = memory[-20:] if len(memory) > 20 else memory
-    for msg in recent_memory:
-        assistant_message: ChatCompletionAssistantMessageParam = {
-            "role": "assistant",
-            "content": msg,
-        }
-        history.append(assistant_message)
+        if not api_key:
+            raise ValueError("OpenAI API key not provided in settings or environment")
 
-    # Add the current event/prompt
-    user_message: ChatCompletionUserMessageParam = {"role": "user", "content": event}
-    history.append(user_message)
+        provider = get_provider("openai", base_url, api_key)
+        return provider, model, {"temperature": 0.7}
 
-    try:
-        if api == "ollama":
-            # Use custom Ollama settings if provided
-            if settings and settings.ollamaUrl:
-                # Set custom Ollama host
-                client = ollama.Client(host=settings.ollamaUrl)
-                model = (
-                    settings.ollamaModel if settings.ollamaModel else "mythomax:latest"
-                )
-                response = client.chat(model=model, messages=history)
-            else:
-                response = ollama.chat(model="mythomax:latest", messages=history)
+    elif api == "github":
+        # Use GitHub Models settings
+        github_token = (
+            settings.githubToken
+            if settings and settings.githubToken
+            else os.environ.get("GITHUB_TOKEN")
+        )
 
-            content = response.get("message", {}).get("content", "")
-            raw_reply = content if isinstance(content, str) else ""
+        if not github_token:
+            raise ValueError("GitHub token not provided in settings or environment")
 
-        elif api == "openai":
-            # Use custom OpenAI settings if provided
-            api_key = (
-                settings.openaiApiKey
-                if settings and settings.openaiApiKey
-                else os.environ.get("OPENAI_API_KEY")
-            )
-            base_url = (
-                settings.openaiBaseUrl
-                if settings and settings.openaiBaseUrl
-                else "https://api.openai.com/v1"
-            )
-            model = (
-                settings.openaiModel
-                if settings and settings.openaiModel
-                else "gpt-4o-mini"
-            )
+        provider = get_provider(
+            "github", "https://models.github.ai/inference", github_token
+        )
+        return provider, model, {}
 
-            if not api_key:
-                raise ValueError(
-                    "OpenAI API key not provided in settings or environment"
-                )
+    raise ValueError(f"Unsupported API: {api}")
 
-            client = OpenAI(api_key=api_key, base_url=base_url)
-            response = client.chat.completions.create(
-                messages=history,
-                temperature=0.7,
-                max_tokens=4000,
-                model=model,
-            )
-            content = response.choices[0].message.content
-            raw_reply = content if content is not None else ""
-
-        elif api == "github":
-            # Use GitHub Models settings
-            github_token = (
-                settings.githubToken
-                if settings and settings.githubToken
-                else os.environ.get("GITHUB_TOKEN")
+
+async def generate_agent_reply(
+    agent: Agent,
+    history,
+    api="ollama",
+    settings: Optional[Settings] = None,
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+    session_id: Optional[int] = None,
+) -> Tuple[str, bool]:
+    """Get the cleaned reply for a prepared history without saving it.
+
+    With the completion cache enabled, a prompt answered before is served from
+    the cache without a backend call unless use_cache is False. Identical
+    concurrent requests in the same session share one backend call, which
+    waits for a scheduler slot at the given priority. Returns (reply, leader):
+    only the leader should save the reply. Backend errors are returned as the
+    reply text; admission errors are raised.
+    """
+    leader = True
+    try:
+        provider, model, params = resolve_backend(api, settings)
+        params = {**params, **generation_params(agent, api, model)}
+        key = cache_key(api, model, params, history)
+        caching = use_cache and completion_cache.enabled
+        raw_reply = None
+        if caching:
+            # Cache misses read SQLite; keep that off the event loop
+            with span("cache"):
+                raw_reply = await to_thread(completion_cache.get, key)
+        if raw_reply is None:
+
+            async def store(raw: str):
+                if caching:
+                    await to_thread(completion_cache.put, key, raw)
+
+            chunks, leader = singleflight.join(
+                f"{key}/{session_id}",
+                lambda: complete_once(provider, model, history, params, api, priority),
+                store,
             )
-            model = (
-                settings.githubModel
-                if settings and settings.githubModel
-                else "openai/gpt-4o-mini"
+            raw_reply = "".join([chunk async for chunk in chunks])
+        with span("clean"):
+            reply = clean_reply(raw_reply)
+        return reply, leader
+    except AdmissionError:
+        raise
+    except Exception as e:
+        error_msg = (
+            f"Error generating response for {agent.name} with {api} API: {str(e)}"
+        )
+        return error_msg, leader
+
+
+async def complete_once(
+    provider, model: str, history, params: dict, api: str, priority: int
+) -> AsyncIterator[str]:
+    """Run a non-streamed completion in a scheduler slot, as a one-chunk stream."""
+    async with scheduler.slot(api, model, priority):
+        with span("llm"):
+            reply = await provider.complete(model, history, **params)
+    yield reply
+
+
+def schedule_compaction(
+    agent: Agent,
+    api="ollama",
+    settings: Optional[Settings] = None,
+    session_id: Optional[int] = None,
+):
+    """Fold the agent's older memory in a session into its summary in the
+    background."""
+
+    async def summarize(previous: Optional[str], messages: List[str]) -> str:
+        provider, model, _ = resolve_backend(api, settings)
+        async with scheduler.slot(api, model, PRIORITY_BATCH):
+            raw = await provider.complete(
+                model,
+                build_summary_prompt(previous, messages),
+                max_tokens=SUMMARY_MAX_TOKENS,
             )
+        return clean_reply(raw)
+
+    compactor.maybe_schedule(agent, summarize, session_id)
+
+
+def check_admission(api="ollama", settings: Optional[Settings] = None):
+    """Reject with 429 before a streamed response starts if the backend queue is full."""
+    try:
+        _, model, _ = resolve_backend(api, settings)
+    except ValueError:
+        # Configuration errors are reported by the stream itself
+        return
+    scheduler.check(api, model)
 
-            if not github_token:
-                raise ValueError("GitHub token not provided in settings or environment")
 
-            client = OpenAI(
-                base_url="https://models.github.ai/inference",
-                api_key=github_token,
+async def load_history(
+    agent: Agent,
+    event: str,
+    all_agents: List[Agent],
+    session_id: Optional[int] = None,
+    api="ollama",
+    settings: Optional[Settings] = None,
+) -> "List[ChatMessage]":
+    """build_agent_history on a pooled connection in a worker thread, so a
+    busy database never blocks the event loop. Traced as "history"."""
+
+    def load():
+        with read_connection() as con:
+            return build_agent_history(
+                agent, event, con.cursor(), all_agents, session_id, api, settings
             )
-            response = client.chat.completions.create(
-                messages=history,
-                max_completion_tokens=4000,
-                model=model,
+
+    with span("history"):
+        return await to_thread(load)
+
+
+async def save_reply(
+    agent: Agent,
+    reply: str,
+    session_id: Optional[int] = None,
+    api="ollama",
+    settings: Optional[Settings] = None,
+):
+    """Save an agent's reply on the writer connection, in a worker thread;
+    waiting for the write lock must not block the event loop. In write-behind
+    mode the reply is only queued on the journal and the writer is not taken,
+    so the request never waits on a journal commit. Its token count is stored
+    for the tokenizer of the backend/model that wrote it. Traced as "save"."""
+
+    def save():
+        # Loading a tiktoken encoding the first time may download it
+        tokenizer = tokenizer_for(api, selected_model(api, settings))
+
+        def add(cursor):
+            agent.add_memory(
+                cursor,
+                reply,
+                role="assistant",
+                session_id=session_id,
+                tokenizer=tokenizer,
             )
-            content = response.choices[0].message.content
-            raw_reply = content if content is not None else ""
-        else:
-            raise ValueError(f"Unsupported API: {api}")
 
-        from agents.manager import clean_reply
+        if journal.enabled:
+            # Only queued; like save_messages, no writer needed
+            add(None)
+            return
+        with write_connection() as con:
+            add(con.cursor())
+
+    with span("save"):
+        await to_thread(save)
+
+
+async def run_agent_with_settings(
+    agent: Agent,
+    event: str,
+    all_agents: List[Agent],
+    api="ollama",
+    settings: Optional[Settings] = None,
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+    session_id: Optional[int] = None,
+) -> str:
+    """Enhanced run_agent function that uses custom settings.
+
+    Only the backend call runs on the event loop; reading the history and
+    saving the reply run in worker threads.
+    """
+    history = await load_history(agent, event, all_agents, session_id, api, settings)
+    reply, leader = await generate_agent_reply(
+        agent, history, api, settings, use_cache, priority, session_id
+    )
+    if leader:
+        await save_reply(agent, reply, session_id, api, settings)
+        schedule_compaction(agent, api, settings, session_id)
+    return reply
+
+
+async def replay_completion(text: str) -> AsyncIterator[str]:
+    """Serve a cached completion through the streaming code path."""
+    yield text
+
+
+async def scheduled_stream(
+    deltas: AsyncIterator[str], api: str, model: str, priority: int
+) -> AsyncIterator[str]:
+    """Hold a scheduler slot for as long as a backend stream is being read."""
+    async with scheduler.slot(api, model, priority):
+        with span("llm"):
+            async for delta in deltas:
+                yield delta
+
+
+async def stream_agent_with_settings(
+    agent: Agent,
+    event: str,
+    all_agents: List[Agent],
+    api="ollama",
+    settings: Optional[Settings] = None,
+    use_cache: bool = True,
+    priority: int = PRIORITY_INTERACTIVE,
+    session_id: Optional[int] = None,
+) -> AsyncIterator[Tuple[str, str]]:
+    """Streaming run_agent_with_settings.
+
+    Yields ("token", text) pieces as the backend produces them, already
+    cleaned, then a final ("done", reply) or ("error", message). The reply is
+    cached and saved to memory once by the generation itself when identical
+    requests share it, so it is kept even if the request that started it
+    disconnects; admission errors are reported but not saved. Memory is read
+    on a pooled connection and the reply saved on the writer connection, both
+    in worker threads; neither is held during generation.
+    """
+    history = await load_history(agent, event, all_agents, session_id, api, settings)
+    cleaner = StreamCleaner()
+    raw_reply = ""
+    leader = True
+
+    try:
+        provider, model, params = resolve_backend(api, settings)
+        params = {**params, **generation_params(agent, api, model)}
+        key = cache_key(api, model, params, history)
+        caching = use_cache and completion_cache.enabled
+        cached = None
+        if caching:
+            with span("cache"):
+                cached = await to_thread(completion_cache.get, key)
+        if cached is not None:
+            deltas = replay_completion(cached)
+        else:
 
-        reply = clean_reply(raw_reply)
-        agent.add_memory(cursor, reply, role="assistant")
-        return reply
+            async def persist(raw: str):
+                if caching:
+                    await to_thread(completion_cache.put, key, raw)
+                await save_reply(agent, clean_reply(raw), session_id, api, settings)
+                schedule_compaction(agent, api, settings, session_id)
+
+            deltas, leader = singleflight.join(
+                f"{key}/{session_id}",
+                lambda: scheduled_stream(
+                    provider.stream(model, history, **params), api, model, priority
+                ),
+                persist,
+            )
+        async for delta in deltas:
+            raw_reply += delta
+            visible = cleaner.feed(delta)
+            if visible:
+                yield "token", visible
+        rest = cleaner.finish()
+        if rest:
+            yield "token", rest
+    except AdmissionError as e:
+        yield "error", f"{agent.name} could not start: {e}"
+        return
     except Exception as e:
         error_msg = (
             f"Error generating response for {agent.name} with {api} API: {str(e)}"
         )
-        agent.add_memory(cursor, error_msg, role="assistant")
-        return error_msg
+        if leader:
+            await save_reply(agent, error_msg, session_id, api, settings)
+        yield "error", error_msg
+        return
+
+    reply = clean_reply(raw_reply)
+    if cached is not None:
+        # Replayed from the cache, so no generation saved it
+        await save_reply(agent, reply, session_id, api, settings)
+        schedule_compaction(agent, api, settings, session_id)
+    yield "done", reply
 
 
 @router.post("/chat")
-async def chat_with_agent(request: ChatRequest, db: Connection = Depends(get_db)):
+async def chat_with_agent(request: ChatRequest):
     """Chat with a specific agent."""
-    cur = db.cursor()
 
     if request.api not in ["ollama", "openai", "github"]:
         raise HTTPException(
@@ -233,34 +608,89 @@ async def chat_with_agent(request: ChatRequest, db: Connection = Depends(get_db)
     if not request.agent_name:
         raise HTTPException(status_code=400, detail="agent_name is required")
 
-    agent_data = load_agent(request.agent_name)
-    if not agent_data:
-        raise HTTPException(
-            status_code=404, detail=f"Agent {request.agent_name} not found"
-        )
-
-    agent = Agent(**agent_data)
-
-    cur.execute("SELECT id, name, persona FROM agents")
-    all_agent_data = cur.fetchall()
-    all_agents = [
-        Agent(id=row[0], name=row[1], persona=row[2]) for row in all_agent_data
-    ]
+    with span("agents"):
+        agent = registry.get(request.agent_name)
+        if not agent:
+            raise HTTPException(
+                status_code=404, detail=f"Agent {request.agent_name} not found"
+            )
+        all_agents = registry.all()
+    session_id = await resolve_session(
+        request.session_id, request.new_session, request.prompt
+    )
 
-    # Run in thread pool to avoid blocking
-    response = await run_in_threadpool(
-        run_agent_with_settings,
+    response = await run_agent_with_settings(
         agent,
         request.prompt,
-        cur,
         all_agents,
         request.api,
         request.settings or Settings(),
+        request.use_cache,
+        session_id=session_id,
     )
 
-    db.commit()
+    return {
+        "agent": request.agent_name,
+        "response": response,
+        "api": request.api,
+        "session_id": session_id,
+    }
+
+
+@router.post("/chat/stream")
+async def stream_chat_with_agent(request: ChatRequest):
+    """Chat with a specific agent, streaming the reply as Server-Sent Events.
+
+    Emits "token" events with {"delta": ...} while the reply is generated and
+    a final "done" event with the full cleaned reply (or "error").
+    """
+
+    if request.api not in ["ollama", "openai", "github"]:
+        raise HTTPException(
+            status_code=400, detail="API must be either 'ollama', 'openai', or 'github'"
+        )
 
-    return {"agent": request.agent_name, "response": response, "api": request.api}
+    if not request.agent_name:
+        raise HTTPException(status_code=400, detail="agent_name is required")
+
+    agent = registry.get(request.agent_name)
+    if not agent:
+        raise HTTPException(
+            status_code=404, detail=f"Agent {request.agent_name} not found"
+        )
+
+    all_agents = registry.all()
+    check_admission(request.api, request.settings)
+    session_id = await resolve_session(
+        request.session_id, request.new_session, request.prompt
+    )
+
+    async def events():
+        async for kind, payload in stream_agent_with_settings(
+            agent,
+            request.prompt,
+            all_agents,
+            request.api,
+            request.settings or Settings(),
+            request.use_cache,
+            session_id=session_id,
+        ):
+            if kind == "token":
+                yield sse_event("token", {"delta": payload})
+                continue
+            yield sse_event(
+                kind,
+                {
+                    "agent": request.agent_name,
+                    "response": payload,
+                    "api": request.api,
+                    "session_id": session_id,
+                },
+            )
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers=SSE_HEADERS
+    )
 
 
 class ConversationRequest(BaseModel):
@@ -269,15 +699,19 @@ class ConversationRequest(BaseModel):
     turns: int = 3
     api: Optional[str] = "ollama"
     settings: Optional[Settings] = None
+    use_cache: bool = True
+    session_id: Optional[int] = None
+    new_session: bool = False
 
 
-def create_agent_conversation_with_settings(
+async def create_agent_conversation_with_settings(
     agents: List[Agent],
     initial_prompt: str,
-    cursor,
     turns: int = 3,
     api="ollama",
     settings: Optional[Settings] = None,
+    use_cache: bool = True,
+    session_id: Optional[int] = None,
 ):
     """Enhanced conversation function that uses custom settings."""
     conversation = []
@@ -298,21 +732,24 @@ def create_agent_conversation_with_settings(
         else:
             context = current_prompt
 
-        response = run_agent_with_settings(
-            current_agent, context, cursor, agents, api, settings
+        response = await run_agent_with_settings(
+            current_agent,
+            context,
+            agents,
+            api,
+            settings,
+            use_cache,
+            priority=PRIORITY_BATCH,
+            session_id=session_id,
         )
         conversation.append({current_agent.name: response})
-        cursor.connection.commit()
 
     return conversation
 
 
 @router.post("/conversation")
-async def create_conversation(
-    request: ConversationRequest, db: Connection = Depends(get_db)
-):
+async def create_conversation(request: ConversationRequest):
     """Create a multi-turn conversation between specified agents."""
-    cur = db.cursor()
 
     if request.api not in ["ollama", "openai", "github"]:
         raise HTTPException(
@@ -322,25 +759,27 @@ async def create_conversation(
     # Load specified agents
     agents = []
     for agent_name in request.agent_names:
-        agent_data = load_agent(agent_name)
-        if not agent_data:
+        agent = registry.get(agent_name)
+        if not agent:
             raise HTTPException(status_code=404, detail=f"Agent {agent_name} not found")
-        agents.append(Agent(**agent_data))
+        agents.append(agent)
 
     if len(agents) < 2:
         raise HTTPException(
             status_code=400, detail="Need at least 2 agents for a conversation"
         )
 
-    # Create conversation in thread pool
-    conversation = await run_in_threadpool(
-        create_agent_conversation_with_settings,
+    session_id = await resolve_session(
+        request.session_id, request.new_session, request.prompt
+    )
+    conversation = await create_agent_conversation_with_settings(
         agents,
         request.prompt,
-        cur,
         request.turns,
         request.api,
         request.settings or Settings(),
+        request.use_cache,
+        session_id,
     )
 
     return {
@@ -349,9 +788,291 @@ async def create_conversation(
         "turns": request.turns,
         "conversation": conversation,
         "api": request.api,
+        "session_id": session_id,
+    }
+
+
+@router.post("/conversation/stream")
+async def stream_conversation(request: ConversationRequest, raw_request: Request):
+    """Run a multi-turn conversation server-side, streaming it as Server-Sent Events.
+
+    Agents and the roster are loaded once for the whole conversation. Each turn
+    emits "turn", then "token" events, then "message" with the cleaned reply.
+    A final "done" event carries the full conversation. If a turn fails an
+    "error" event is sent and the conversation stops. Closing the connection
+    cancels the remaining turns.
+    """
+
+    if request.api not in ["ollama", "openai", "github"]:
+        raise HTTPException(
+            status_code=400, detail="API must be either 'ollama', 'openai', or 'github'"
+        )
+
+    # Load specified agents
+    agents = []
+    for agent_name in request.agent_names:
+        agent = registry.get(agent_name)
+        if not agent:
+            raise HTTPException(status_code=404, detail=f"Agent {agent_name} not found")
+        agents.append(agent)
+
+    if len(agents) < 2:
+        raise HTTPException(
+            status_code=400, detail="Need at least 2 agents for a conversation"
+        )
+
+    all_agents = registry.all()
+    settings = request.settings or Settings()
+    check_admission(request.api, settings)
+    session_id = await resolve_session(
+        request.session_id, request.new_session, request.prompt
+    )
+
+    async def events():
+        conversation = []
+
+        for turn in range(request.turns):
+            if await raw_request.is_disconnected():
+                return
+
+            current_agent = agents[turn % len(agents)]
+
+            if conversation:
+                last_speaker, last_line = list(conversation[-1].items())[0]
+                context = (
+                    f"{last_speaker} said: {last_line}\n"
+                    f"Respond as {current_agent.name}."
+                )
+            else:
+                context = request.prompt
+
+            yield sse_event("turn", {"turn": turn, "agent": current_agent.name})
+
+            async for kind, payload in stream_agent_with_settings(
+                current_agent,
+                context,
+                all_agents,
+                request.api,
+                settings,
+                request.use_cache,
+                priority=PRIORITY_BATCH,
+                session_id=session_id,
+            ):
+                if kind == "token":
+                    yield sse_event("token", {"turn": turn, "delta": payload})
+                    continue
+
+                event = "message" if kind == "done" else "error"
+                yield sse_event(
+                    event,
+                    {
+                        "turn": turn,
+                        "agent": current_agent.name,
+                        "response": payload,
+                    },
+                )
+                if kind == "error":
+                    return
+                conversation.append({current_agent.name: payload})
+
+        yield sse_event(
+            "done",
+            {
+                "prompt": request.prompt,
+                "agents": [agent.name for agent in agents],
+                "turns": request.turns,
+                "conversation": conversation,
+                "api": request.api,
+                "session_id": session_id,
+            },
+        )
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
+class BroadcastRequest(BaseModel):
+    prompt: str
+    agent_names: Optional[List[str]] = None
+    api: Optional[str] = "ollama"
+    settings: Optional[Settings] = None
+    use_cache: bool = True
+    session_id: Optional[int] = None
+    new_session: bool = False
+
+
+def broadcast_targets(request: BroadcastRequest) -> List[Agent]:
+    """Validate a broadcast request; no agent_names means every agent."""
+    if request.api not in ["ollama", "openai", "github"]:
+        raise HTTPException(
+            status_code=400, detail="API must be either 'ollama', 'openai', or 'github'"
+        )
+
+    if request.agent_names is None:
+        return registry.all()
+
+    agents = []
+    for agent_name in request.agent_names:
+        agent = registry.get(agent_name)
+        if not agent:
+            raise HTTPException(status_code=404, detail=f"Agent {agent_name} not found")
+        agents.append(agent)
+    return agents
+
+
+async def start_broadcast(
+    agents: List[Agent], request: BroadcastRequest, session_id: Optional[int]
+) -> List["asyncio.Task[Tuple[Agent, str, bool]]"]:
+    """Start one generation task per agent; the scheduler caps concurrency.
+
+    Histories are read on one pooled connection in a worker thread.
+    """
+    all_agents = registry.all()
+    settings = request.settings or Settings()
+
+    def load_histories():
+        with read_connection() as con:
+            cur = con.cursor()
+            return [
+                build_agent_history(
+                    agent,
+                    request.prompt,
+                    cur,
+                    all_agents,
+                    session_id,
+                    request.api,
+                    settings,
+                )
+                for agent in agents
+            ]
+
+    with span("history"):
+        histories = await to_thread(load_histories)
+
+    async def answer(agent: Agent, history) -> Tuple[Agent, str, bool]:
+        reply, leader = await generate_agent_reply(
+            agent,
+            history,
+            request.api,
+            settings,
+            request.use_cache,
+            priority=PRIORITY_BATCH,
+            session_id=session_id,
+        )
+        return agent, reply, leader
+
+    return [
+        asyncio.create_task(answer(agent, history))
+        for agent, history in zip(agents, histories)
+    ]
+
+
+async def save_broadcast(
+    results: List[Tuple[Agent, str, bool]],
+    request: BroadcastRequest,
+    session_id: Optional[int],
+):
+    """Save the replies this request generated in one transaction, in a worker
+    thread, then schedule compaction of the agents that replied."""
+    rows = [
+        (agent.id, "assistant", reply) for agent, reply, leader in results if leader
+    ]
+
+    def save():
+        tokenizer = tokenizer_for(
+            request.api, selected_model(request.api, request.settings)
+        )
+        count = functools.partial(count_tokens, tokenizer=tokenizer)
+        save_messages(rows, session_id, count, tokenizer)
+
+    if rows:
+        await to_thread(save)
+    for agent, _, leader in results:
+        if leader:
+            schedule_compaction(agent, request.api, request.settings, session_id)
+
+
+@router.post("/broadcast")
+async def broadcast(request: BroadcastRequest):
+    """Send the same prompt to several agents at once and collect every reply.
+
+    Replies are generated concurrently and saved together in one transaction.
+    """
+    agents = broadcast_targets(request)
+    session_id = await resolve_session(
+        request.session_id, request.new_session, request.prompt
+    )
+    tasks = await start_broadcast(agents, request, session_id)
+    try:
+        results = await asyncio.gather(*tasks)
+    except AdmissionError:
+        for task in tasks:
+            task.cancel()
+        raise
+    with span("save"):
+        await save_broadcast(results, request, session_id)
+
+    return {
+        "prompt": request.prompt,
+        "responses": [
+            {"agent": agent.name, "response": reply} for agent, reply, _ in results
+        ],
+        "api": request.api,
+        "session_id": session_id,
     }
 
 
+@router.post("/broadcast/stream")
+async def stream_broadcast(request: BroadcastRequest):
+    """Broadcast a prompt, streaming each agent's reply as soon as it finishes.
+
+    Emits a "message" event per agent in completion order and a final "done"
+    event. Replies that finished are saved in one transaction at the end, also
+    when the client disconnects early.
+    """
+    agents = broadcast_targets(request)
+    check_admission(request.api, request.settings)
+    session_id = await resolve_session(
+        request.session_id, request.new_session, request.prompt
+    )
+
+    async def events():
+        tasks = await start_broadcast(agents, request, session_id)
+        finished: List[Tuple[Agent, str, bool]] = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    agent, reply, leader = await next_done
+                except AdmissionError as e:
+                    yield sse_event(
+                        "error", {"response": str(e), "retry_after": e.retry_after}
+                    )
+                    continue
+                finished.append((agent, reply, leader))
+                yield sse_event("message", {"agent": agent.name, "response": reply})
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Shielded: on disconnect this generator is being cancelled, and
+            # the finished replies must still be saved
+            await asyncio.shield(save_broadcast(finished, request, session_id))
+
+        yield sse_event(
+            "done",
+            {
+                "prompt": request.prompt,
+                "agents": [agent.name for agent, _, _ in finished],
+                "api": request.api,
+                "session_id": session_id,
+            },
+        )
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers=SSE_HEADERS
+    )
+
+
 class TestConnectionRequest(BaseModel):
     api: str
     settings: Settings
@@ -359,134 +1080,256 @@ class TestConnectionRequest(BaseModel):
 
 @router.post("/test-connection")
 async def test_connection(request: TestConnectionRequest):
-    """Test connection to the specified API with given settings."""
+    """Test connection to the specified API with given settings.
+
+    Results are cached for a short while per settings, so repeated clicks
+    do not run a new check against the backend every time.
+    """
+    settings = request.settings
+    key = (request.api, *settings.model_dump().values())
     try:
-        if request.api == "ollama":
-            # Test Ollama connection
-            url = request.settings.ollamaUrl or "http://localhost:11434"
-            model = request.settings.ollamaModel or "mythomax:latest"
-
-            client = ollama.Client(host=url)
-            # Try to get model info or make a simple request
-            try:
-                models = client.list()
-                model_names = [m["name"] for m in models["models"]]
-                if model not in model_names:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Model '{model}' not found. Available models: {
-                            ', '.join(model_names)
-                        }",
-                    )
+        return await connection_checks.run(
+            key, lambda: check_connection(request.api, settings)
+        )
+    except HTTPException:
+        # Re-raise HTTPExceptions as-is
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Connection test failed: {str(e)}")
 
-                # Test with a simple message
-                response = client.chat(
-                    model=model,
-                    messages=[{"role": "user", "content": "Hello"}],
-                    # Limit response length for test
-                    options={"num_predict": 10},
-                )
-                return {
-                    "success": True,
-                    "message": f"Successfully connected to Ollama at {url} with model {model}",
-                }
-            except Exception as e:
-                raise HTTPException(
-                    status_code=400, detail=f"Failed to connect to Ollama: {str(e)}"
-                )
 
-        elif request.api == "openai":
-            # Test OpenAI connection
-            api_key = request.settings.openaiApiKey
-            base_url = request.settings.openaiBaseUrl or "https://api.openai.com/v1"
-            model = request.settings.openaiModel or "gpt-4o-mini"
+async def check_connection(api: str, settings: Settings) -> dict:
+    """Run one connection check; raises HTTPException on failure."""
+    if api == "ollama":
+        # Test Ollama connection
+        url = settings.ollamaUrl or "http://localhost:11434"
+        model = settings.ollamaModel or "mythomax:latest"
 
-            if not api_key:
+        provider = get_provider("ollama", url)
+        # Try to get model info, then load the model, which proves it is
+        # usable and leaves it warm for the first chat
+        try:
+            model_names = await provider.list_models()
+            if model not in model_names:
                 raise HTTPException(
-                    status_code=400, detail="OpenAI API key is required"
+                    status_code=400,
+                    detail=f"Model '{model}' not found. Available models: {
+                        ', '.join(model_names)
+                    }",
                 )
 
-            client = OpenAI(api_key=api_key, base_url=base_url)
-
-            # Test with a simple message
-            response = client.chat.completions.create(
-                messages=[{"role": "user", "content": "Hello"}],
-                model=model,
-                max_tokens=10,
-            )
+            await provider.load(model)
             return {
                 "success": True,
-                "message": f"Successfully connected to OpenAI with model {model}",
+                "message": f"Successfully connected to Ollama at {url} with model {model}",
             }
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=400, detail=f"Failed to connect to Ollama: {str(e)}"
+            )
 
-        elif request.api == "github":
-            # Test GitHub Models connection
-            github_token = request.settings.githubToken
-            model = request.settings.githubModel or "openai/gpt-4o-mini"
+    elif api == "openai":
+        # Test OpenAI connection
+        api_key = settings.openaiApiKey
+        base_url = settings.openaiBaseUrl or "https://api.openai.com/v1"
+        model = settings.openaiModel or "gpt-4o-mini"
 
-            if not github_token:
-                raise HTTPException(status_code=400, detail="GitHub token is required")
+        if not api_key:
+            raise HTTPException(status_code=400, detail="OpenAI API key is required")
 
-            client = OpenAI(
-                base_url="https://models.inference.ai.azure.com",
-                api_key=github_token,
-            )
+        provider = get_provider("openai", base_url, api_key)
 
-            # Test with a simple message
-            response = client.chat.completions.create(
-                messages=[{"role": "user", "content": "Hello"}],
-                model=model,
-                max_tokens=10,
-            )
-            return {
-                "success": True,
-                "message": f"Successfully connected to GitHub Models with model {model}",
-            }
+        # Test with a simple message
+        await provider.complete(
+            model, [{"role": "user", "content": "Hello"}], max_tokens=10
+        )
+        return {
+            "success": True,
+            "message": f"Successfully connected to OpenAI with model {model}",
+        }
 
-        else:
-            raise HTTPException(
-                status_code=400, detail=f"Unsupported API: {request.api}"
-            )
+    elif api == "github":
+        # Test GitHub Models connection
+        github_token = settings.githubToken
+        model = settings.githubModel or "openai/gpt-4o-mini"
 
-    except HTTPException:
-        # Re-raise HTTPExceptions as-is
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Connection test failed: {str(e)}")
+        if not github_token:
+            raise HTTPException(status_code=400, detail="GitHub token is required")
 
+        provider = get_provider(
+            "github", "https://models.inference.ai.azure.com", github_token
+        )
 
-@router.delete("/agents/{agent_name}/memory")
-async def clear_agent_memory(agent_name: str, db: Connection = Depends(get_db)):
-    """Clear all memory for a specific agent."""
-    cur = db.cursor()
+        # Test with a simple message
+        await provider.complete(
+            model, [{"role": "user", "content": "Hello"}], max_tokens=10
+        )
+        return {
+            "success": True,
+            "message": f"Successfully connected to GitHub Models with model {model}",
+        }
+
+    raise HTTPException(status_code=400, detail=f"Unsupported API: {api}")
+
+
+class SessionRequest(BaseModel):
+    title: Optional[str] = None
 
-    agent_data = load_agent(agent_name)
-    if not agent_data:
-        raise HTTPException(status_code=404, detail=f"Agent {agent_name} not found")
 
-    agent = Agent(**agent_data)
-    agent.clear_memory(cur, commit=True)
+@router.post("/sessions")
+async def start_session(request: SessionRequest):
+    """Start a new story; pass its id as session_id to /chat, /conversation
+    and /broadcast."""
+    return await to_thread(create_session, request.title)
+
+
+@router.get("/sessions")
+async def get_sessions(
+    limit: int = Query(50, ge=1, le=200), before: Optional[str] = None
+):
+    """List sessions, newest first. Pass next_cursor as before for more."""
+    cursor = decode_cursor(before, 1)
+    sessions = await to_thread(
+        list_sessions, cursor[0] if cursor else None, limit + 1
+    )
+    next_cursor = None
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        next_cursor = encode_cursor(sessions[-1]["id"])
+    return {"sessions": sessions, "next_cursor": next_cursor}
+
+
+@router.get("/sessions/{session_id}")
+async def get_session(
+    session_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+):
+    """A session with one page of its transcript across all agents.
 
-    return {"message": f"Memory cleared for agent {agent_name}"}
+    Each page is in chronological order; pass its next_cursor as before to
+    get the page of older messages.
+    """
+    session = await to_thread(load_session, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+
+    rows = await to_thread(
+        session_messages, session_id, decode_cursor(before, 2), limit + 1
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][4], rows[-1][0])
+    session["messages"] = [
+        {
+            "id": row[0],
+            "agent": row[1],
+            "role": row[2],
+            "content": row[3],
+            "created_at": row[4],
+        }
+        for row in reversed(rows)
+    ]
+    session["next_cursor"] = next_cursor
+    return session
+
+
+@router.delete("/sessions/{session_id}")
+async def remove_session(session_id: int):
+    """Delete a session with all of its messages and summaries."""
+    deleted = await to_thread(delete_session, session_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {"message": f"Session {session_id} deleted", "deleted": deleted}
+
+
+@router.delete("/agents/{agent_name}/memory")
+async def clear_agent_memory(agent_name: str):
+    """Clear all memory for a specific agent, in chunks (see db.retention)."""
+    agent = registry.get(agent_name)
+    if not agent:
+        raise HTTPException(status_code=404, detail=f"Agent {agent_name} not found")
+    deleted = await to_thread(purge_messages, [agent.id])
+
+    return {"message": f"Memory cleared for agent {agent_name}", "deleted": deleted}
 
 
 @router.post("/clear-all-memory")
-async def clear_all_agent_memory(db: Connection = Depends(get_db)):
-    """Clear all memory for all agents."""
-    cur = db.cursor()
+async def clear_all_agent_memory():
+    """Clear all memory for all agents.
+
+    One set-based purge deleted in short chunks, so other requests keep
+    writing meanwhile, then the freed space is returned to the file system.
+    """
+    deleted = await to_thread(purge_messages)
+    pages = await to_thread(reclaim_space)
+
+    return {
+        "message": "Memory cleared for all agents",
+        "deleted": deleted,
+        "pages_freed": pages,
+    }
+
+
+@router.get("/export")
+async def export_database():
+    """Stream every agent and message as NDJSON, see db.transfer."""
+    return StreamingResponse(export_lines(), media_type="application/x-ndjson")
+
 
-    # Get all agents
-    cur.execute("SELECT id, name, persona FROM agents")
-    all_agent_data = cur.fetchall()
+@router.post("/import")
+async def import_database(request: Request):
+    """Import an NDJSON export from the request body.
 
-    # Clear memory for each agent
-    for agent_data in all_agent_data:
-        agent = Agent(id=agent_data[0], name=agent_data[1], persona=agent_data[2])
-        agent.clear_memory(cur)
+    The body is read as a stream and written in batched transactions, so
+    large exports are imported with constant memory.
+    """
+    importer = NdjsonImporter()
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if importer.feed(line):
+                await to_thread(importer.flush)
+    importer.feed(buffer)
+    await to_thread(importer.flush)
+    return importer.stats()
 
-    db.commit()
 
-    return {"message": "Memory cleared for all agents"}
+@router.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the completion, context and roster caches."""
+    return {
+        **completion_cache.stats(),
+        "context": context_cache.stats(),
+        "roster": roster_cache.stats(),
+    }
+
+
+@router.get("/scheduler/stats")
+async def scheduler_stats():
+    """Active and queued generations per backend gate."""
+    return {
+        "gates": scheduler.stats(),
+        "coalescing": singleflight.stats(),
+        "compaction": compactor.stats(),
+        "retention": retention.stats(),
+        "journal": journal.stats(),
+        "models": model_pool.stats(),
+        "connection_checks": connection_checks.stats(),
+    }
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics in the text exposition format."""
+    return PlainTextResponse(
+        await render_metrics(), media_type="text/plain; version=0.0.4"
+    )
 
 
 # Health check endpoint
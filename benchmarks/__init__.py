@@ -0,0 +1 @@
+"""Benchmark harness and mock LLM backend, see benchmarks/run.py."""
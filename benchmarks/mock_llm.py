@@ -0,0 +1,161 @@
+"""Local stand-in for the Ollama and OpenAI-compatible chat APIs.
+
+Replies after a fixed first-token latency and then emits tokens at a fixed
+rate, so benchmarks measure the service rather than a model. Run it with
+
+    python -m benchmarks.mock_llm --port 11500 --latency-ms 50 --tokens-per-sec 200
+
+and point the app at http://127.0.0.1:11500 (Ollama) or
+http://127.0.0.1:11500/v1 (OpenAI).
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+WORDS = "the lantern flickers as the story takes another strange turn".split()
+
+
+class MockBackend:
+    """Timing model shared by both API flavours."""
+
+    def __init__(self, latency_ms: float, tokens_per_sec: float, reply_tokens: int):
+        self.latency = latency_ms / 1000
+        self.token_interval = 1 / tokens_per_sec if tokens_per_sec > 0 else 0
+        self.reply_tokens = reply_tokens
+        self.requests = 0
+
+    def tokens(self, max_tokens=None):
+        count = min(self.reply_tokens, max_tokens or self.reply_tokens)
+        return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+    async def stream(self, tokens):
+        await asyncio.sleep(self.latency)
+        for token in tokens:
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+            yield token
+
+    async def complete(self, tokens) -> str:
+        await asyncio.sleep(self.latency + self.token_interval * len(tokens))
+        return "".join(tokens)
+
+
+def create_app(backend: MockBackend) -> Starlette:
+    async def ollama_chat(request: Request):
+        body = await request.json()
+        backend.requests += 1
+        options = body.get("options") or {}
+        tokens = backend.tokens(options.get("num_predict"))
+        model = body.get("model", "mock")
+
+        def chunk(content: str, done: bool) -> dict:
+            return {
+                "model": model,
+                "created_at": "2024-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": content},
+                "done": done,
+            }
+
+        if body.get("stream", True):
+
+            async def lines():
+                async for token in backend.stream(tokens):
+                    yield json.dumps(chunk(token, False)) + "\n"
+                yield json.dumps(chunk("", True)) + "\n"
+
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+        return JSONResponse(chunk(await backend.complete(tokens), True))
+
+    async def ollama_tags(request: Request):
+        return JSONResponse({"models": [{"model": "mock", "name": "mock"}]})
+
+    async def openai_chat(request: Request):
+        body = await request.json()
+        backend.requests += 1
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        tokens = backend.tokens(max_tokens)
+        base = {
+            "id": "chatcmpl-mock",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+        }
+
+        if body.get("stream"):
+
+            async def events():
+                async for token in backend.stream(tokens):
+                    delta = {"index": 0, "delta": {"content": token}}
+                    data = {**base, "object": "chat.completion.chunk"}
+                    data["choices"] = [{**delta, "finish_reason": None}]
+                    yield f"data: {json.dumps(data)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        content = await backend.complete(tokens)
+        return JSONResponse(
+            {
+                **base,
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": len(tokens),
+                },
+            }
+        )
+
+    async def openai_models(request: Request):
+        return JSONResponse({"object": "list", "data": [{"id": "mock"}]})
+
+    async def stats(request: Request):
+        return JSONResponse({"requests": backend.requests})
+
+    return Starlette(
+        routes=[
+            Route("/api/chat", ollama_chat, methods=["POST"]),
+            Route("/api/tags", ollama_tags),
+            Route("/v1/chat/completions", openai_chat, methods=["POST"]),
+            Route("/v1/models", openai_models),
+            Route("/stats", stats),
+        ]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Ollama/OpenAI backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-sec", type=float, default=200)
+    parser.add_argument("--reply-tokens", type=int, default=20)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    backend = MockBackend(args.latency_ms, args.tokens_per_sec, args.reply_tokens)
+    uvicorn.run(
+        create_app(backend),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+"""Benchmarks for the service's own overhead, separate from model latency.
+
+Starts benchmarks.mock_llm as the backend, seeds a throwaway database with
+the requested history sizes and then drives /chat, /conversation and the
+memory queries at the requested concurrency. The app runs in-process behind
+an httpx ASGI transport; each request's SQLite time is taken from the db
+entry of its Server-Timing header and reported next to its latency.
+
+    python -m benchmarks.run --history 1000 100000 --concurrency 1 16
+    python -m benchmarks.run --suite db --history 1000000
+    python -m benchmarks.run --compare benchmarks/results/<older>.json
+
+Results are printed and saved as JSON under benchmarks/results/ so runs from
+different commits can be compared with --compare.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def _query_time():
+    # Imported late: the app reads its configuration at import time
+    from telemetry import query_time
+
+    return query_time
+
+
+def server_timing_db_seconds(header: str) -> float:
+    """The db entry of a Server-Timing header, in seconds."""
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if name == "db" and params.startswith("dur="):
+            return float(params[4:]) / 1000
+    return 0.0
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(
+    latencies: List[float], db_times: List[float], errors: int, elapsed: float
+) -> dict:
+    ms = [t * 1000 for t in latencies]
+    db_ms = [t * 1000 for t in db_times]
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ms) / len(ms), 3) if ms else 0.0,
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "db_mean_ms": round(sum(db_ms) / len(db_ms), 3) if db_ms else 0.0,
+        "db_p95_ms": round(percentile(db_ms, 95), 3),
+    }
+
+
+async def run_async(
+    requests: int, concurrency: int, call: Callable[[int], Awaitable[float]]
+) -> dict:
+    """Run call(i) for every i with at most `concurrency` in flight.
+
+    call returns the request's DB seconds; its latency is measured here.
+    """
+    latencies: List[float] = []
+    db_times: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                db_seconds = await call(i)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            db_times.append(db_seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(latencies, db_times, errors, time.perf_counter() - start)
+
+
+def run_threads(requests: int, concurrency: int, call: Callable[[int], None]) -> dict:
+    """Run the synchronous call(i) from `concurrency` threads, timing each."""
+
+    query_time = _query_time()
+
+    def timed(i: int) -> Optional[Tuple[float, float]]:
+        acc = [0.0]
+        token = query_time.set(acc)
+        start = time.perf_counter()
+        try:
+            call(i)
+        except Exception:
+            return None
+        finally:
+            query_time.reset(token)
+        return time.perf_counter() - start, acc[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    ok = [r for r in results if r is not None]
+    return summarize(
+        [r[0] for r in ok], [r[1] for r in ok], len(results) - len(ok), elapsed
+    )
+
+
+WORDS = ["dragons", "keys", "storms", "masks", "maps", "ghosts", "bells", "tides"]
+
+
+def seed_history(agent_ids: List[int], total: int):
+    """Top the messages table up to `total` rows spread over the agents."""
+    from db import write_connection
+
+    with write_connection() as con:
+        existing = con.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    batch = 10000
+    for offset in range(existing, total, batch):
+        rows = [
+            (
+                agent_ids[i % len(agent_ids)],
+                "assistant",
+                f"Seeded line {i} about lanterns, rivers and {random.choice(WORDS)}.",
+            )
+            for i in range(offset, min(offset + batch, total))
+        ]
+        with write_connection() as con:
+            con.executemany(
+                "INSERT INTO messages (agent_id, role, content) VALUES (?, ?, ?)",
+                rows,
+            )
+        if total >= 100000 and (offset // batch) % 10 == 0:
+            print(f"  seeded {offset + len(rows)}/{total} messages", file=sys.stderr)
+
+
+def backend_settings(api: str, mock_url: str) -> dict:
+    if api == "openai":
+        return {
+            "openaiApiKey": "bench",
+            "openaiBaseUrl": f"{mock_url}/v1",
+            "openaiModel": "mock",
+        }
+    return {"ollamaUrl": mock_url, "ollamaModel": "mock"}
+
+
+async def api_suite(args, history: int, concurrency: int, mock_url: str) -> dict:
+    import httpx
+
+    from agents import registry
+    from api import app
+
+    names = [agent.name for agent in registry.all()]
+    settings = backend_settings(args.api, mock_url)
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+
+        async def post(path: str, body: dict) -> float:
+            response = await client.post(path, json=body)
+            response.raise_for_status()
+            return server_timing_db_seconds(response.headers.get("server-timing", ""))
+
+        async def chat(i: int) -> float:
+            return await post(
+                "/chat",
+                {
+                    # A unique prompt per request, so nothing is coalesced
+                    "prompt": f"Benchmark event {i}: what happens next?",
+                    "agent_name": names[i % len(names)],
+                    "api": args.api,
+                    "settings": settings,
+                    "use_cache": False,
+                },
+            )
+
+        async def conversation(i: int) -> float:
+            return await post(
+                "/conversation",
+                {
+                    "prompt": f"Benchmark scene {i} begins.",
+                    "agent_names": [names[i % len(names)], names[(i + 1) % len(names)]],
+                    "turns": args.turns,
+                    "api": args.api,
+                    "settings": settings,
+                    "use_cache": False,
+                },
+            )
+
+        # Warm up first: backend SDKs are imported and connections opened lazily
+        for i in range(args.warmup):
+            await chat(-1 - i)
+
+        tag = f"h={history},c={concurrency}"
+        results[f"chat[{tag}]"] = await run_async(args.requests, concurrency, chat)
+        results[f"conversation[{tag}]"] = await run_async(
+            max(1, args.requests // args.turns), concurrency, conversation
+        )
+    return results
+
+
+def db_suite(args, history: int, concurrency: int) -> dict:
+    from agents import registry
+    from agents.context_cache import context_cache
+    from db import journal, read_connection, write_connection
+
+    agents = registry.all()
+    tag = f"h={history},c={concurrency}"
+
+    def load_memory(i: int):
+        with read_connection() as con:
+            agents[i % len(agents)].load_memory(con.cursor(), limit=20)
+
+    def add_memory(i: int):
+        agent = agents[i % len(agents)]
+        if journal.enabled:
+            # Queued like the app's writes; the writer is not taken
+            agent.add_memory(None, f"Benchmark memory {i}")
+            return
+        with write_connection() as con:
+            agent.add_memory(con.cursor(), f"Benchmark memory {i}")
+
+    def conversation_history(i: int):
+        with read_connection() as con:
+            agents[i % len(agents)].get_conversation_history(con.cursor(), limit=20)
+
+    results = {}
+    # Seeding bypasses the context cache; start it cold
+    context_cache.invalidate()
+    # Reads answered by the context cache, filled on each agent's first read
+    results[f"load_memory[cached,{tag}]"] = run_threads(
+        args.requests, concurrency, load_memory
+    )
+    # The same reads with the cache off, so every one queries SQLite
+    enabled = context_cache.enabled
+    context_cache.enabled = False
+    try:
+        results[f"load_memory[db,{tag}]"] = run_threads(
+            args.requests, concurrency, load_memory
+        )
+    finally:
+        context_cache.enabled = enabled
+        context_cache.invalidate()
+    results[f"add_memory[{tag}]"] = run_threads(args.requests, concurrency, add_memory)
+    results[f"get_conversation_history[{tag}]"] = run_threads(
+        args.requests, concurrency, conversation_history
+    )
+    return results
+
+
+async def run_all(args, agent_ids: List[int], mock_url: Optional[str]) -> dict:
+    # One event loop for everything: pooled clients and the scheduler are
+    # bound to the loop they were first used on
+    results: Dict[str, dict] = {}
+    for history in sorted(args.history):
+        print(f"Seeding {history} messages...", file=sys.stderr)
+        seed_history(agent_ids, history)
+        for concurrency in args.concurrency:
+            if args.suite in ("db", "all"):
+                results.update(db_suite(args, history, concurrency))
+            if args.suite in ("api", "all"):
+                results.update(await api_suite(args, history, concurrency, mock_url))
+    return results
+
+
+def start_mock(args) -> Tuple[subprocess.Popen, str]:
+    import httpx
+
+    url = f"http://127.0.0.1:{args.mock_port}"
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.mock_llm",
+            "--port",
+            str(args.mock_port),
+            "--latency-ms",
+            str(args.latency_ms),
+            "--tokens-per-sec",
+            str(args.tokens_per_sec),
+            "--reply-tokens",
+            str(args.reply_tokens),
+        ],
+        cwd=ROOT,
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{url}/stats", timeout=1).raise_for_status()
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("mock LLM backend did not start")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, dict]):
+    print(
+        f"{'benchmark':<44} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9} {'db ms':>8} {'err':>4}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:<44} {r['throughput_rps']:>9.1f} {r['p50_ms']:>9.2f} "
+            f"{r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['db_mean_ms']:>8.2f} "
+            f"{r['errors']:>4}"
+        )
+
+
+def compare(baseline_path: str, results: Dict[str, dict]):
+    """Print the change of every shared benchmark against a saved run."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for name, r in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if old[key]:
+                changes.append(f"{key} {100 * (r[key] - old[key]) / old[key]:+.1f}%")
+        print(f"  {name:<44} {'  '.join(changes)}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI Story benchmarks")
+    parser.add_argument("--suite", choices=["api", "db", "all"], default="all")
+    parser.add_argument("--api", choices=["ollama", "openai"], default="ollama")
+    parser.add_argument(
+        "--history",
+        type=int,
+        nargs="+",
+        default=[1000],
+        help="messages in the database, e.g. 1000 100000 1000000",
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument(
+        "--warmup", type=int, default=5, help="unmeasured requests before each run"
+    )
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--tokens-per-sec", type=float, default=0)
+    parser.add_argument("--reply-tokens", type=int, default=20)
+    parser.add_argument("--mock-port", type=int, default=11500)
+    parser.add_argument(
+        "--mock-url", help="use an already running mock instead of starting one"
+    )
+    parser.add_argument("--db", help="database file (default: a temporary one)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/)")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="ai-story-bench-")
+
+    # The app reads its configuration at import time, so set it up first.
+    # Lift the admission limits and disable background compaction so the
+    # numbers are the service's own overhead.
+    os.environ["AI_STORY_DB"] = args.db or os.path.join(workdir, "bench.db")
+    os.environ.setdefault("AI_STORY_CONCURRENCY", "ollama=1024,openai=1024")
+    os.environ.setdefault("AI_STORY_QUEUE_SIZE", "4096")
+    os.environ.setdefault("AI_STORY_COMPACT_AFTER", "0")
+
+    from agents import import_agents_from_json, registry
+    from db import init_db
+
+    init_db()
+    import_agents_from_json(os.path.join(ROOT, "agents.json"), force=True)
+    agent_ids = [agent.id for agent in registry.all()]
+
+    mock = None
+    mock_url = args.mock_url
+    if args.suite != "db" and not mock_url:
+        mock, mock_url = start_mock(args)
+
+    try:
+        results = asyncio.run(run_all(args, agent_ids, mock_url))
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+
+    print_results(results)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        output = os.path.join(
+            RESULTS_DIR, f"{stamp}-{report['meta']['commit'] or 'nogit'}.json"
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
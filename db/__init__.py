@@ -1,3 +1,59 @@
-from .queries import init_db, con, save_agent, load_agent
+from .database import close_all, pool, read_connection, write_connection
+from .journal import MessageJournal, journal
+from .queries import (
+    init_db,
+    create_session,
+    list_sessions,
+    load_session,
+    session_messages,
+    get_meta,
+    set_meta,
+    save_agent,
+    save_agents,
+    load_agent,
+    load_agents,
+    on_agents_changed,
+    on_messages_changed,
+    save_messages,
+    search_messages,
+)
+from .retention import (
+    RetentionTask,
+    delete_session,
+    purge_messages,
+    reclaim_space,
+    retention,
+)
+from .transfer import NdjsonImporter, export_lines, import_lines
 
-__all__ = ["init_db", "con", "save_agent", "load_agent"]
+__all__ = [
+    "init_db",
+    "create_session",
+    "delete_session",
+    "list_sessions",
+    "load_session",
+    "session_messages",
+    "get_meta",
+    "set_meta",
+    "save_agent",
+    "save_agents",
+    "load_agent",
+    "load_agents",
+    "on_agents_changed",
+    "on_messages_changed",
+    "save_messages",
+    "search_messages",
+    "pool",
+    "read_connection",
+    "write_connection",
+    "close_all",
+    "MessageJournal",
+    "journal",
+    "NdjsonImporter",
+    "export_lines",
+    "import_lines",
+    "RetentionTask",
+    "purge_messages",
+    "reclaim_space",
+    "retention",
+]
@@ -1,4 +1,246 @@
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from typing import Callable, Optional
 
-con = sqlite3.connect("AI_story.db", check_same_thread=False)
-cur = con.cursor()
+from telemetry import histogram, query_time
+
+DB_PATH = os.environ.get("AI_STORY_DB", "AI_story.db")
+POOL_SIZE = int(os.environ.get("AI_STORY_DB_POOL_SIZE", "8"))
+POOL_OVERFLOW = int(os.environ.get("AI_STORY_DB_POOL_OVERFLOW", "32"))
+BUSY_TIMEOUT_MS = 5000
+
+
+STATEMENT_SECONDS = histogram(
+    "ai_story_sqlite_statement_duration_seconds",
+    "Time to execute SQLite statements and commits, by statement kind.",
+    ["statement"],
+)
+WAIT_SECONDS = histogram(
+    "ai_story_sqlite_connection_wait_seconds",
+    "Time spent waiting for a pooled or the writer connection.",
+    ["kind"],
+)
+
+
+def _statement_kind(sql: str) -> str:
+    words = sql.split(None, 1)
+    kind = words[0].upper() if words else ""
+    return kind if kind in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "OTHER"
+
+
+class MeteredCursor(sqlite3.Cursor):
+    """Cursor recording statement timings for /metrics and query_time."""
+
+    def _timed(self, method, sql: Optional[str], *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            if sql is not None:
+                STATEMENT_SECONDS.observe(elapsed, _statement_kind(sql))
+            acc = query_time.get()
+            if acc is not None:
+                acc[0] += elapsed
+
+    def execute(self, sql, *args):
+        return self._timed(super().execute, sql, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(super().executemany, sql, sql, *args)
+
+    def fetchone(self):
+        return self._timed(super().fetchone, None)
+
+    def fetchmany(self, *args):
+        return self._timed(super().fetchmany, None, *args)
+
+    def fetchall(self):
+        return self._timed(super().fetchall, None)
+
+
+class MeteredConnection(sqlite3.Connection):
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def after_commit(self, callback: Callable[[], None]):
+        """Run callback once the current transaction commits; a rollback
+        drops it. Used to update caches only with data that is stored."""
+        self.__dict__.setdefault("_after_commit", []).append(callback)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            elapsed = time.perf_counter() - start
+            STATEMENT_SECONDS.observe(elapsed, "COMMIT")
+            acc = query_time.get()
+            if acc is not None:
+                acc[0] += elapsed
+        for callback in self.__dict__.pop("_after_commit", ()):
+            callback()
+
+    def rollback(self):
+        self.__dict__.pop("_after_commit", None)
+        super().rollback()
+
+
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    """Open a connection tuned for concurrent use.
+
+    WAL lets readers run alongside the single writer, synchronous=NORMAL is
+    durable across application crashes in WAL mode without an fsync per
+    commit, and busy_timeout makes writers wait instead of failing with
+    "database is locked".
+    """
+    con = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        factory=MeteredConnection,
+    )
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return con
+
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections.
+
+    Up to `size` connections are kept open and reused; `max_overflow` extra
+    connections may be opened under load and are closed when released.
+    acquire() waits up to `timeout` seconds and then raises
+    sqlite3.OperationalError once every connection is in use.
+    """
+
+    def __init__(
+        self,
+        path: str = DB_PATH,
+        size: int = POOL_SIZE,
+        max_overflow: int = POOL_OVERFLOW,
+        timeout: float = 5.0,
+    ):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle: LifoQueue = LifoQueue()
+        self.max_connections = size + max_overflow
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.timeout)
+        WAIT_SECONDS.observe(time.perf_counter() - start, "pool")
+        if not acquired:
+            raise sqlite3.OperationalError("database connection pool exhausted")
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        try:
+            con = connect(self.path)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._open += 1
+        return con
+
+    def release(self, con: sqlite3.Connection):
+        try:
+            if con.in_transaction:
+                con.rollback()
+            with self._lock:
+                keep = self._idle.qsize() < self.size
+                if not keep:
+                    self._open -= 1
+            if keep:
+                self._idle.put(con)
+            else:
+                con.close()
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        con = self.acquire()
+        try:
+            yield con
+        finally:
+            self.release(con)
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                con = self._idle.get_nowait()
+            except Empty:
+                break
+            con.close()
+            with self._lock:
+                self._open -= 1
+
+    def stats(self) -> dict:
+        return {
+            "open": self._open,
+            "idle": self._idle.qsize(),
+            "size": self.size,
+            "max": self.max_connections,
+        }
+
+
+pool = ConnectionPool()
+
+# Single dedicated writer connection; SQLite allows only one writer at a time
+# anyway, so serialising here avoids lock contention between connections.
+_writer_lock = threading.Lock()
+_writer = None
+
+
+@contextmanager
+def read_connection():
+    """Borrow a pooled connection for reads; writes go through write_connection."""
+    with pool.connection() as con:
+        yield con
+
+
+@contextmanager
+def write_connection():
+    """Use the writer connection; commits on success, rolls back on error."""
+    global _writer
+    start = time.perf_counter()
+    with _writer_lock:
+        WAIT_SECONDS.observe(time.perf_counter() - start, "writer")
+        if _writer is None:
+            _writer = connect()
+        try:
+            yield _writer
+            _writer.commit()
+        except Exception:
+            _writer.rollback()
+            raise
+
+
+def close_all():
+    """Close pooled and writer connections, e.g. on shutdown."""
+    global _writer
+    pool.close()
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
@@ -0,0 +1,199 @@
+"""Write-behind journal for chat messages.
+
+With AI_STORY_DURABILITY=write-behind, Agent.add_memory only queues the
+message; a single background writer drains the queue and inserts it in one
+transaction, committing once per AI_STORY_JOURNAL_BATCH messages or every
+AI_STORY_JOURNAL_FLUSH_MS milliseconds, whichever comes first. Requests
+never wait on a commit, at the cost of losing at most one flush interval of
+messages if the process is killed. A batch that fails to commit (e.g. the
+database is locked or the disk is full) stays queued and is retried with
+exponential backoff, from RETRY_MIN to RETRY_MAX seconds; messages appended
+meanwhile wait behind it. The default "sync" mode keeps the old
+insert-per-message behaviour.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from .database import write_connection
+
+DURABILITY = os.environ.get("AI_STORY_DURABILITY", "sync")
+BATCH_SIZE = int(os.environ.get("AI_STORY_JOURNAL_BATCH", "64"))
+FLUSH_MS = int(os.environ.get("AI_STORY_JOURNAL_FLUSH_MS", "50"))
+RETRY_MIN = 0.1
+RETRY_MAX = 30.0
+
+# (agent_id, role, content, session_id, token_count, tokenizer)
+Row = Tuple[int, str, str, Optional[int], Optional[int], Optional[str]]
+# A row and what to tell its id to once it is inserted
+Entry = Tuple[Row, Optional[Callable[[int], None]]]
+
+
+class MessageJournal:
+    """Queue of (agent_id, role, content, session_id, token_count, tokenizer)
+    rows drained by one writer thread."""
+
+    def __init__(
+        self,
+        enabled: bool = DURABILITY == "write-behind",
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_MS / 1000,
+    ):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.written = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def append(
+        self,
+        agent_id: int,
+        role: str,
+        content: str,
+        session_id: Optional[int] = None,
+        token_count: Optional[int] = None,
+        tokenizer: Optional[str] = None,
+        on_insert: Optional[Callable[[int], None]] = None,
+    ):
+        """Queue a message for the next batch insert.
+
+        on_insert gets the message's id when its batch is inserted, before the
+        commit makes the row visible (again on a retry, with the new id).
+        """
+        self._ensure_started()
+        row = (agent_id, role, content, session_id, token_count, tokenizer)
+        self._queue.put((row, on_insert))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": self.pending(),
+            "written": self.written,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far is committed."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """Flush and stop the writer thread, e.g. on shutdown."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name="message-journal", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch: List[Entry] = []
+            waiters: List[threading.Event] = []
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    # Flush request: commit now instead of waiting for the batch
+                    waiters.append(item)
+                    break
+                else:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+
+                remaining = deadline - time.monotonic()
+                if stop or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if stop:
+                # Drain anything queued after the stop request
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif item is not None:
+                        batch.append(item)
+
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _write(self, batch: List[Entry]):
+        """Insert the batch, retrying with backoff until it commits."""
+        delay = RETRY_MIN
+        while True:
+            try:
+                with write_connection() as con:
+                    # One statement per row to learn each id; still a single
+                    # transaction, and the commit is what costs
+                    cur = con.cursor()
+                    for row, on_insert in batch:
+                        cur.execute(
+                            "INSERT INTO messages "
+                            "(agent_id, role, content, session_id, token_count, "
+                            "tokenizer) VALUES (?, ?, ?, ?, ?, ?)",
+                            row,
+                        )
+                        if on_insert is not None:
+                            on_insert(cur.lastrowid)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                # Keep the writer alive and the batch queued; the transaction
+                # was rolled back, so retrying cannot insert rows twice
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"Message journal failed to write {len(batch)} messages: {e}")
+            if self._stopping.is_set():
+                # Shutting down: one last try was made, do not hang the exit
+                print(f"Message journal dropped {len(batch)} messages on shutdown")
+                return
+            # Woken early by stop(), which gets one last try
+            self._stopping.wait(delay)
+            delay = min(delay * 2, RETRY_MAX)
+
+
+journal = MessageJournal()
@@ -0,0 +1,120 @@
+"""Versioned schema upgrades, tracked with SQLite's PRAGMA user_version.
+
+Each entry upgrades the schema by one version. Entries are SQL scripts
+applied in order inside a transaction, so existing databases are brought up
+to date by init_db() and fresh ones end up with the same schema.
+"""
+
+MIGRATIONS = [
+    # 1: index for the bounded "last N messages for agent" memory window
+    """
+    CREATE INDEX IF NOT EXISTS idx_messages_agent_role_created
+        ON messages (agent_id, role, created_at);
+    """,
+    # 2: persistent tier of the LLM completion cache
+    """
+    CREATE TABLE IF NOT EXISTS completion_cache (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_completion_cache_created
+        ON completion_cache (created_at);
+    """,
+    # 3: rolling summaries of compacted agent memory
+    """
+    CREATE TABLE IF NOT EXISTS memory_summaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        agent_id INTEGER NOT NULL REFERENCES agents(id) ON DELETE CASCADE,
+        summary TEXT NOT NULL,
+        up_to_message_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_memory_summaries_agent
+        ON memory_summaries (agent_id, up_to_message_id);
+    """,
+    # 4: full-text index over message content for relevance-based recall,
+    # an external-content FTS5 table kept in sync with messages by triggers
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='porter unicode61'
+    );
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content)
+            VALUES ('delete', old.id, old.content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content)
+            VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+    END;
+    INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');
+    """,
+    # 5: keyset pagination of an agent's full history by (created_at, id)
+    """
+    CREATE INDEX IF NOT EXISTS idx_messages_agent_created
+        ON messages (agent_id, created_at);
+    """,
+    # 6: content hash of each agent definition, so imports skip unchanged ones
+    """
+    ALTER TABLE agents ADD COLUMN content_hash TEXT;
+    """,
+    # 7: small key/value store, e.g. the hash of the last imported agents.json
+    """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """,
+    # 8: age-based retention deletes the oldest messages across all agents
+    """
+    CREATE INDEX IF NOT EXISTS idx_messages_created ON messages (created_at);
+    """,
+    # 9: conversation sessions; messages and summaries without a session form
+    # the default session. Context queries filter on (session_id, agent_id)
+    # first, so they only scan one story; the session transcript and session
+    # deletes use the (session_id, created_at) index.
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ALTER TABLE messages ADD COLUMN session_id INTEGER REFERENCES sessions(id) ON DELETE CASCADE;
+    ALTER TABLE memory_summaries ADD COLUMN session_id INTEGER REFERENCES sessions(id) ON DELETE CASCADE;
+    DROP INDEX IF EXISTS idx_messages_agent_role_created;
+    CREATE INDEX IF NOT EXISTS idx_messages_session_agent_role_created
+        ON messages (session_id, agent_id, role, created_at);
+    CREATE INDEX IF NOT EXISTS idx_messages_session_created
+        ON messages (session_id, created_at);
+    DROP INDEX IF EXISTS idx_memory_summaries_agent;
+    CREATE INDEX IF NOT EXISTS idx_memory_summaries_session_agent
+        ON memory_summaries (session_id, agent_id, up_to_message_id);
+    """,
+    # 10: token count cached per message (NULL until counted) and per-agent
+    # generation profiles (JSON)
+    """
+    ALTER TABLE messages ADD COLUMN token_count INTEGER;
+    ALTER TABLE agents ADD COLUMN generation TEXT;
+    """,
+    # 11: name of the tokenizer token_count was made with; counts from another
+    # tokenizer (or NULL, from before this column) are recomputed when read
+    """
+    ALTER TABLE messages ADD COLUMN tokenizer TEXT;
+    """,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(con) -> int:
+    """Apply pending migrations to the connection, returns the schema version."""
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        con.executescript(
+            f"BEGIN;\n{MIGRATIONS[target - 1]}\nPRAGMA user_version = {target};\nCOMMIT;"
+        )
+    return max(version, SCHEMA_VERSION)
@@ -1,8 +1,54 @@
-from typing import Optional
-from .database import cur, con
+import hashlib
+import json
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from telemetry import traced
+
+from .database import read_connection, write_connection
+from .journal import journal
+from .migrations import SCHEMA_VERSION, migrate
+
+# Called after any write to the agents table, e.g. to drop cached agents
+_agent_listeners: List[Callable[[], None]] = []
+
+def on_agents_changed(callback: Callable[[], None]):
+    """Register a callback to run whenever the agents table is written."""
+    _agent_listeners.append(callback)
+
+def _notify_agents_changed():
+    for callback in _agent_listeners:
+        callback()
+
+# Called after messages are written or deleted other than through
+# Agent.add_memory, with the agent id or None for any agent
+_message_listeners: List[Callable[[Optional[int]], None]] = []
+
+def on_messages_changed(callback: Callable[[Optional[int]], None]):
+    """Register a callback to run after bulk writes or deletes of messages."""
+    _message_listeners.append(callback)
+
+def notify_messages_changed(agent_id: Optional[int] = None):
+    for callback in _message_listeners:
+        callback(agent_id)
 
 def init_db():
-    """Create tables to store memories."""
+    """Create tables to store memories and upgrade older schemas."""
+    with write_connection() as con:
+        # Already up to date: skip the DDL, a restart only reads one pragma
+        if con.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        # Lets db.retention hand freed pages back to the file system; only
+        # takes effect here on a brand new file, see below for old ones
+        con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        _create_tables(con.cursor())
+        con.commit()
+        migrate(con)
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Existing databases switch over with one full VACUUM, once
+            con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            con.execute("VACUUM")
+
+def _create_tables(cur):
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS agents (
@@ -24,26 +70,219 @@ def init_db():
         );
         """
     )
-    con.commit()
+
+def agent_hash(name: str, persona: str, generation: Optional[dict] = None) -> str:
+    """Content hash of an agent definition, to detect unchanged agents."""
+    fields = [name, persona] if generation is None else [name, persona, generation]
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+def get_meta(key: str) -> Optional[str]:
+    """Read a value from the meta key/value table."""
+    with read_connection() as con:
+        row = con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_meta(key: str, value: str):
+    """Store a value in the meta key/value table."""
+    with write_connection() as con:
+        con.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
 
 def save_agent(name: str, persona: str) -> int:
     """Saves a agents name and persona if name does not exist."""
-    cur.execute(
-        "INSERT OR IGNORE INTO agents (name, persona) VALUES (?, ?)",
-        (name, persona)
-    )
-    con.commit()
-
-    cur.execute("SELECT id FROM agents WHERE name = ?", (name,))
-    agent_id = cur.fetchone()[0]
+    with write_connection() as con:
+        cur = con.execute(
+            "INSERT OR IGNORE INTO agents (name, persona, content_hash) VALUES (?, ?, ?)",
+            (name, persona, agent_hash(name, persona))
+        )
+        inserted = cur.rowcount > 0
+        cur.execute("SELECT id FROM agents WHERE name = ?", (name,))
+        agent_id = cur.fetchone()[0]
+    if inserted:
+        _notify_agents_changed()
     return agent_id
 
+@traced
+def save_agents(agents: Iterable[Tuple[str, str, Optional[dict]]]) -> int:
+    """
+    Insert new agents and update changed personas in one transaction.
+    Rows are (name, persona, generation profile or None).
+    Agents whose content hash matches the stored one are skipped, so
+    re-importing an unchanged roster writes nothing.
+    Returns the number of agents inserted or updated.
+    """
+    with write_connection() as con:
+        stored = dict(con.execute("SELECT name, content_hash FROM agents"))
+        changed = []
+        for name, persona, generation in agents:
+            digest = agent_hash(name, persona, generation)
+            if stored.get(name) != digest:
+                stored[name] = digest
+                profile = json.dumps(generation) if generation is not None else None
+                changed.append((name, persona, profile, digest))
+        if changed:
+            con.executemany(
+                """
+                INSERT INTO agents (name, persona, generation, content_hash) VALUES (?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    persona = excluded.persona, generation = excluded.generation,
+                    content_hash = excluded.content_hash
+                """,
+                changed
+            )
+    if changed:
+        _notify_agents_changed()
+    return len(changed)
+
 def load_agent(name: str) -> Optional[dict]:
     """Load agent by name, returns result in a dictionary."""
-    cur.execute(
-        "SELECT id, name, persona FROM agents WHERE name = ?", (name,)
+    with read_connection() as con:
+        row = con.execute(
+            "SELECT id, name, persona, generation FROM agents WHERE name = ?", (name,)
+        ).fetchone()
+    if row:
+        return _agent_dict(row)
+    return None
+
+@traced
+def load_agents() -> List[dict]:
+    """Load every agent, returns a list of dictionaries."""
+    with read_connection() as con:
+        rows = con.execute("SELECT id, name, persona, generation FROM agents").fetchall()
+    return [_agent_dict(row) for row in rows]
+
+def _agent_dict(row) -> dict:
+    return {
+        "id": row[0],
+        "name": row[1],
+        "persona": row[2],
+        "generation": json.loads(row[3]) if row[3] else None,
+    }
+
+@traced
+def search_messages(
+    match: str,
+    agent_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: int = 20,
+    session_id: Optional[int] = None,
+) -> List[dict]:
+    """Full-text search over every agent's messages, newest first.
+
+    match is an FTS5 query, optionally narrowed to one agent and/or one
+    session. Pages are keyed on the message id: pass the id of the last
+    result as before_id for the next page.
+    """
+    sql = (
+        "SELECT m.id, a.name, m.role, m.content, m.created_at FROM messages_fts "
+        "JOIN messages m ON m.id = messages_fts.rowid "
+        "JOIN agents a ON a.id = m.agent_id "
+        "WHERE messages_fts MATCH ?"
     )
-    row = cur.fetchone()
+    params: list = [match]
+    if before_id is not None:
+        sql += " AND messages_fts.rowid < ?"
+        params.append(before_id)
+    if agent_id is not None:
+        sql += " AND m.agent_id = ?"
+        params.append(agent_id)
+    if session_id is not None:
+        sql += " AND m.session_id = ?"
+        params.append(session_id)
+    sql += " ORDER BY messages_fts.rowid DESC LIMIT ?"
+    params.append(limit)
+    with read_connection() as con:
+        rows = con.execute(sql, params).fetchall()
+    return [
+        {
+            "id": row[0],
+            "agent": row[1],
+            "role": row[2],
+            "content": row[3],
+            "created_at": row[4],
+        }
+        for row in rows
+    ]
+
+@traced
+def save_messages(
+    rows: Iterable[Tuple[int, str, str]],
+    session_id: Optional[int] = None,
+    count: Optional[Callable[[str], int]] = None,
+    tokenizer: Optional[str] = None,
+):
+    """
+    Insert (agent_id, role, content) rows into a session in a single transaction.
+    With count given, each message's token count is stored alongside it,
+    tagged with the name of the tokenizer count uses.
+    """
+    rows = [
+        row + (session_id, count(row[2]), tokenizer) if count else row + (session_id, None, None)
+        for row in rows
+    ]
+    if journal.enabled:
+        for row in rows:
+            journal.append(*row)
+    else:
+        with write_connection() as con:
+            con.executemany(
+                "INSERT INTO messages (agent_id, role, content, session_id, token_count, tokenizer) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+    for agent_id in {row[0] for row in rows}:
+        notify_messages_changed(agent_id)
+
+@traced
+def create_session(title: Optional[str] = None) -> dict:
+    """Start a new conversation session, returns it as a dictionary."""
+    with write_connection() as con:
+        cur = con.execute("INSERT INTO sessions (title) VALUES (?)", (title,))
+        row = con.execute(
+            "SELECT id, title, created_at FROM sessions WHERE id = ?", (cur.lastrowid,)
+        ).fetchone()
+    return {"id": row[0], "title": row[1], "created_at": row[2]}
+
+def load_session(session_id: int) -> Optional[dict]:
+    """Load a session by id, returns result in a dictionary."""
+    with read_connection() as con:
+        row = con.execute(
+            "SELECT id, title, created_at FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
     if row:
-        return {"id": row[0], "name": row[1], "persona": row[2]}
+        return {"id": row[0], "title": row[1], "created_at": row[2]}
     return None
+
+@traced
+def list_sessions(before_id: Optional[int] = None, limit: int = 50) -> List[dict]:
+    """Sessions newest first; pass the id of the last one as before_id for more."""
+    with read_connection() as con:
+        rows = con.execute(
+            "SELECT id, title, created_at FROM sessions WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id if before_id is not None else 2**63 - 1, limit)
+        ).fetchall()
+    return [{"id": row[0], "title": row[1], "created_at": row[2]} for row in rows]
+
+@traced
+def session_messages(
+    session_id: int, before: Optional[Tuple[str, int]] = None, limit: int = 50
+) -> List[Tuple[int, str, str, str, str]]:
+    """
+    One page of a session's transcript across all agents, newest first, as
+    (id, agent name, role, content, created_at) rows. Pass (created_at, id)
+    of the last row as before for the next (older) page.
+    """
+    sql = (
+        "SELECT m.id, a.name, m.role, m.content, m.created_at FROM messages m "
+        "JOIN agents a ON a.id = m.agent_id WHERE m.session_id = ?"
+    )
+    params: list = [session_id]
+    if before is not None:
+        sql += " AND (m.created_at, m.id) < (?, ?)"
+        params.extend(before)
+    sql += " ORDER BY m.created_at DESC, m.id DESC LIMIT ?"
+    params.append(limit)
+    with read_connection() as con:
+        return con.execute(sql, params).fetchall()
@@ -0,0 +1,246 @@
+"""Bulk message purges, retention policies and space reclamation.
+
+Deletes run in chunks of AI_STORY_PURGE_CHUNK rows, each its own short
+transaction on the writer connection, so a purge of millions of messages
+never holds the write lock for long and chat requests keep being served in
+between. Freed pages are handed back to the file system with
+PRAGMA incremental_vacuum (init_db switches databases to
+auto_vacuum=INCREMENTAL), also a few pages at a time.
+
+A background thread enforces the retention policy every
+AI_STORY_RETENTION_INTERVAL seconds: messages older than
+AI_STORY_RETENTION_DAYS and, per agent, all but the newest
+AI_STORY_RETENTION_MAX_MESSAGES are deleted. Both are off (0) by default.
+Rolling summaries are kept, so an agent still remembers the gist of pruned
+messages that were compacted before they were deleted.
+"""
+
+import atexit
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+from .database import read_connection, write_connection
+from .journal import journal
+from .queries import notify_messages_changed
+
+RETENTION_DAYS = float(os.environ.get("AI_STORY_RETENTION_DAYS", "0"))
+RETENTION_MAX_MESSAGES = int(os.environ.get("AI_STORY_RETENTION_MAX_MESSAGES", "0"))
+RETENTION_INTERVAL = float(os.environ.get("AI_STORY_RETENTION_INTERVAL", "3600"))
+PURGE_CHUNK = int(os.environ.get("AI_STORY_PURGE_CHUNK", "500"))
+# Pages freed per incremental_vacuum step (4 MB with the default page size)
+VACUUM_STEP = 1000
+# Pause between chunks so waiting writers get the lock in between
+CHUNK_PAUSE = 0.005
+
+
+def delete_in_chunks(sql: str, params: tuple, chunk_size: int) -> int:
+    """Run a DELETE whose last parameter is a LIMIT until it deletes nothing."""
+    total = 0
+    while True:
+        with write_connection() as con:
+            deleted = con.execute(sql, params + (chunk_size,)).rowcount
+        total += deleted
+        if deleted < chunk_size:
+            return total
+        time.sleep(CHUNK_PAUSE)
+
+
+def purge_messages(
+    agent_ids: Optional[Iterable[int]] = None, chunk_size: int = PURGE_CHUNK
+) -> int:
+    """Delete all messages and summaries of the given agents (default: all).
+
+    Returns the number of messages deleted. Messages still queued in the
+    write-behind journal are flushed first so they are purged too.
+    """
+    journal.flush()
+    if agent_ids is None:
+        deleted = delete_in_chunks(
+            "DELETE FROM messages WHERE id IN (SELECT id FROM messages LIMIT ?)",
+            (),
+            chunk_size,
+        )
+        with write_connection() as con:
+            con.execute("DELETE FROM memory_summaries")
+        notify_messages_changed()
+        return deleted
+
+    deleted = 0
+    for agent_id in agent_ids:
+        deleted += delete_in_chunks(
+            "DELETE FROM messages WHERE id IN "
+            "(SELECT id FROM messages WHERE agent_id = ? LIMIT ?)",
+            (agent_id,),
+            chunk_size,
+        )
+        with write_connection() as con:
+            con.execute("DELETE FROM memory_summaries WHERE agent_id = ?", (agent_id,))
+        notify_messages_changed(agent_id)
+    return deleted
+
+
+def delete_session(session_id: int, chunk_size: int = PURGE_CHUNK) -> Optional[int]:
+    """Delete a session with its messages and summaries.
+
+    Returns the number of messages deleted, or None if there is no such
+    session. The messages are found on the session index.
+    """
+    with read_connection() as con:
+        row = con.execute(
+            "SELECT 1 FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    journal.flush()
+    deleted = delete_in_chunks(
+        "DELETE FROM messages WHERE id IN "
+        "(SELECT id FROM messages WHERE session_id = ? LIMIT ?)",
+        (session_id,),
+        chunk_size,
+    )
+    with write_connection() as con:
+        con.execute("DELETE FROM memory_summaries WHERE session_id = ?", (session_id,))
+        con.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+    notify_messages_changed()
+    return deleted
+
+
+def prune_older_than(days: float, chunk_size: int = PURGE_CHUNK) -> int:
+    """Delete messages created more than `days` days ago, oldest first."""
+    return delete_in_chunks(
+        "DELETE FROM messages WHERE id IN (SELECT id FROM messages "
+        "WHERE created_at < datetime('now', ?) ORDER BY created_at LIMIT ?)",
+        (f"-{days} days",),
+        chunk_size,
+    )
+
+
+def prune_to_max_messages(max_messages: int, chunk_size: int = PURGE_CHUNK) -> int:
+    """Keep only the newest `max_messages` messages of every agent."""
+    with read_connection() as con:
+        agent_ids = [row[0] for row in con.execute("SELECT id FROM agents")]
+    deleted = 0
+    for agent_id in agent_ids:
+        # Newest message that falls outside the window, found on the
+        # (agent_id, created_at) index; everything up to it goes
+        with read_connection() as con:
+            cutoff = con.execute(
+                "SELECT created_at, id FROM messages WHERE agent_id = ? "
+                "ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?",
+                (agent_id, max_messages),
+            ).fetchone()
+        if cutoff is None:
+            continue
+        deleted += delete_in_chunks(
+            "DELETE FROM messages WHERE id IN (SELECT id FROM messages "
+            "WHERE agent_id = ? AND (created_at, id) <= (?, ?) LIMIT ?)",
+            (agent_id, cutoff[0], cutoff[1]),
+            chunk_size,
+        )
+    return deleted
+
+
+def reclaim_space(step: int = VACUUM_STEP) -> int:
+    """Return free pages to the file system, `step` pages per transaction.
+
+    Returns the number of pages freed. A no-op on databases that are not in
+    auto_vacuum=INCREMENTAL mode.
+    """
+    freed = 0
+    while True:
+        with write_connection() as con:
+            before = con.execute("PRAGMA freelist_count").fetchone()[0]
+            if before == 0:
+                return freed
+            con.execute(f"PRAGMA incremental_vacuum({int(step)})").fetchall()
+            after = con.execute("PRAGMA freelist_count").fetchone()[0]
+        freed += before - after
+        if after == 0 or after == before:
+            return freed
+        time.sleep(CHUNK_PAUSE)
+
+
+class RetentionTask:
+    """Background thread applying the retention policy at a fixed interval."""
+
+    def __init__(
+        self,
+        max_age_days: float = RETENTION_DAYS,
+        max_messages: int = RETENTION_MAX_MESSAGES,
+        interval: float = RETENTION_INTERVAL,
+    ):
+        self.max_age_days = max_age_days
+        self.max_messages = max_messages
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.pruned = 0
+        self.pages_freed = 0
+        self.last_run: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age_days > 0 or self.max_messages > 0
+
+    def run_once(self) -> int:
+        """Apply the policy now; returns the number of messages deleted."""
+        deleted = 0
+        if self.max_age_days > 0:
+            deleted += prune_older_than(self.max_age_days)
+        if self.max_messages > 0:
+            deleted += prune_to_max_messages(self.max_messages)
+        if deleted:
+            notify_messages_changed()
+            self.pages_freed += reclaim_space()
+        self.runs += 1
+        self.pruned += deleted
+        self.last_run = time.time()
+        return deleted
+
+    def start(self):
+        """Start the background thread if a retention limit is configured."""
+        if not self.enabled or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="message-retention", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                # Keep the thread alive; the next interval tries again
+                self.last_error = str(e)
+                print(f"Message retention failed: {e}")
+            self._stop.wait(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_age_days": self.max_age_days,
+            "max_messages": self.max_messages,
+            "runs": self.runs,
+            "pruned": self.pruned,
+            "pages_freed": self.pages_freed,
+            "last_run": self.last_run,
+            "last_error": self.last_error,
+        }
+
+
+retention = RetentionTask()
@@ -0,0 +1,253 @@
+"""Streaming NDJSON export and import of agents and message history.
+
+The format is one JSON object per line: every agent first,
+
+    {"type": "agent", "name": ..., "persona": ..., "generation": {...}}
+
+("generation" only for agents with a generation profile), then every session,
+
+    {"type": "session", "id": ..., "title": ..., "created_at": ...}
+
+followed by every message in insertion order ("session" is left out for
+messages in the default session),
+
+    {"type": "message", "agent": ..., "role": ..., "content": ..., "created_at": ...,
+     "session": ...}
+
+Session ids are only used to link messages to sessions within one file;
+import creates new sessions.
+
+Export reads the tables in id-keyed batches and import writes in batched
+transactions, so memory use stays constant however large the database is.
+"""
+
+import json
+import sqlite3
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from .database import read_connection, write_connection
+from .queries import notify_messages_changed, save_agents
+
+BATCH_SIZE = 1000
+
+
+def export_lines(batch_size: int = BATCH_SIZE) -> Iterator[str]:
+    """Yield the whole database as NDJSON lines (each ending in a newline)."""
+    names: Dict[int, str] = {}
+    last_id = 0
+    while True:
+        with read_connection() as con:
+            rows = con.execute(
+                "SELECT id, name, persona, generation FROM agents "
+                "WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+        if not rows:
+            break
+        for agent_id, name, persona, generation in rows:
+            names[agent_id] = name
+            record = {"type": "agent", "name": name, "persona": persona}
+            if generation:
+                record["generation"] = json.loads(generation)
+            yield _line(record)
+        last_id = rows[-1][0]
+
+    last_id = 0
+    while True:
+        with read_connection() as con:
+            rows = con.execute(
+                "SELECT id, title, created_at FROM sessions WHERE id > ? "
+                "ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+        if not rows:
+            break
+        for session_id, title, created_at in rows:
+            yield _line(
+                {
+                    "type": "session",
+                    "id": session_id,
+                    "title": title,
+                    "created_at": created_at,
+                }
+            )
+        last_id = rows[-1][0]
+
+    last_id = 0
+    while True:
+        with read_connection() as con:
+            rows = con.execute(
+                "SELECT id, agent_id, role, content, created_at, session_id "
+                "FROM messages WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+        if not rows:
+            break
+        for _, agent_id, role, content, created_at, session_id in rows:
+            record = {
+                "type": "message",
+                "agent": names.get(agent_id),
+                "role": role,
+                "content": content,
+                "created_at": created_at,
+            }
+            if session_id is not None:
+                record["session"] = session_id
+            yield _line(record)
+        last_id = rows[-1][0]
+
+
+def _line(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class NdjsonImporter:
+    """
+    Incremental NDJSON import.
+
+    feed() parses one line and returns True once a batch is ready; the
+    caller then calls flush() (which may block on the database), and calls
+    it once more at the end. Agents are upserted by content hash, sessions
+    created anew and messages appended with their original timestamps.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE):
+        self.batch_size = batch_size
+        self._agents: List[Tuple[str, str, Optional[dict]]] = []
+        self._sessions: List[Tuple[int, Optional[str], Optional[str]]] = []
+        self._messages: List[Tuple[str, str, str, Optional[str], Optional[int]]] = []
+        self._ids: Dict[str, int] = {}
+        # Session id in the file -> id of the session created for it
+        self._session_ids: Dict[int, int] = {}
+        self.lines = 0
+        self.agents = 0
+        self.agents_changed = 0
+        self.sessions = 0
+        self.messages = 0
+        self.skipped = 0
+
+    def feed(self, line: Union[str, bytes]) -> bool:
+        line = line.strip()
+        if not line:
+            return False
+        self.lines += 1
+        try:
+            record = json.loads(line)
+            kind = record.get("type")
+            if kind == "agent":
+                generation = record.get("generation")
+                self._agents.append(
+                    (
+                        str(record["name"]),
+                        str(record["persona"]),
+                        dict(generation) if generation else None,
+                    )
+                )
+            elif kind == "session":
+                self._sessions.append(
+                    (int(record["id"]), record.get("title"), record.get("created_at"))
+                )
+            elif kind == "message":
+                session = record.get("session")
+                self._messages.append(
+                    (
+                        str(record["agent"]),
+                        str(record["role"]),
+                        str(record["content"]),
+                        record.get("created_at"),
+                        int(session) if session is not None else None,
+                    )
+                )
+            else:
+                self.skipped += 1
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.skipped += 1
+        pending = len(self._agents) + len(self._sessions) + len(self._messages)
+        return pending >= self.batch_size
+
+    def flush(self):
+        """Write everything fed so far, agents and sessions before messages."""
+        if self._agents:
+            self.agents += len(self._agents)
+            self.agents_changed += save_agents(self._agents)
+            self._agents = []
+        if self._sessions:
+            with write_connection() as con:
+                for file_id, title, created_at in self._sessions:
+                    cur = con.execute(
+                        "INSERT INTO sessions (title, created_at) "
+                        "VALUES (?, COALESCE(?, CURRENT_TIMESTAMP))",
+                        (title, created_at),
+                    )
+                    self._session_ids[file_id] = cur.lastrowid
+            self.sessions += len(self._sessions)
+            self._sessions = []
+        if not self._messages:
+            return
+
+        with write_connection() as con:
+            missing = {name for name, *_ in self._messages} - self._ids.keys()
+            for name in missing:
+                row = con.execute(
+                    "SELECT id FROM agents WHERE name = ?", (name,)
+                ).fetchone()
+                if row:
+                    self._ids[name] = row[0]
+            rows = []
+            for name, role, content, created_at, session in self._messages:
+                agent_id = self._ids.get(name)
+                if agent_id is None:
+                    self.skipped += 1
+                    continue
+                # A session missing from the file lands in the default session
+                session_id = self._session_ids.get(session)
+                rows.append((agent_id, role, content, created_at, session_id))
+            try:
+                con.executemany(
+                    "INSERT INTO messages "
+                    "(agent_id, role, content, created_at, session_id) "
+                    "VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)",
+                    rows,
+                )
+            except sqlite3.IntegrityError:
+                # e.g. an invalid role; keep the valid rows of the batch
+                con.rollback()
+                rows = self._insert_valid(con, rows)
+            self.messages += len(rows)
+        self._messages = []
+        notify_messages_changed()
+
+    def _insert_valid(self, con, rows: list) -> list:
+        inserted = []
+        for row in rows:
+            try:
+                con.execute(
+                    "INSERT INTO messages "
+                    "(agent_id, role, content, created_at, session_id) "
+                    "VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)",
+                    row,
+                )
+                inserted.append(row)
+            except sqlite3.IntegrityError:
+                self.skipped += 1
+        return inserted
+
+    def stats(self) -> dict:
+        return {
+            "lines": self.lines,
+            "agents": self.agents,
+            "agents_changed": self.agents_changed,
+            "sessions": self.sessions,
+            "messages": self.messages,
+            "skipped": self.skipped,
+        }
+
+
+def import_lines(lines, batch_size: int = BATCH_SIZE) -> dict:
+    """Import NDJSON lines from any iterable, e.g. an open file."""
+    importer = NdjsonImporter(batch_size)
+    for line in lines:
+        if importer.feed(line):
+            importer.flush()
+    importer.flush()
+    return importer.stats()
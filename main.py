@@ -1,21 +1,120 @@
+import time
+
+_START = time.perf_counter()
+
+import argparse
 import os
+import sys
 
 from dotenv import load_dotenv
 
-from agents import import_agents_from_json
-from api import run
-from db import init_db
+from db import RetentionTask, export_lines, import_lines, init_db, reclaim_space
 
 load_dotenv()
 
 
+class StartupReport:
+    """Wall time of each startup phase, printed with --startup-report."""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.phases = [("imports", time.perf_counter() - _START)]
+        self._last = time.perf_counter()
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def print(self):
+        if not self.enabled:
+            return
+        print("\nStartup time:")
+        for phase, seconds in self.phases:
+            print(f"  {phase:<12} {seconds * 1000:8.1f} ms")
+        total = sum(seconds for _, seconds in self.phases)
+        print(f"  {'total':<12} {total * 1000:8.1f} ms")
+        loaded = [m for m in ("ollama", "openai", "httpx") if m in sys.modules]
+        print(f"  backend SDKs loaded: {', '.join(loaded) or 'none'}")
+        print("  (python -X importtime main.py gives a per-module breakdown)\n")
+
+
+def export_db(path: str):
+    """Write agents and messages as NDJSON to path ("-" for stdout)."""
+    init_db()
+    out = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+    try:
+        out.writelines(export_lines())
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def import_db(path: str):
+    """Load agents and messages from an NDJSON export ("-" for stdin)."""
+    init_db()
+    src = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        print(import_lines(src), file=sys.stderr)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+
+
+def prune_db(max_age_days: float, max_messages: int):
+    """Apply a retention policy once and reclaim the freed space."""
+    init_db()
+    deleted = RetentionTask(max_age_days, max_messages).run_once()
+    pages = reclaim_space()
+    print(f"Deleted {deleted} messages, freed {pages} pages", file=sys.stderr)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="AI Story server")
+    parser.add_argument(
+        "--startup-report",
+        action="store_true",
+        help="print how long each startup phase took",
+    )
+    commands = parser.add_subparsers(dest="command")
+    export_cmd = commands.add_parser("export", help="export the database as NDJSON")
+    export_cmd.add_argument("path", nargs="?", default="-")
+    import_cmd = commands.add_parser("import", help="import an NDJSON export")
+    import_cmd.add_argument("path", nargs="?", default="-")
+    prune_cmd = commands.add_parser(
+        "prune", help="delete old messages now (defaults to the retention settings)"
+    )
+    prune_cmd.add_argument("--days", type=float, default=None)
+    prune_cmd.add_argument("--max-messages", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        return export_db(args.path)
+    if args.command == "import":
+        return import_db(args.path)
+    if args.command == "prune":
+        defaults = RetentionTask()
+        return prune_db(
+            defaults.max_age_days if args.days is None else args.days,
+            defaults.max_messages if args.max_messages is None else args.max_messages,
+        )
+
+    report = StartupReport(args.startup_report)
+
+    # Imported here so the export/import commands do not load the web stack
+    from agents import import_agents_from_json
+    from api import run
+
+    report.mark("app imports")
+
     print("Initializing database...")
     init_db()
+    report.mark("database")
 
     print("Loading agents from JSON...")
     agents = import_agents_from_json()
     print(f"Loaded {len(agents)} agents: {[agent.name for agent in agents]}")
+    report.mark("agents")
 
     api_choice = os.environ.get("AI_API", "ollama")
     print(f"Using API: {api_choice}")
@@ -24,6 +123,7 @@ def main():
     print("📱 Open your browser and go to: http://localhost:8081")
     print("🤖 Your AI agents are ready to chat!")
 
+    report.print()
     run()
 
 
@@ -28,6 +28,7 @@ saveBtn.onclick = function () {
 
 let agents = [];
 let isConversationRunning = false;
+let conversationController = null;
 
 // Settings management
 const DEFAULT_SETTINGS = {
@@ -198,6 +199,14 @@ function addMessage(speaker, content) {
   messageDiv.appendChild(contentDiv);
   container.appendChild(messageDiv);
 
+  scrollChatToBottom();
+
+  return contentDiv;
+}
+
+function scrollChatToBottom() {
+  const container = document.getElementById("chatContainer");
+
   // Smooth scroll to the bottom
   setTimeout(() => {
     container.scrollTo({
@@ -207,8 +216,40 @@ function addMessage(speaker, content) {
   }, 100); // Small delay to ensure the message is fully rendered
 }
 
+// Read a Server-Sent Events response body and call onEvent(event, data)
+// for every message as soon as it arrives.
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      onEvent(event, data ? JSON.parse(data) : null);
+    }
+  }
+}
+
 async function startConversation() {
-  if (isConversationRunning) return;
+  if (isConversationRunning) {
+    // The start button doubles as a stop button while a conversation runs
+    if (conversationController) conversationController.abort();
+    return;
+  }
 
   const selectedAgents = getSelectedAgents();
   if (selectedAgents.length < 2) {
@@ -224,65 +265,81 @@ async function startConversation() {
 
   const turns = parseInt(document.getElementById("turns").value);
   const api = document.getElementById("api").value;
+  const startButton = document.getElementById("startChat");
 
   isConversationRunning = true;
+  conversationController = new AbortController();
   showLoading(true);
+  startButton.disabled = false;
+  startButton.textContent = "Stop Conversation";
   clearChat();
 
   try {
-    await startStreamingConversation(selectedAgents, prompt, turns, api);
+    await startStreamingConversation(
+      selectedAgents,
+      prompt,
+      turns,
+      api,
+      conversationController.signal,
+    );
   } catch (error) {
-    showError("Failed to start conversation: " + error.message);
+    if (error.name === "AbortError") {
+      addMessage("System", "Conversation stopped.");
+    } else {
+      showError("Failed to start conversation: " + error.message);
+    }
   } finally {
     showLoading(false);
+    startButton.textContent = "Start Conversation";
     isConversationRunning = false;
+    conversationController = null;
   }
 }
 
-async function startStreamingConversation(selectedAgents, prompt, turns, api) {
-  let currentPrompt = prompt;
+async function startStreamingConversation(
+  selectedAgents,
+  prompt,
+  turns,
+  api,
+  signal,
+) {
   const settings = getSettings();
 
-  for (let turn = 0; turn < turns; turn++) {
-    const currentAgent = selectedAgents[turn % selectedAgents.length];
-
-    try {
-      const requestBody = {
-        prompt: currentPrompt,
-        agent_name: currentAgent,
-        api: api,
-        settings: settings, // Pass settings to backend
-      };
-
-      const response = await fetch("/chat", {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify(requestBody),
-      });
-
-      if (!response.ok) {
-        const errorData = await response.json();
-        throw new Error(errorData.detail || "Chat failed");
-      }
-
-      const data = await response.json();
-      const message = data.response;
-
-      addMessage(currentAgent, message);
+  // The server runs the whole turn loop and pushes each turn as it happens
+  const response = await fetch("/conversation/stream", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({
+      prompt: prompt,
+      agent_names: selectedAgents,
+      turns: turns,
+      api: api,
+      settings: settings, // Pass settings to backend
+    }),
+    signal: signal,
+  });
 
-      // Update the prompt for the next agent to be the last response
-      currentPrompt = `${currentAgent} said: ${message}\nRespond as the next character.`;
+  if (!response.ok) {
+    const errorData = await response.json();
+    throw new Error(errorData.detail || "Conversation failed");
+  }
 
-      // Small delay between messages for readability
-      await new Promise((resolve) => setTimeout(resolve, 500));
-    } catch (error) {
-      console.error(`Error with ${currentAgent}:`, error);
-      addMessage("System", `Error with ${currentAgent}: ${error.message}`);
-      break;
+  let contentDiv = null;
+  await readEventStream(response, (event, data) => {
+    if (event === "turn") {
+      contentDiv = addMessage(data.agent, "");
+    } else if (event === "token") {
+      contentDiv.textContent += data.delta;
+    } else if (event === "message") {
+      contentDiv.textContent = data.response;
+      scrollChatToBottom();
+    } else if (event === "error") {
+      contentDiv.textContent = data.response;
+      addMessage("System", `Error with ${data.agent}: ${data.response}`);
     }
-  }
+  });
 }
 
 async function clearAllMemory() {
@@ -439,7 +496,7 @@ document
   .addEventListener("click", testGitHubConnection);
 
 document.getElementById("prompt").addEventListener("keydown", function (e) {
-  if (e.key === "Enter" && e.ctrlKey) {
+  if (e.key === "Enter" && e.ctrlKey && !isConversationRunning) {
     startConversation();
   }
 });
@@ -0,0 +1,41 @@
+from .metrics import (
+    REGISTRY,
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    counter,
+    gauge,
+    histogram,
+)
+from .tracing import (
+    Trace,
+    TracingMiddleware,
+    current_trace,
+    profiler,
+    query_time,
+    sink,
+    span,
+    traced,
+)
+from .threads import WorkerThreads, to_thread, workers
+
+__all__ = [
+    "REGISTRY",
+    "Counter",
+    "Histogram",
+    "MetricsRegistry",
+    "counter",
+    "gauge",
+    "histogram",
+    "Trace",
+    "TracingMiddleware",
+    "current_trace",
+    "profiler",
+    "query_time",
+    "sink",
+    "span",
+    "traced",
+    "WorkerThreads",
+    "to_thread",
+    "workers",
+]
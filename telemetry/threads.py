@@ -0,0 +1,68 @@
+"""The thread pool running the service's blocking work.
+
+SQLite queries, the completion cache and imports run on worker threads
+through to_thread(), a counted asyncio.to_thread. When the server starts,
+WorkerThreads.start() makes its own ThreadPoolExecutor of AI_STORY_THREADS
+workers the event loop's default executor, so the pool size is known
+without reading asyncio internals; the calls running or waiting for a
+worker are counted around each to_thread() call.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# asyncio's own default size
+THREADS = int(os.environ.get("AI_STORY_THREADS", "0")) or min(
+    32, (os.cpu_count() or 1) + 4
+)
+
+
+class WorkerThreads:
+    """The loop's default executor and a count of the work submitted to it."""
+
+    def __init__(self, max_workers: int = THREADS):
+        self.max_workers = max_workers
+        self.executor: Optional[ThreadPoolExecutor] = None
+        # to_thread() calls not finished yet, running or queued
+        self.in_flight = 0
+        self.calls = 0
+
+    def start(self):
+        """Install the executor as the running loop's default executor."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix="ai-story"
+            )
+        asyncio.get_running_loop().set_default_executor(self.executor)
+
+    def stop(self):
+        """Let the threads exit once the work already submitted is done."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """asyncio.to_thread(func, *args, **kwargs), counted while pending."""
+        self.in_flight += 1
+        self.calls += 1
+        try:
+            return await asyncio.to_thread(func, *args, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        # Only to_thread() work is counted, so these are lower bounds
+        return {
+            "max_threads": self.max_workers,
+            "threads": min(self.in_flight, self.max_workers),
+            "queued": max(0, self.in_flight - self.max_workers),
+            "calls": self.calls,
+        }
+
+
+workers = WorkerThreads()
+to_thread = workers.run
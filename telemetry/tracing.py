@@ -0,0 +1,262 @@
+"""Lightweight per-request phase tracing and an opt-in profiler.
+
+TracingMiddleware starts a Trace for every HTTP request; code marks its
+phases with `with span("history"):`, or a whole function with @traced, which
+costs one context variable lookup when no trace is active (CLI runs,
+background tasks started outside a request). Spans opened inside another
+span are nested; the response gets a Server-Timing header with the total
+time per top-level phase, so no time is counted twice, plus the SQLite time
+and the request total, e.g.
+
+    Server-Timing: history;dur=0.41, llm;dur=812.3, db;dur=1.92, total;dur=820.5
+
+Headers go out before a streamed body, so there it only covers the phases
+finished by the first byte; the trace file has the complete picture.
+
+With AI_STORY_TRACE_FILE set, every finished request (or a sampled
+AI_STORY_TRACE_SAMPLE fraction of them) is appended to that file as one
+JSON line with all of its spans, nested ones included with their depth.
+
+With AI_STORY_PROFILING=1 a request carrying "X-Profile: 1" (or ?profile=1)
+runs under cProfile; the pstats file is written to AI_STORY_PROFILE_DIR and
+named in the X-Profile response header. cProfile sees everything the event
+loop thread does meanwhile, so profile one request at a time, and only one
+profile runs at once.
+"""
+
+import cProfile
+import functools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+TRACE_FILE = os.environ.get("AI_STORY_TRACE_FILE")
+TRACE_SAMPLE = float(os.environ.get("AI_STORY_TRACE_SAMPLE", "1.0"))
+PROFILING = os.environ.get("AI_STORY_PROFILING", "0").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.environ.get("AI_STORY_PROFILE_DIR", "profiles")
+
+
+class Trace:
+    """Spans recorded during one request, as (name, start, duration, depth)
+    with times in seconds; depth 0 is a top-level span."""
+
+    __slots__ = ("start", "spans")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float, float, int]] = []
+
+    def totals(self) -> Dict[str, float]:
+        """Total seconds per top-level span name, in order of first appearance."""
+        totals: Dict[str, float] = {}
+        for name, _, duration, depth in self.spans:
+            if depth == 0:
+                totals[name] = totals.get(name, 0.0) + duration
+        return totals
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+# Spans open in the current context; copied into tasks and to_thread calls
+_depth: ContextVar[int] = ContextVar("span_depth", default=0)
+
+# Set to [0.0] to add up the seconds the current context spends in SQLite
+# (statements, fetches and commits); recorded by db.database's cursors
+query_time: ContextVar[Optional[List[float]]] = ContextVar("query_time", default=None)
+
+
+class span:
+    """Time a block as a named phase of the current request's trace."""
+
+    __slots__ = ("name", "trace", "start", "depth")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.depth = _depth.get()
+            _depth.set(self.depth + 1)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.trace is not None:
+            end = time.perf_counter()
+            # set, not reset: generators may exit in another context
+            _depth.set(self.depth)
+            self.trace.spans.append(
+                (self.name, self.start - self.trace.start, end - self.start, self.depth)
+            )
+        return False
+
+
+F = TypeVar("F", bound=Callable)
+
+
+def traced(func: F) -> F:
+    """Record every call of func as a span named after it."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def server_timing(trace: Trace, db_seconds: float) -> str:
+    parts = [
+        f"{name};dur={seconds * 1000:.2f}" for name, seconds in trace.totals().items()
+    ]
+    parts.append(f"db;dur={db_seconds * 1000:.2f}")
+    parts.append(f"total;dur={(time.perf_counter() - trace.start) * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class TraceSink:
+    """Appends finished traces to a JSONL file."""
+
+    def __init__(self, path: Optional[str] = TRACE_FILE, sample: float = TRACE_SAMPLE):
+        self.path = path
+        self.sample = sample
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def write(self, record: dict):
+        if not self.enabled or random.random() >= self.sample:
+            return
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+sink = TraceSink()
+
+
+class Profiler:
+    """One cProfile run at a time, dumped to PROFILE_DIR."""
+
+    def __init__(self, enabled: bool = PROFILING, directory: str = PROFILE_DIR):
+        self.enabled = enabled
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def start(self) -> Optional[Tuple[cProfile.Profile, str]]:
+        """Start profiling, or return None if disabled or already running."""
+        if not self.enabled or not self._lock.acquire(blocking=False):
+            return None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(
+                self.directory,
+                f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof",
+            )
+            profile = cProfile.Profile()
+            profile.enable()
+        except Exception:
+            self._lock.release()
+            raise
+        return profile, path
+
+    def stop(self, profile: cProfile.Profile, path: str):
+        try:
+            profile.disable()
+            profile.dump_stats(path)
+        finally:
+            self._lock.release()
+
+
+profiler = Profiler()
+
+
+def _wants_profile(scope) -> bool:
+    for key, value in scope.get("headers", []):
+        if key == b"x-profile" and value.strip() in (b"1", b"true"):
+            return True
+    query = scope.get("query_string", b"")
+    return b"profile=1" in query.split(b"&")
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware adding Server-Timing, the JSONL sink and profiling."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace = Trace()
+        db_time = [0.0]
+        trace_token = _current.set(trace)
+        db_token = query_time.set(db_time)
+        status = 500
+        profiling = profiler.start() if _wants_profile(scope) else None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (b"server-timing", server_timing(trace, db_time[0]).encode())
+                )
+                if profiling is not None:
+                    headers.append((b"x-profile", profiling[1].encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiling is not None:
+                profiler.stop(*profiling)
+            _current.reset(trace_token)
+            query_time.reset(db_token)
+            if sink.enabled:
+                route = scope.get("route")
+                sink.write(
+                    {
+                        "ts": time.time(),
+                        "method": scope.get("method"),
+                        "path": scope.get("path"),
+                        "route": getattr(route, "path", None),
+                        "status": status,
+                        "duration_ms": round(
+                            (time.perf_counter() - trace.start) * 1000, 3
+                        ),
+                        "db_ms": round(db_time[0] * 1000, 3),
+                        "spans": [
+                            {
+                                "name": name,
+                                "start_ms": round(start * 1000, 3),
+                                "duration_ms": round(duration * 1000, 3),
+                                "depth": depth,
+                            }
+                            for name, start, duration, depth in trace.spans
+                        ],
+                    }
+                )
@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+
+from agents.singleflight import FlightCancelled, SingleFlight
+
+
+async def generation(chunks, started: asyncio.Event, release: asyncio.Event):
+    yield chunks[0]
+    started.set()
+    await release.wait()
+    for chunk in chunks[1:]:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    async def test_leader_disconnect_still_completes_the_flight(self):
+        flights = SingleFlight(enabled=True)
+        started, release = asyncio.Event(), asyncio.Event()
+        done = []
+
+        async def on_done(text):
+            done.append(text)
+
+        source = lambda: generation(["a", "b", "c"], started, release)
+        leader_chunks, leader = flights.join("key", source, on_done)
+        follower_chunks, follower_leads = flights.join("key", source, on_done)
+        self.assertTrue(leader)
+        self.assertFalse(follower_leads)
+
+        # The leader reads one chunk and leaves before the follower has read
+        # anything; the follower was counted when it joined
+        self.assertEqual(await leader_chunks.__anext__(), "a")
+        await started.wait()
+        await leader_chunks.aclose()
+        follower = asyncio.create_task(self.collect(follower_chunks))
+        await asyncio.sleep(0)
+        release.set()
+
+        self.assertEqual(await follower, "abc")
+        self.assertEqual(done, ["abc"])
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    async def test_cancelled_generation_fails_followers_without_cancelling(self):
+        flights = SingleFlight(enabled=True)
+        started, release = asyncio.Event(), asyncio.Event()
+
+        chunks, _ = flights.join(
+            "key", lambda: generation(["a", "b"], started, release)
+        )
+        self.assertEqual(await chunks.__anext__(), "a")
+        await started.wait()
+        # E.g. the server shutting down while the follower still waits
+        flights._flights["key"].task.cancel()
+        await asyncio.sleep(0)
+
+        with self.assertRaises(FlightCancelled):
+            await chunks.__anext__()
+
+    async def test_last_subscriber_leaving_cancels_without_saving(self):
+        flights = SingleFlight(enabled=True)
+        started, release = asyncio.Event(), asyncio.Event()
+        done = []
+
+        async def on_done(text):
+            done.append(text)
+
+        chunks, _ = flights.join(
+            "key", lambda: generation(["a", "b"], started, release), on_done
+        )
+        self.assertEqual(await chunks.__anext__(), "a")
+        await chunks.aclose()
+        release.set()
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(done, [])
+        self.assertEqual(flights.stats()["in_flight"], 0)
+
+    async def test_disabled_calls_on_done_after_the_stream(self):
+        flights = SingleFlight(enabled=False)
+        started, release = asyncio.Event(), asyncio.Event()
+        release.set()
+        done = []
+
+        async def on_done(text):
+            done.append(text)
+
+        chunks, leader = flights.join(
+            "key", lambda: generation(["a", "b"], started, release), on_done
+        )
+        self.assertTrue(leader)
+        self.assertEqual(await self.collect(chunks), "ab")
+        self.assertEqual(done, ["ab"])
+
+    @staticmethod
+    async def collect(chunks) -> str:
+        return "".join([chunk async for chunk in chunks])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from agents.manager import StreamCleaner, clean_reply
+
+
+def stream(chunks):
+    cleaner = StreamCleaner()
+    text = "".join(cleaner.feed(chunk) for chunk in chunks)
+    return text + cleaner.finish()
+
+
+class StreamCleanerTest(unittest.TestCase):
+    def assertStreamsLikeCleanReply(self, raw: str):
+        # Whole, and split between every character
+        self.assertEqual(stream([raw]), clean_reply(raw))
+        self.assertEqual(stream(list(raw)), clean_reply(raw))
+
+    def test_leading_quote_kept_when_the_reply_is_not_wrapped(self):
+        self.assertEqual(stream(['"Hi" she said']), '"Hi" she said')
+        self.assertStreamsLikeCleanReply('"Hi" she said')
+
+    def test_trailing_quote_kept_when_the_reply_is_not_wrapped(self):
+        self.assertEqual(stream(['say "go"']), 'say "go"')
+        self.assertStreamsLikeCleanReply('say "go"')
+
+    def test_wrapping_quotes_stripped(self):
+        self.assertEqual(stream(['  "Hello', ' there" ']), "Hello there")
+        self.assertStreamsLikeCleanReply(' "Hello there"\n')
+
+    def test_text_streams_before_the_end(self):
+        cleaner = StreamCleaner()
+        self.assertEqual(cleaner.feed("Hello "), "Hello")
+        self.assertEqual(cleaner.feed("world "), " world")
+        self.assertEqual(cleaner.finish(), "")
+
+    def test_think_blocks(self):
+        for raw in (
+            "<think>plan</think> Hi there",
+            '<think>plan</think>"Quoted"',
+            "Hi <think>never closed",
+            "a <thi",
+        ):
+            self.assertStreamsLikeCleanReply(raw)
+
+
+if __name__ == "__main__":
+    unittest.main()